@@ -77,6 +77,13 @@ def get_system_prompt_addendum():
 
 def route_intent(llm_response):
     """Aggressive parser that hunts for the first valid JSON object."""
+    call = parse_intent(llm_response)
+    if call and call["tool"] in registry:
+        return _launch_sequence(call["tool"], call["args"], registry)
+    return None
+
+def parse_intent(llm_response):
+    """The {"tool", "args"} call in a reply (without running it), or None."""
     if not llm_response: return None
     
     # A. Strip <think> blocks (cleaner input)
@@ -97,13 +104,10 @@ def route_intent(llm_response):
         try: data = ast.literal_eval(candidate)
         except: pass
 
-    # D. Execution Decision
-    if isinstance(data, dict):
-        tool = data.get("tool")
-        args = data.get("args", {})
-        if tool in registry:
-            return _launch_sequence(tool, args, registry)
-            
+    # D. Shape Check
+    if isinstance(data, dict) and data.get("tool"):
+        return {"tool": data.get("tool"), "args": data.get("args", {})}
+
     return None
 
 # --- 3. AGGRESSIVE LAUNCH SEQUENCE ---
@@ -5,14 +5,28 @@ import os
 import json
 import numpy as np
 import re
+import threading
+import itertools
+import signal
+import time
 
 # --- IMPORTS ---
-try:
-    import mlx.core as mx
-    from mlx_lm import load, generate
-except ImportError:
-    print("❌ Error: MLX not installed. Run: pip install mlx mlx-lm")
-    sys.exit(1)
+# Model libraries (mlx / torch) are imported by the selected backend, not here.
+from backends import make_backend
+from engine import Engine, EngineThread, PRIORITIES, INTERACTIVE, BACKGROUND_STRIDE, STARVATION_STEPS
+from context import ContextManager, make_summarizer, strip_think, DEFAULT_BUDGET
+from profiles import route_profile
+from streaming import ThinkFilter, FrameWriter
+import metrics
+import sessions
+import models
+import memory
+import responses
+import batch
+import dispatch
+import prefixcache
+from memory import format_memories
+import daemon
 
 try:
     import agent
@@ -33,32 +47,36 @@ def _load_meta(weights_npz: str):
         print(f"Error reading NPZ: {e}")
         sys.exit(1)
 
-def load_from_npz(weights: str):
-    print(f"🔹 Reading manifest: {weights}")
-    meta = _load_meta(weights)
-    repo = meta.get("repo")
-    if not repo:
-        print("Error: Could not find 'repo' in weights metadata.")
-        sys.exit(1)
-    
-    print(f"🔹 Loading Model from Repo: {repo}")
-    model, tokenizer = load(repo)
-    return model, tokenizer
+def load_from_npz(weights: str, use_draft: bool = True, engine_override: str = None, report=None,
+                  overrides: dict = None, variant: str = None, headroom_gb: float = None):
+    """Reads the manifest, picks a model variant that fits in memory and loads its backend."""
+    if os.path.exists(weights):
+        print(f"🔹 Reading manifest: {weights}")
+        meta = _load_meta(weights)
+    elif engine_override == "fake":
+        meta = {}  # the fake backend needs no weights
+    else:
+        raise FileNotFoundError(f"Weights file not found: {weights}")
+    if engine_override:
+        meta["engine"] = engine_override
+    meta.update(overrides or {})
+    meta, reason = models.choose_variant(meta, models.available_memory(), headroom_gb,
+                                         use_draft=use_draft, name=variant)
+    if reason:
+        print(f"🔹 Model variant {meta['variant']} ({meta.get('repo')}): {reason}")
+    meta = models.localize(meta)
+    if meta.get("repo_path"):
+        print(f"🔹 Using local weights: {meta['repo_path']}")
 
-# --- CHAT LOOP ---
-def chat_main(args):
-    # 1. Load Model
-    if not os.path.exists(args.weights):
-        print(f"❌ Error: Weights file not found: {args.weights}")
-        return
+    backend = make_backend(meta, use_draft=use_draft)
+    if backend.name != "fake" and not meta.get("repo"):
+        raise ValueError("Could not find 'repo' in weights metadata.")
+    if report: report(15, f"loading {backend.name} weights")
+    backend.load()
+    return backend, meta
 
-    try:
-        model, tokenizer = load_from_npz(args.weights)
-    except Exception as e:
-        print(f"❌ Load Failed: {e}")
-        return
-
-    # 2. Get Tools from Agent
+# --- SYSTEM PROMPT ---
+def build_system_prompt():
     try:
         if hasattr(agent, "get_system_prompt_addendum"):
             tool_instructions = agent.get_system_prompt_addendum()
@@ -67,8 +85,7 @@ def chat_main(args):
     except Exception:
         tool_instructions = ""
 
-    # 3. Construct System Prompt
-    system_prompt = (
+    return (
         "You are Amber, a helpful AI assistant residing on a Mac. "
         "You can control the computer using the tools below. "
         "To use a tool, reply ONLY with a JSON object describing the action. "
@@ -79,95 +96,847 @@ def chat_main(args):
         'Amber: {"tool": "calclaunch", "args": {"mode": "standard"}}\n'
     )
 
-    messages = [{"role": "system", "content": system_prompt}]
-    print("\n✅ Amber Ready. (Type 'exit' to quit)\n")
-
-    # 4. Main Loop
-    while True:
+def load_engine(args, system_prompt, report, overrides=None):
+    """Runs on the engine thread: backend load + system-prompt cache."""
+    report(5, "reading manifest")
+    # The prefix trees come out of the same memory as the weights: the variant choice counts them
+    budget = getattr(args, "prefix_cache_mb", prefixcache.BUDGET_MB)
+    overrides = {**(overrides or {}), "prefix_cache_mb": budget or 0}
+    backend, meta = load_from_npz(args.weights, use_draft=not args.no_draft,
+                                  engine_override=args.engine, report=report, overrides=overrides,
+                                  variant=getattr(args, "variant", None),
+                                  headroom_gb=getattr(args, "headroom", None))
+    # Command-line sampling flags override the manifest's chat profile
+    chat = {k: getattr(args, k, None) for k in ("temperature", "top_p", "top_k", "max_tokens")}
+    chat = {k: v for k, v in chat.items() if v is not None}
+    if chat:
+        meta.setdefault("profiles", {}).setdefault("chat", {}).update(chat)
+    engine = Engine(backend)
+    backend.prefix_cache = prefixcache.open_prefix_cache(backend, budget)
+    if not getattr(args, "no_dispatcher", False):
+        report(75, "loading dispatcher")
         try:
+            engine.dispatcher_backend = dispatch.load_backend(meta, backend)
+            if engine.dispatcher_backend is not None:
+                engine.dispatcher_backend.prefix_cache = prefixcache.open_prefix_cache(engine.dispatcher_backend, budget)
+        except Exception as e:
+            print(f"⚠️  Dispatcher unavailable, every turn goes to the chat model: {e}")
+    report(85, "priming system prompt")
+
+    # Restore (or build) the system-prompt KV cache so the first turn only prefills user tokens
+    try:
+        state = engine.prime([{"role": "system", "content": system_prompt}])
+        print(f"🔹 System prompt cache: {state}")
+    except Exception as e:
+        print(f"⚠️  System prompt cache unavailable: {e}")
+    return engine
+
+# --- HOST (sessions over the shared engine thread) ---
+class ChatSession:
+    """One conversation: its own KV cache over the shared backend, plus its context."""
+    def __init__(self, runner, system_prompt, budget, log=None, memory=None, name=None):
+        self.runner = runner
+        self.system_prompt = system_prompt
+        self.engine = None
+        self.name = name
+        self.memory = memory          # memory.MemoryStore shared by every conversation, or None
+        self.started = time.time()
+        self.tool_outputs = {}        # tool -> hash of its latest output in this conversation
+        self.lock = threading.Lock()  # one turn at a time per conversation
+        self.log = log                # sessions.SessionLog for persistent conversations
+        self.history = log.records() if log else []  # replayed once the tokenizer is loaded
+
+        # Summaries join the engine's batch like any other generation
+        self.context = ContextManager(system_prompt, lambda text: runner.engine.count_tokens(text),
+                                      budget=budget, summarize=make_summarizer(runner.complete),
+                                      journal=log.append if log else None)
+
+    def _open(self, shared):
+        """
+        Engine thread: separate cache, same weights. A resumed session maps its own KV
+        snapshot back in; otherwise the system prompt comes from the shared snapshot.
+        """
+        engine = Engine(shared.backend)
+        if self.log:
+            restored = engine.load_snapshot(self.log.kv_path(engine.backend.cache_ext))
+            if restored:
+                print(f"🔹 Session '{self.log.name}': KV snapshot restored ({restored} tokens)")
+                return engine
+        engine.prime([{"role": "system", "content": self.system_prompt}])
+        return engine
+
+    def save(self):
+        """Persist the KV cache next to the log (waits for the engine thread)."""
+        if not (self.log and self.engine): return
+        def write(_):
+            path = self.log.kv_path(self.engine.backend.cache_ext)
+            if self.engine.save_snapshot(path):
+                sessions.prune(self.log.root, max_bytes=sessions.KV_LIMIT, kv_only=True, keep=(self.log.name,))
+        with self.lock:
+            self.runner.submit(write).result()
+
+    def _ensure_open(self):
+        if self.engine is None:
+            self.engine = self.runner.submit(self._open).result()
+            if self.history:
+                self.context.restore(self.history)
+                self.history = []
+
+    def replay(self, user_content, reply, emit, profile="chat"):
+        """Answer without the chat model (response cache, dispatcher): same events and context update."""
+        self._ensure_open()
+        emit({"event": "status", "state": "running"})
+        emit({"event": "token", "text": reply})
+        self.context.add("user", user_content)
+        self.context.add("assistant", reply)
+        if self.memory and profile == "chat":
+            self.memory.remember(self.name, user_content, strip_think(reply))
+
+    def generate(self, user_content, emit, cancel, profile="chat", max_tokens=None, stop=None, sampling=None,
+                 priority=INTERACTIVE, thinking=None):
+        """Stream one reply into `emit` and update the context. Returns (reply, turn stats)."""
+        self._ensure_open()
+        emit({"event": "status", "state": "running"})
+
+        self.context.add("user", user_content)
+        messages, recall = self.context.messages(), {}
+        if self.memory and profile == "chat":
+            # Long-term memory goes into this turn's prompt only, after the cached prefix
+            t0 = time.perf_counter()
+            hits = self.memory.search(user_content, exclude_session=self.name, since=self.started)
+            recall = {"memories": len(hits), "memory_s": round(time.perf_counter() - t0, 4)}
+            if hits:
+                messages[-1] = {"role": "user",
+                                "content": f"{format_memories(hits)}\n\n{messages[-1]['content']}"}
+        full_response = ""
+        # Engine keeps the KV cache between turns and only prefills the new tokens
+        for chunk in self.runner.stream(self.engine, messages, profile=profile, max_tokens=max_tokens,
+                                        stop=stop, cancel=cancel, priority=priority, thinking=thinking,
+                                        **(sampling or {})):
+            full_response += chunk
+            emit({"event": "token", "text": chunk})
+
+        # History keeps the answer only; reasoning traces are dropped by the context manager
+        self.context.add("assistant", full_response)
+        if self.memory and profile == "chat" and not cancel.is_set():
+            self.memory.remember(self.name, user_content, strip_think(full_response))
+        return full_response, {**self.engine.last_turn, **recall}
+
+
+class AmberHost:
+    """Serves protocol requests (see daemon.py) for the REPL, the daemon and other frontends."""
+    def __init__(self, runner, system_prompt, budget, metrics_log=None, memory=None, response_cache=None):
+        self.runner = runner
+        self.system_prompt = system_prompt
+        self.budget = budget
+        self.metrics_log = metrics_log  # metrics.MetricsLog or None
+        self.memory = memory            # memory.MemoryStore or None
+        self.response_cache = response_cache  # responses.ResponseCache or None
+        self._dispatcher = False              # dispatch.Dispatcher, None without one, False until loaded
+        self.toolset = responses.toolset_version(getattr(agent, "registry", {}))
+        self.sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, name, persist=False):
+        """In-memory conversation `name`; persistent ones are logged under sessions.SESSIONS_DIR."""
+        with self._lock:
+            if name not in self.sessions:
+                log = sessions.SessionLog(name) if persist else None
+                self.sessions[name] = ChatSession(self.runner, self.system_prompt, self.budget, log,
+                                                  memory=self.memory, name=name)
+            return self.sessions[name]
+
+    def open(self, name):
+        """Start or resume a persistent session. Returns what was found on disk."""
+        session = self.session(name, persist=True)
+        turns = sum(1 for r in session.history if r.get("type") == "turn")
+        return {"session": name, "resumed": bool(session.history), "turns": turns}
+
+    def chat(self, name, content, emit, cancel, request=None):
+        request = request or {}
+        session = self.session(name, persist=bool(request.get("persist")))
+        # Before the session lock: an earlier queued turn holds it until the weights are loaded,
+        # and the REPL keeps reading input only once it knows this turn is queued too
+        if not self.runner.ready:
+            emit({"event": "status", "state": "queued", "model": self.runner.describe()})
+        with session.lock:
+            # Simple tool dispatches skip reasoning and decode greedily (see profiles.route_profile)
+            profile = request.get("profile") or route_profile(content, getattr(agent, "registry", {}))
+            t0 = time.perf_counter()
+            history = self._history_key(session) if self.response_cache else None
+            scope = self._cache_scope(content, profile, request, history)
+            hit = self.response_cache.get(content, scope) if scope else None
+            # Short dispatches may be answered by the small dispatcher model (see dispatch.py)
+            dispatcher = self.dispatcher() if not (hit or request.get("profile")) else None
+            decision = dispatcher.decide(content, cancel) if dispatcher and dispatcher.applies(content) else None
+            if hit:
+                reply = hit.reply
+                session.replay(content, reply, emit, profile=profile)
+                turn = {"cached": True, "near": hit.near, "similarity": hit.similarity, "cache_age_s": hit.age_s,
+                        "cache_s": round(time.perf_counter() - t0, 4)}
+            elif decision and decision.route == "tool":
+                profile, reply = "tool_call", json.dumps(decision.call)
+                session.replay(content, reply, emit, profile=profile)
+                turn = {"route": "dispatcher", "confidence": decision.confidence, "dispatch_s": decision.latency_s,
+                        "dispatch_tokens": decision.tokens, "tokens": 0}
+            else:
+                reply, turn = session.generate(content, emit, cancel,
+                                               profile=profile,
+                                               max_tokens=request.get("max_tokens"),
+                                               stop=request.get("stop"),
+                                               sampling=request.get("sampling"),
+                                               priority=PRIORITIES.get(request.get("priority"), INTERACTIVE),
+                                               thinking=request.get("think"))
+                if dispatcher:
+                    turn["route"], turn["escalation"] = "chat", decision.reason if decision else "skipped"
+                    if decision: turn.update(confidence=decision.confidence, dispatch_s=decision.latency_s)
+                scope = scope or self._cache_scope(content, profile, request, history)  # model was still loading
+                if scope and not cancel.is_set() and not turn.get("memories"):
+                    self._cache_store(session, content, scope, reply)
+
+            # --- ACTION LAYER --- (off the engine thread so the batch keeps decoding)
+            tool_s = None
+            if hasattr(agent, "route_intent") and not cancel.is_set():
+                t0 = time.perf_counter()
+                tool_output = agent.route_intent(reply)
+                if tool_output:
+                    tool_s = round(time.perf_counter() - t0, 4)
+                    emit({"event": "tool", "output": tool_output})
+                    session.context.add("tool", tool_output)
+                    self._tool_ran(session, responses.tool_name(reply), tool_output)
+
+            turn = {"ts": round(time.time(), 3), "session": name, "profile": profile, **turn,
+                    "tool_s": tool_s, "cancelled": cancel.is_set()}
+            if self.metrics_log:
+                self.metrics_log.append(turn)
+            emit({"event": "metrics", **{k: v for k, v in turn.items() if k != "session"}})
+            emit({"event": "done", "text": reply, "tokens": turn.get("tokens", 0), "profile": profile,
+                  "thinking_tokens": turn.get("thinking_tokens", 0), "cancelled": cancel.is_set()})
+
+    def run_tool(self, call):
+        if not hasattr(agent, "route_intent"): return None
+        output = agent.route_intent(json.dumps(call))
+        if output: self._tool_ran(None, call.get("tool"), output)
+        return output or "Unknown tool or malformed call."
+
+    def dispatcher(self):
+        """The dispatcher once the model is loaded, or None (no dispatcher in the manifest)."""
+        if self._dispatcher is False and self.runner.ready:
+            self._dispatcher = dispatch.Dispatcher.from_engine(self.runner, self.runner.engine,
+                                                               getattr(agent, "registry", {}),
+                                                               getattr(agent, "parse_intent", lambda r: None))
+        return self._dispatcher or None
+
+    # ---- response cache
+    def _cache_scope(self, content, profile, request, history):
+        """
+        Cache scope for this request, or None if it can't be answered from the cache: only
+        greedy decodes are kept, since replaying one sample would hide the sampling.
+        """
+        engine = self.runner.engine
+        if not self.response_cache or engine is None or not responses.self_contained(content):
+            return None
+        sampling = engine.profiles.get(profile, **(request.get("sampling") or {})).sampling
+        if sampling.get("temperature", 0) > 0: return None
+        overrides = {k: request.get(k) for k in ("max_tokens", "stop", "sampling", "think")}
+        return responses.digest(profile, overrides, self.toolset, history,
+                                responses.manifest_fingerprint(engine.backend.meta, self.system_prompt))[:16]
+
+    @staticmethod
+    def _history_key(session):
+        """The conversation before this turn: after different turns the same words ask something else."""
+        turns = [(m["role"], m["content"]) for m in session.context.messages()[1:]]
+        turns += [(r.get("role"), r.get("content")) for r in session.history if r.get("type") == "turn"]
+        return responses.digest(turns)[:16]
+
+    def _cache_store(self, session, content, scope, reply):
+        """Keep the reply unless a tool it dispatches or was answered from opts out."""
+        ttl = self.response_cache.ttl
+        for name in [responses.tool_name(reply), *session.tool_outputs]:
+            meta = (getattr(agent, "registry", {}).get(name) or {}).get("meta") or {}
+            if meta.get("cache") is False: return
+            if meta.get("cache_ttl") is not None: ttl = min(ttl, float(meta["cache_ttl"]))
+        if reply.strip():
+            self.response_cache.put(content, scope, reply, deps=dict(session.tool_outputs), ttl=ttl)
+
+    def _tool_ran(self, session, name, output):
+        """A tool produced `output`: cached answers built on an older output are dropped."""
+        if not (self.response_cache and name): return
+        h = self.response_cache.tool_result(name, output)
+        if session is not None:
+            session.tool_outputs[name] = h
+
+    def thinking_tokens(self):
+        return sum(s.engine.thinking_total for s in list(self.sessions.values()) if s.engine)
+
+    def status(self):
+        engine = self.runner.engine
+        return {"state": "ready" if self.runner.ready else "loading",
+                "model": self.runner.describe(), "sessions": len(self.sessions),
+                "variant": engine.backend.meta.get("variant") if engine else None,
+                "response_cache": self.response_cache.stats() if self.response_cache else None,
+                "dispatcher": self.dispatcher().describe() if self.dispatcher() else None,
+                "prefix_cache": engine.backend.prefix_cache.stats() if engine and engine.backend.prefix_cache else None,
+                "thinking_tokens": self.thinking_tokens(), **self.runner.load()}
+
+    def reset(self, name):
+        with self._lock:
+            self.sessions.pop(name, None)
+
+    def close(self, name):
+        """Drop a conversation from memory; persistent ones save their KV cache first."""
+        session = self.sessions.get(name)
+        if session and session.log and self.runner.ready:
             try:
-                raw_input = input("User: ").strip()
-            except EOFError:
-                break
+                session.save()
+            except Exception as e:
+                print(f"⚠️  Could not save session '{name}': {e}")
+        self.reset(name)
+
+    def close_all(self):
+        for name in list(self.sessions): self.close(name)
+
+    def forget_shared_kv(self):
+        """Drop the KV shared across conversations (prefix trees, idle dispatcher engines)."""
+        engine = self.runner.engine
+        if engine is None: return
+        for backend in (engine.backend, getattr(engine, "dispatcher_backend", None)):
+            if backend is not None and backend.prefix_cache is not None:
+                backend.prefix_cache.clear()
+        if self._dispatcher:
+            self._dispatcher.forget()
 
-            if not raw_input: continue
-            if raw_input.lower() in ["exit", "quit"]: break
-
-            # --- "SHOW THINK" TOGGLE LOGIC ---
-            show_thoughts = False
-            user_content = raw_input
-            
-            if raw_input.lower().startswith("show think"):
-                show_thoughts = True
-                user_content = re.sub(r"^show think\s*", "", raw_input, flags=re.IGNORECASE).strip()
-
-            messages.append({"role": "user", "content": user_content})
-
-            # --- GENERATION ---
-            print("Amber: ", end="", flush=True)
-            prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-            
-            full_response = ""
-            
-            # Variables for suppressing thought output
-            output_buffer = ""
-            is_thinking = False
-            
-            for chunk in generate(model, tokenizer, prompt=prompt, verbose=False, max_tokens=1024):
-                full_response += chunk
-                
-                if show_thoughts:
-                    # MODE A: Print everything (Raw)
-                    print(chunk, end="", flush=True)
-                else:
-                    # MODE B: Suppress <think> blocks
-                    output_buffer += chunk
-                    
-                    if not is_thinking:
-                        if "<think>" in output_buffer:
-                            pre, post = output_buffer.split("<think>", 1)
-                            print(pre, end="", flush=True)
-                            print("☁️ ", end="", flush=True) # Visual indicator
-                            output_buffer = post
-                            is_thinking = True
-                        else:
-                            if not any(output_buffer.endswith(x) for x in ["<", "<t", "<th", "<thi", "<thin", "<think"]):
-                                print(output_buffer, end="", flush=True)
-                                output_buffer = ""
-                    else:
-                        if "</think>" in output_buffer:
-                            _, post = output_buffer.split("</think>", 1)
-                            print("\r" + " " * 4 + "\r", end="", flush=True) # Clear indicator
-                            output_buffer = post
-                            is_thinking = False
-                            print(output_buffer, end="", flush=True)
-                            output_buffer = ""
-                            
+# --- CONSOLE RENDERING ---
+class ConsoleRenderer:
+    """Prints one request's events the way the REPL always has (think blocks hidden unless asked)."""
+    def __init__(self, show_thoughts=False, stats=False):
+        self.show_thoughts = show_thoughts
+        self.stats = stats
+        self.queued = False
+        self.started = False
+        self.metrics = None
+        # Think blocks are filtered incrementally; output goes out once per frame, not per token
+        self.think_filter = ThinkFilter()
+        self.out = FrameWriter()
+
+    def __call__(self, ev):
+        kind = ev.get("event")
+        if kind != "token":
+            self._drain()
+        if kind == "status" and ev.get("state") == "queued":
+            self.queued = True
+            print(f"⏳ Queued — {ev.get('model', 'model loading')}")
+        elif kind == "status" and ev.get("state") == "running":
+            print(("\n" if self.queued else "") + "Amber: ", end="", flush=True)
+            self.started = True
+        elif kind == "token":
+            self._token(ev["text"])
+        elif kind == "tool":
+            self._end_line()
+            print(f"⚙️  {ev['output']}")
+        elif kind == "metrics":
+            self.metrics = ev
+        elif kind == "done":
+            if ev.get("cancelled"): print(" ⏹️", end="")
+            if self.show_thoughts and ev.get("thinking_tokens"):
+                print(f" ☁️ {ev['thinking_tokens']} thinking tokens", end="")
+            self._end_line()
+            if self.stats and self.metrics:
+                print(metrics.format_turn(self.metrics))
+            if self.queued:
+                print("User: ", end="", flush=True) # restore the prompt we printed over
+        elif kind == "error":
+            self._end_line()
+            print(f"❌ Error: {ev.get('message')}")
+        elif kind == "closed":
+            self._end_line()
+            print("❌ Lost connection to the Amber daemon.")
+
+    def _end_line(self):
+        if self.started:
             print() # Final newline
+            self.started = False
 
-            messages.append({"role": "assistant", "content": full_response})
+    def _drain(self):
+        """Emit anything held back (a partial tag, the current frame) before other output."""
+        if not self.show_thoughts:
+            self._render(self.think_filter.flush())
+        self.out.flush()
 
-            # --- ACTION LAYER ---
-            if hasattr(agent, "route_intent"):
-                tool_output = agent.route_intent(full_response)
-                if tool_output:
-                    print(f"⚙️  {tool_output}")
-            
-        except KeyboardInterrupt:
-            print("\nGoodbye.")
-            break
-        except Exception as e:
-            print(f"\n❌ Error: {e}")
+    def _token(self, chunk):
+        if self.show_thoughts:
+            # MODE A: Print everything (Raw)
+            self.out.write(chunk)
+            return
+        # MODE B: Suppress <think> blocks
+        self._render(self.think_filter.feed(chunk))
+
+    def _render(self, segments):
+        for kind, text in segments:
+            if kind == "text":
+                self.out.write(text)
+            elif kind == "think_start":
+                self.out.write("☁️ ") # Visual indicator
+            elif kind == "think_end":
+                self.out.write("\r" + " " * 4 + "\r") # Clear indicator
+
+# --- FAST PATH (served while the model loads) ---
+HELP_TEXT = (
+    "Commands: 'status' (model loading), 'tools' (list tools), "
+    "'{\"tool\": ..., \"args\": {...}}' (run a tool directly), 'show think <msg>', 'exit'"
+)
+
+# --- CHAT LOOP ---
+class Repl:
+    """Console front end. Talks the daemon protocol to a local host or a running daemon."""
+    def __init__(self, conn, stats=False, session=None):
+        self.conn = conn
+        self.stats = stats          # print per-turn metrics after each reply
+        self.session = session      # persistent session name (--resume)
+        self.conn.on_event = self._on_event
+        self.waiting = {}   # request id -> (renderer, first event, done)
+        self.pending = []   # done events of turns queued while loading
+        self._ids = itertools.count(1)
+
+    def _on_event(self, ev):
+        if ev.get("event") == "closed":
+            for rid in list(self.waiting): self._on_event({**ev, "id": rid, "event": "error",
+                                                             "message": "lost connection to the Amber daemon"})
+            return
+        slot = self.waiting.get(ev.get("id"))
+        if not slot: return
+        renderer, first, done = slot
+        renderer(ev)
+        first.set()
+        if ev.get("event") in ("done", "error"):
+            self.waiting.pop(ev["id"], None)
+            done.set()
+
+    def request(self, renderer, **req):
+        rid = f"c{next(self._ids)}"
+        slot = (renderer, threading.Event(), threading.Event())
+        self.waiting[rid] = slot
+        self.conn.send({"id": rid, **req})
+        return rid, slot
+
+    def fast_path(self, raw_input):
+        """Handles commands that don't need the model. Returns True if handled."""
+        low = raw_input.lower()
+        if low == "help":
+            print(HELP_TEXT)
+        elif low == "status":
+            def show(ev):
+                if ev.get("event") != "status": return
+                print(f"🔹 {ev.get('model')}")
+                pc = ev.get("prefix_cache")
+                if pc:
+                    print(f"🔹 Shared prefixes: {pc['hit_ratio']:.0%} hit ratio, {pc['resident_mb']:.0f}/"
+                          f"{pc['budget_mb']} MB in the tree, {pc['dedup_mb']:.0f} MB deduplicated "
+                          f"(sessions keep their own copies)")
+            _, (_, _, done) = self.request(show, op="status")
+            done.wait(5)
+        elif low == "tools":
+            print("🔹 Tools: " + ", ".join(sorted(getattr(agent, "registry", {}))))
+        elif raw_input.startswith("{") and '"tool"' in raw_input:
+            # A literal tool call needs no generation
+            try:
+                call = json.loads(raw_input)
+            except ValueError:
+                print("⚙️  Unknown tool or malformed call.")
+                return True
+            _, (_, _, done) = self.request(ConsoleRenderer(), op="tool", call=call)
+            done.wait()
+        else:
+            return False
+        return True
+
+    def open_session(self):
+        def show(ev):
+            if ev.get("event") == "status" and ev.get("resumed"):
+                print(f"🔹 Resumed session '{ev['session']}' ({ev['turns']} messages)")
+            elif ev.get("event") == "status":
+                print(f"🔹 New session '{ev['session']}' (saved on exit)")
+            elif ev.get("event") == "error":
+                print(f"❌ {ev.get('message')}")
+        _, (_, _, done) = self.request(show, op="open", session=self.session)
+        done.wait(5)
+
+    def close_session(self):
+        print(f"💾 Saving session '{self.session}'…")
+        _, (_, _, done) = self.request(lambda ev: None, op="close", session=self.session)
+        done.wait()
+
+    def run(self):
+        if self.session:
+            self.open_session()
+        print("\n✅ Amber Ready. (Type 'help' for commands, 'exit' to quit)\n")
+        while True:
+            try:
+                try:
+                    raw_input = input("User: ").strip()
+                except EOFError:
+                    break
+
+                if not raw_input: continue
+                if raw_input.lower() in ["exit", "quit"]: break
+                if self.fast_path(raw_input): continue
+
+                # --- "SHOW THINK" TOGGLE LOGIC ---
+                show_thoughts = False
+                user_content = raw_input
+
+                if raw_input.lower().startswith("show think"):
+                    show_thoughts = True
+                    user_content = re.sub(r"^show think\s*", "", raw_input, flags=re.IGNORECASE).strip()
+
+                renderer = ConsoleRenderer(show_thoughts, stats=self.stats)
+                extra = {"session": self.session, "persist": True} if self.session else {}
+                rid, (_, first, done) = self.request(renderer, op="chat", content=user_content, **extra)
+                first.wait()
+                if renderer.queued:
+                    # Generation waits for the weights; keep accepting input meanwhile
+                    self.pending.append(done)
+                    continue
+                try:
+                    done.wait()
+                except KeyboardInterrupt:
+                    self.conn.send({"op": "cancel", "target": rid})  # stop at the next token, keep the session
+                    done.wait()
+
+            except KeyboardInterrupt:
+                print("\nGoodbye.")
+                break
+            except Exception as e:
+                print(f"\n❌ Error: {e}")
+
+        # Don't drop requests the user queued before the weights were ready
+        pending = [d for d in self.pending if not d.is_set()]
+        if pending:
+            print(f"⏳ Finishing {len(pending)} queued request(s)… (Ctrl-C to abort)")
+            try:
+                for d in pending: d.wait()
+            except KeyboardInterrupt:
+                pass
+        if self.session:
+            self.close_session()
+        self.conn.close()
+
+
+def start_host(args, overrides=None):
+    """Starts loading the model in the background and returns a host for it."""
+    system_prompt = build_system_prompt()
+    runner = EngineThread(lambda report: load_engine(args, system_prompt, report, overrides),
+                          max_batch=args.max_batch, background_stride=args.background_stride,
+                          starvation_steps=args.starvation_steps)
+
+    def on_loaded(fut):
+        if fut.exception():
+            print(f"\n❌ Load Failed: {fut.exception()}")
+        else:
+            print(f"\n✅ Model ready ({runner.load_seconds:.1f}s)")
+    runner.loaded.add_done_callback(on_loaded)
+    return AmberHost(runner, system_prompt, args.context_budget,
+                     metrics_log=metrics.open_log(getattr(args, "metrics", None)),
+                     memory=memory.open_store(getattr(args, "memory", None)),
+                     response_cache=responses.open_cache(getattr(args, "response_cache", None),
+                                                         ttl=getattr(args, "cache_ttl", responses.DEFAULT_TTL),
+                                                         near=getattr(args, "near_duplicates", False)))
+
+
+def chat_main(args):
+    # Thin client if a daemon already holds the model
+    if not args.local and daemon.ping(daemon.SOCKET_PATH):
+        print(f"🔹 Connected to Amber daemon ({daemon.SOCKET_PATH})")
+        Repl(daemon.SocketConnection(daemon.SOCKET_PATH), stats=args.stats, session=args.resume).run()
+        return
+
+    # 1. Load Model in the background; the REPL is usable right away
+    host = start_host(args)
+    Repl(daemon.LocalConnection(host), stats=args.stats, session=args.resume).run()
+
+    engine = host.runner.engine
+    if engine is not None and engine.has_draft and engine.spec_total["tokens"]:
+        t = engine.spec_total
+        print(f"🔹 Speculative decoding: {t['draft_accepted']}/{t['tokens']} tokens accepted from draft "
+              f"({engine.acceptance_rate():.0%})")
+    if host.thinking_tokens():
+        print(f"🔹 Reasoning: {host.thinking_tokens()} thinking tokens this session")
+    host.runner.shutdown()
+
+
+def stream_main(args):
+    """
+    `ai.py --stream`: the daemon protocol (see daemon.py) as JSON lines on stdin/stdout,
+    for the GUI and other frontends. A line that isn't JSON is sent as a chat message.
+    Unsolicited events carry "id": null. EOF waits for running requests, then exits.
+    """
+    out = sys.stdout
+    sys.stdout = sys.stderr  # model/tool logging must never interleave with protocol lines
+    wlock = threading.Lock()
+    active = set()
+    idle = threading.Condition(wlock)
+
+    def write(ev):
+        line = json.dumps(ev)
+        with wlock:
+            out.write(line + "\n")
+            out.flush()
+            if ev.get("event") in ("done", "error", "closed"):
+                active.discard(ev.get("id"))
+                if ev.get("event") == "closed": active.clear()
+                idle.notify_all()
+
+    host = None
+    if not args.local and daemon.ping(daemon.SOCKET_PATH):
+        conn = daemon.SocketConnection(daemon.SOCKET_PATH, on_event=write)
+        write({"id": None, "event": "status", "state": "ready", "model": f"daemon {daemon.SOCKET_PATH}"})
+    else:
+        host = start_host(args)
+        conn = daemon.LocalConnection(host, on_event=write)
+        write({"id": None, "event": "status", "state": "loading", "model": host.runner.describe()})
+        host.runner.loaded.add_done_callback(lambda fut: write(
+            {"id": None, "event": "status", "state": "failed" if fut.exception() else "ready",
+             "model": host.runner.describe()}))
+
+    ids = itertools.count(1)
+    for line in sys.stdin:
+        line = line.strip()
+        if not line: continue
+        try:
+            req = json.loads(line)
+        except ValueError:
+            req = {"op": "chat", "content": line}
+        if not isinstance(req, dict):
+            write({"id": None, "event": "error", "message": "expected a JSON object"})
+            continue
+        req.setdefault("id", f"in{next(ids)}")
+        with wlock:
+            active.add(req["id"])   # every op ends in done/error
+        conn.send(req)
+
+    with wlock:
+        idle.wait_for(lambda: not active)
+    conn.close()
+    if host:
+        host.close_all()
+        host.runner.shutdown()
+
+
+def serve_main(args):
+    """`ai.py serve`: keep one model resident and share it over a Unix socket."""
+    host = start_host(args)
+    try:
+        server = daemon.AmberServer(daemon.SOCKET_PATH, host)
+    except Exception as e:
+        print(f"❌ {e}")
+        host.runner.shutdown()
+        return
+    print(f"🔹 Amber daemon listening on {daemon.SOCKET_PATH}")
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))  # clean up the socket on kill
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nGoodbye.")
+    finally:
+        server.server_close()
+        host.close_all()  # persistent sessions keep their KV snapshots
+        host.runner.shutdown()
+
+
+def sessions_main(args):
+    """`ai.py sessions [list|prune]`: persistent conversations on disk."""
+    if args.action == "prune":
+        if args.max_size is None and args.older_than is None:
+            print("❌ prune needs --max-size and/or --older-than")
+            return
+        max_bytes = sessions.parse_size(args.max_size) if args.max_size else None
+        removed = sessions.prune(max_bytes=max_bytes, older_than_days=args.older_than)
+        for path in removed: print(f"🗑️  {os.path.basename(path)}")
+        print(f"✅ Removed {len(removed)} file(s)")
+        return
+
+    found = sessions.list_sessions()
+    if not found:
+        print(f"🔹 No saved sessions in {sessions.SESSIONS_DIR}")
+        return
+    print(f"{'name':<24} {'msgs':>5} {'log':>9} {'kv':>9}  last used")
+    for s in found:
+        print(f"{s['name']:<24} {s['turns']:>5} {s['log_bytes'] / 1024:>7.1f}KB {s['kv_bytes'] / 2**20:>7.1f}MB  "
+              f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(s['mtime']))}")
+    total = sum(s["log_bytes"] + s["kv_bytes"] for s in found)
+    print(f"🔹 {len(found)} session(s), {total / 2**20:.1f} MB (KV snapshots capped at {sessions.KV_LIMIT / 2**30:.0f} GB)")
+
+def models_main(args):
+    """`ai.py models [list|pin|verify]`: model variants and their pinned local weights."""
+    if not os.path.exists(args.weights):
+        print(f"❌ Weights file not found: {args.weights}")
+        sys.exit(1)
+    meta = _load_meta(args.weights)
+    local = meta.get("local") or {}
+
+    if args.action == "pin":
+        for repo in models.manifest_repos(meta):
+            t0 = time.time()
+            entry = models.pin(repo, download=args.download, workers=args.workers)
+            if entry is None:
+                print(f"⚠️  {repo}: not in the local cache (--download fetches it)")
+                continue
+            local[repo] = entry
+            size = sum(f["size"] for f in entry["files"].values())
+            print(f"✅ {repo}: {len(entry['files'])} files, {size / 2**30:.2f} GB hashed in {time.time() - t0:.1f}s")
+        meta["local"], meta["manifest_version"] = local, models.MANIFEST_VERSION
+        models.write_manifest(args.weights, meta)
+        print(f"🔹 Wrote manifest v{models.MANIFEST_VERSION}: {args.weights}")
+        return
+
+    if args.action == "verify":
+        if not local:
+            print(f"❌ {args.weights} has no pinned local weights; run: python ai.py models pin")
+            sys.exit(1)
+        bad = 0
+        for repo, entry in local.items():
+            t0 = time.time()
+            results = models.verify(entry, workers=args.workers)
+            failed = [(name, status) for name, status in results if status != "ok"]
+            print(f"{'✅' if not failed else '❌'} {repo}: {len(results) - len(failed)}/{len(results)} files ok "
+                  f"({time.time() - t0:.1f}s)")
+            for name, status in failed:
+                print(f"   {status:<8} {name}")
+            if failed and args.download:
+                # Drop the damaged files (and their cache blobs) so the hub fetches them again
+                for name, status in failed:
+                    path = os.path.join(entry["path"], name)
+                    for p in {os.path.realpath(path), path}:
+                        try: os.remove(p)
+                        except OSError: pass
+                if models.find_snapshot(repo, download=True, revision=entry.get("revision")):
+                    failed = [r for r in models.verify(entry, workers=args.workers) if r[1] != "ok"]
+                    print(f"   🔹 re-downloaded, {len(failed)} file(s) still failing")
+            bad += bool(failed)
+        sys.exit(1 if bad else 0)
+
+    print(f"🔹 {args.weights} (manifest v{meta.get('manifest_version', 1)}), "
+          f"{(models.available_memory() or 0) / 2**30:.1f} GB available")
+    variants = meta.get("variants") or [{"name": "default", "repo": meta.get("repo")}]
+    for v in variants:
+        merged = models.merge_variant(meta, v)
+        need = models.required_bytes(merged)
+        entry = local.get(merged.get("repo"))
+        where = ("local" if not models.quick_check(entry) else "local copy damaged") if entry else "hub"
+        print(f"{models.variant_name(v):<12} {merged.get('repo'):<36} "
+              f"{f'{need / 2**30:.1f} GB' if need else '?':>8}  {where}")
+
+def batch_main(args):
+    """`ai.py batch --input prompts.jsonl --output results.jsonl`: offline inference, resumable."""
+    if not args.input or not args.output:
+        print("❌ batch needs --input and --output")
+        sys.exit(1)
+    try:
+        items = batch.read_inputs(args.input)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    done = batch.completed_ids(args.output)
+    todo = [(rid, rec) for rid, rec in items if rid not in done]
+    print(f"🔹 {len(items)} prompt(s), {len(items) - len(todo)} already in {args.output}, {len(todo)} to run")
+    if not todo: return
+
+    system_prompt = build_system_prompt()
+    runner = EngineThread(lambda report: load_engine(args, system_prompt, report),
+                          max_batch=args.max_batch, background_stride=args.background_stride,
+                          starvation_steps=args.starvation_steps)
+    worker = batch.BatchRunner(runner, system_prompt, args.output, profile=args.profile or "chat",
+                               max_tokens=args.max_tokens, concurrency=args.max_batch,
+                               parse_tools=agent.parse_intent if args.parse_tools and hasattr(agent, "parse_intent") else None)
+    try:
+        s = worker.run(todo)
+    finally:
+        runner.shutdown()
+    print(f"✅ {s['done']} done, {s['failed']} failed in {s['wall_s']:.1f}s · "
+          f"{s['tokens'] / s['wall_s'] if s['wall_s'] else 0:.1f} tok/s decoded · "
+          f"{s['prefill_tokens']} tokens prefilled · {s['done'] / s['wall_s'] if s['wall_s'] else 0:.2f} prompts/s"
+          + (f" · {s['tool_calls']} tool call(s)" if args.parse_tools else ""))
+    if s["failed"]:
+        print("🔹 Rerun the same command to retry the failed prompts")
+        sys.exit(1)
 
 def main():
     parser = argparse.ArgumentParser(description="Agent F (Amber)")
     parser.add_argument("--weights", type=str, default="qwen.npz", help="Path to qwen.npz")
     # ADDED THIS LINE TO FIX THE ERROR:
     parser.add_argument("--agent", type=str, default="agent.py", help="Path to agent script (legacy argument)")
-    parser.add_argument("cmd", nargs="?", default="chat", help="Command (default: chat)")
+    parser.add_argument("--context-budget", type=int, default=DEFAULT_BUDGET, help="Token budget for conversation history")
+    parser.add_argument("--engine", type=str, default=None, help="Override the manifest's engine (mlx, cpu, fake)")
+    parser.add_argument("--variant", type=str, default=None,
+                        help="Load this manifest variant (name or repo) instead of choosing by free memory")
+    parser.add_argument("--headroom", type=float, default=None, metavar="GB",
+                        help="Memory to leave free when choosing a variant (manifest memory_headroom_gb, default 2)")
+    parser.add_argument("--no-draft", action="store_true", help="Disable speculative decoding even if the manifest declares a draft model")
+    parser.add_argument("--no-dispatcher", action="store_true",
+                        help="Send every turn to the chat model even if the manifest declares a dispatcher")
+    parser.add_argument("--temperature", type=float, default=None, help="Chat sampling temperature (manifest profile otherwise)")
+    parser.add_argument("--top-k", type=int, default=None, help="Chat top-k sampling")
+    parser.add_argument("--top-p", type=float, default=None, help="Chat nucleus sampling")
+    parser.add_argument("--max-tokens", type=int, default=None, help="Token budget per chat reply")
+    parser.add_argument("--max-batch", type=int, default=8, help="Concurrent generations decoded together")
+    parser.add_argument("--background-stride", type=int, default=BACKGROUND_STRIDE,
+                        help="While chat turns decode, background generations step every Nth step")
+    parser.add_argument("--starvation-steps", type=int, default=STARVATION_STEPS,
+                        help="Scheduler steps after which held-back background work gets chat priority")
+    parser.add_argument("--stats", action="store_true", help="Print per-turn metrics (TTFT, prefill/decode speed, memory)")
+    parser.add_argument("--metrics", type=str, default=metrics.METRICS_PATH,
+                        help="Append per-turn metrics here (.jsonl or .db/.sqlite); 'none' disables")
+    parser.add_argument("--memory", type=str, nargs="?", const=memory.MEMORY_DIR, default=None, metavar="DIR",
+                        help="Remember chat turns across conversations in this store (default directory "
+                             "without DIR). Off unless given")
+    parser.add_argument("--response-cache", type=str, nargs="?", const=responses.CACHE_PATH, default=None,
+                        metavar="PATH", help="Answer repeated questions from a cache (SQLite; default path "
+                                             "without PATH). Off unless given")
+    parser.add_argument("--cache-ttl", type=float, default=responses.DEFAULT_TTL, metavar="SECONDS",
+                        help="How long cached answers stay valid (tools may shorten it)")
+    parser.add_argument("--near-duplicates", action="store_true",
+                        help="Also serve cached answers to near-identical questions (MinHash)")
+    parser.add_argument("--prefix-cache-mb", type=float, default=prefixcache.BUDGET_MB, metavar="MB",
+                        help="Memory for KV prefixes shared across conversations (per model); 0 disables")
+    parser.add_argument("--local", action="store_true", help="Load the model in-process even if a daemon is running")
+    parser.add_argument("--stream", action="store_true",
+                        help="JSON-lines protocol on stdin/stdout instead of the console (GUI frontends)")
+    parser.add_argument("--resume", type=str, default=None, metavar="NAME",
+                        help="Start or resume a named, persistent conversation")
+    parser.add_argument("--max-size", type=str, default=None, help="sessions prune: total size limit, e.g. 2G")
+    parser.add_argument("--older-than", type=float, default=None, metavar="DAYS",
+                        help="sessions prune: remove sessions unused for this many days")
+    parser.add_argument("--download", action="store_true",
+                        help="models pin/verify: fetch missing or damaged files from the hub")
+    parser.add_argument("--workers", type=int, default=models.VERIFY_WORKERS,
+                        help="models pin/verify: files hashed in parallel")
+    parser.add_argument("--input", type=str, default=None, help="batch: JSONL prompts")
+    parser.add_argument("--output", type=str, default=None, help="batch: JSONL results (also the resume checkpoint)")
+    parser.add_argument("--profile", type=str, default=None, help="batch: generation profile (default chat)")
+    parser.add_argument("--parse-tools", action="store_true", help="batch: add the parsed tool call to each result")
+    parser.add_argument("cmd", nargs="?", default="chat", choices=["chat", "serve", "sessions", "models", "batch"],
+                        help="chat (default), serve (shared daemon on a Unix socket), sessions, models or batch")
+    parser.add_argument("action", nargs="?", default="list", choices=["list", "prune", "pin", "verify"],
+                        help="sessions: list (default) or prune; models: list, pin or verify")
     
     args = parser.parse_args()
-    chat_main(args)
+    if args.resume:
+        try:
+            sessions.check_name(args.resume)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.cmd == "serve":
+        serve_main(args)
+    elif args.cmd == "sessions":
+        sessions_main(args)
+    elif args.cmd == "models":
+        models_main(args)
+    elif args.cmd == "batch":
+        batch_main(args)
+    elif args.stream:
+        stream_main(args)
+    else:
+        chat_main(args)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,703 @@
+#!/usr/bin/env python3
+"""
+Inference backends for Amber.
+The `engine` field of the weights manifest picks one:
+  - "mlx"   : Apple Silicon via mlx-lm (default)
+  - "cpu"   : PyTorch + transformers on CPU (Linux servers, CI); alias "transformers"
+  - "fake"  : deterministic byte-level model for tests and benchmarks (no weights)
+Every backend exposes the same small surface: load, render/encode, KV cache control
+and a streaming generate. The engine only talks to this interface.
+"""
+import codecs
+import json
+import re
+import sys
+import time
+from collections import namedtuple
+
+# One generated token. `text` may be empty while a multi-byte character is incomplete.
+# `logprob` (the sampled token's log-probability) is only filled in when the manifest asks
+# for it ("logprobs": true, e.g. the dispatcher model).
+Step = namedtuple("Step", "text token from_draft logprob", defaults=(None,))
+
+
+# --- INTERFACE ---
+class Backend:
+    name = "base"
+    cache_ext = ".bin"
+
+    def __init__(self, meta, use_draft=True):
+        self.meta = meta
+        self.use_draft = use_draft
+        self.has_draft = False
+        self.prefix_cache = None   # prefixcache.PrefixCache shared by every Engine on this backend
+
+    def load(self):
+        raise NotImplementedError
+
+    # ---- tokenization
+    def render(self, messages, add_generation_prompt=True, **template_kwargs):
+        """Chat template -> prompt text."""
+        raise NotImplementedError
+
+    def encode(self, text):
+        raise NotImplementedError
+
+    # ---- cache control
+    def new_cache(self):
+        raise NotImplementedError
+
+    def cache_offset(self, cache):
+        """Tokens held by the cache (for multi-part caches: by every part)."""
+        raise NotImplementedError
+
+    def trim_to(self, cache, n):
+        """Drop everything after the first `n` tokens. Returns False if the cache can't be trimmed."""
+        raise NotImplementedError
+
+    def prefill(self, cache, tokens):
+        """Feed `tokens` into `cache` without sampling."""
+        raise NotImplementedError
+
+    def save_cache(self, path, cache, metadata):
+        raise NotImplementedError
+
+    def load_cache(self, path):
+        """Returns (cache, metadata)."""
+        raise NotImplementedError
+
+    # ---- prefix sharing (see prefixcache.py); None from cache_segment means unsupported
+    def cache_segment(self, cache, start, end):
+        """Standalone copy of positions [start, end) of `cache`, or None."""
+        return None
+
+    def join_segments(self, segments):
+        """A new cache holding the given consecutive segments."""
+        raise NotImplementedError
+
+    def segment_bytes(self, segment):
+        return 0
+
+    # ---- generation
+    def generate(self, tokens, cache, max_tokens=1024, **sampling):
+        """Prefill `tokens` on top of `cache` and yield Steps until EOS or `max_tokens`."""
+        raise NotImplementedError
+
+    # ---- continuous batching (driven by engine.EngineThread)
+    def begin(self, tokens, cache, max_tokens=1024, **sampling):
+        """Start a sequence in the running batch. Returns an opaque per-sequence state."""
+        return self.generate(tokens, cache, max_tokens=max_tokens, **sampling)
+
+    def step(self, states):
+        """
+        Advance every sequence in the batch by one token; None marks a finished one.
+        Backends with batched decoding (mlx) override this. The default runs one
+        forward pass per sequence, still interleaved at token boundaries.
+        """
+        return [next(s, None) for s in states]
+
+    def end(self, state):
+        """Release a sequence (finished, cancelled or failed)."""
+        close = getattr(state, "close", None)
+        if close: close()
+
+    # ---- memory (per-turn metrics)
+    def peak_memory(self):
+        """Peak memory in bytes since reset_peak_memory(); here the process high-water mark."""
+        try:
+            import resource
+        except ImportError:
+            return None
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024  # bytes on macOS, KiB on Linux
+
+    def reset_peak_memory(self):
+        pass
+
+
+# --- MLX (Apple Silicon) ---
+class _MLXSeq:
+    """A sequence in the MLX decode batch."""
+    def __init__(self, cache, pending, history, sampler, processors, max_tokens, detokenizer):
+        self.cache = cache            # the engine's per-layer caches, written back when it leaves its group
+        self.pending = pending        # token fed at the next step: the last prompt token, then each sampled one
+        self.history = history        # context for logits processors (repetition penalty)
+        self.sampler = sampler        # None = greedy
+        self.processors = processors
+        self.max_tokens = max_tokens
+        self.detokenizer = detokenizer
+        self.n = 0
+        self.done = False
+        self.group = None
+
+
+class _MLXGroup:
+    """Sequences decoded by one batched forward pass over a shared BatchKVCache per layer."""
+    def __init__(self, seqs, cache):
+        self.seqs = seqs
+        self.cache = cache
+
+
+class MLXBackend(Backend):
+    name = "mlx"
+    cache_ext = ".safetensors"
+    PREFILL_STEP = 512
+
+    def load(self):
+        try:
+            import mlx.core as mx
+            from mlx_lm import load
+        except ImportError:
+            raise RuntimeError("MLX not installed. Run: pip install mlx mlx-lm")
+        self.mx = mx
+
+        # repo_path / draft_path: pinned local snapshots (see models.localize), no hub lookup
+        repo = self.meta.get("repo")
+        print(f"🔹 Loading Model from Repo: {repo}")
+        self.model, self.tokenizer = load(self.meta.get("repo_path") or repo)
+
+        # Optional draft model for speculative decoding (must share the tokenizer vocabulary)
+        self.draft_model = None
+        draft_repo = self.meta.get("draft_repo")
+        if draft_repo and self.use_draft:
+            print(f"🔹 Loading Draft Model: {draft_repo}")
+            try:
+                self.draft_model, _ = load(self.meta.get("draft_path") or draft_repo)
+                self.has_draft = True
+            except Exception as e:
+                print(f"⚠️  Draft model unavailable, decoding without it: {e}")
+        self.num_draft_tokens = int(self.meta.get("num_draft_tokens", 3))
+
+    def render(self, messages, add_generation_prompt=True, **template_kwargs):
+        return self.tokenizer.apply_chat_template(messages, tokenize=False,
+                                                  add_generation_prompt=add_generation_prompt,
+                                                  **template_kwargs)
+
+    def encode(self, text):
+        return self.tokenizer.encode(text, add_special_tokens=False)
+
+    def new_cache(self):
+        from mlx_lm.models.cache import make_prompt_cache
+        # mlx_lm expects the draft model's layers after the main model's in one list
+        cache = make_prompt_cache(self.model)
+        if self.draft_model is not None:
+            cache += make_prompt_cache(self.draft_model)
+        return cache
+
+    def cache_offset(self, cache):
+        if not cache: return 0
+        return min(getattr(c, "offset", 0) for c in cache)
+
+    def trim_to(self, cache, n):
+        for c in cache:
+            extra = getattr(c, "offset", 0) - n
+            if extra > 0:
+                if not c.is_trimmable(): return False
+                c.trim(extra)
+        return True
+
+    def prefill(self, cache, tokens):
+        mx = self.mx
+        n_main = len(self.model.layers)
+        parts = [(self.model, cache[:n_main])]
+        if self.draft_model is not None:
+            parts.append((self.draft_model, cache[n_main:]))
+        for model, layers in parts:
+            for i in range(0, len(tokens), self.PREFILL_STEP):
+                model(mx.array(tokens[i:i + self.PREFILL_STEP])[None], cache=layers)
+                mx.eval([c.state for c in layers])
+
+    def save_cache(self, path, cache, metadata):
+        from mlx_lm.models.cache import save_prompt_cache
+        save_prompt_cache(path, cache, metadata)
+
+    def load_cache(self, path):
+        from mlx_lm.models.cache import load_prompt_cache
+        # mx.load maps the safetensors file lazily; nothing is copied until used.
+        return load_prompt_cache(path, return_metadata=True)
+
+    def cache_segment(self, cache, start, end):
+        from mlx_lm.models.cache import KVCache
+        mx = self.mx
+        # Only plain caches hold every position; rotating / quantized layers can't be cut up
+        if any(type(c) is not KVCache or c.keys is None or c.offset < end for c in cache):
+            return None
+        # contiguous() copies, so the segment doesn't pin the session's whole buffer
+        seg = [(mx.contiguous(c.keys[..., start:end, :]), mx.contiguous(c.values[..., start:end, :])) for c in cache]
+        mx.eval(seg)
+        return seg
+
+    def join_segments(self, segments):
+        from mlx_lm.models.cache import KVCache
+        mx = self.mx
+        cache = []
+        for layer in zip(*segments):
+            c = KVCache()
+            c.keys = mx.concatenate([k for k, _ in layer], axis=2)
+            c.values = mx.concatenate([v for _, v in layer], axis=2)
+            c.offset = c.keys.shape[2]
+            cache.append(c)
+        return cache
+
+    def segment_bytes(self, segment):
+        return sum(k.nbytes + v.nbytes for k, v in segment)
+
+    def peak_memory(self):
+        import mlx.core as mx
+        get = getattr(mx, "get_peak_memory", None) or mx.metal.get_peak_memory
+        return get()
+
+    def reset_peak_memory(self):
+        import mlx.core as mx
+        reset = getattr(mx, "reset_peak_memory", None) or mx.metal.reset_peak_memory
+        reset()
+
+    def generate(self, tokens, cache, max_tokens=1024, **sampling):
+        from mlx_lm import stream_generate
+        kwargs = {}
+        if self.draft_model is not None:
+            kwargs = {"draft_model": self.draft_model, "num_draft_tokens": self.num_draft_tokens}
+        if sampling.get("temperature"):  # otherwise greedy (mlx_lm's default sampler)
+            from mlx_lm.sample_utils import make_sampler
+            kwargs["sampler"] = make_sampler(temp=sampling["temperature"], top_p=sampling.get("top_p") or 0.0,
+                                             min_p=sampling.get("min_p") or 0.0, top_k=sampling.get("top_k") or 0)
+        if sampling.get("repetition_penalty"):
+            from mlx_lm.sample_utils import make_logits_processors
+            kwargs["logits_processors"] = make_logits_processors(repetition_penalty=sampling["repetition_penalty"])
+        logprobs = bool(self.meta.get("logprobs"))
+        for resp in stream_generate(self.model, self.tokenizer, tokens, max_tokens=max_tokens,
+                                    prompt_cache=cache, **kwargs):
+            yield Step(resp.text, resp.token, bool(getattr(resp, "from_draft", False)),
+                       resp.logprobs[resp.token].item() if logprobs else None)
+
+    # ---- batched decoding
+    # Sequences are prefilled into their own cache, then decoded together: one forward pass
+    # per step over a left-padded BatchKVCache for the whole group. A sequence the scheduler
+    # skips (paused, or background work on a stride) is split off into a group of its own, so
+    # a stable batch isn't re-copied every step. Its KV goes back into the engine's cache
+    # when it finishes. With a draft model, sequences decode speculatively one at a time
+    # instead (the draft's cache can't follow a batched step).
+    def begin(self, tokens, cache, max_tokens=1024, **sampling):
+        from mlx_lm.models.cache import KVCache
+        if self.draft_model is not None or any(type(c) is not KVCache for c in cache):
+            return self.generate(tokens, cache, max_tokens=max_tokens, **sampling)
+        mx = self.mx
+        sampler = processors = None
+        if sampling.get("temperature"):
+            from mlx_lm.sample_utils import make_sampler
+            sampler = make_sampler(temp=sampling["temperature"], top_p=sampling.get("top_p") or 0.0,
+                                   min_p=sampling.get("min_p") or 0.0, top_k=sampling.get("top_k") or 0)
+        if sampling.get("repetition_penalty"):
+            from mlx_lm.sample_utils import make_logits_processors
+            processors = make_logits_processors(repetition_penalty=sampling["repetition_penalty"])
+        self.prefill(cache, tokens[:-1])
+        return _MLXSeq(cache, tokens[-1], mx.array(tokens[:-1], dtype=mx.uint32), sampler, processors,
+                       max_tokens, self.tokenizer.detokenizer)
+
+    def step(self, states):
+        out = [None] * len(states)
+        live = []
+        for i, s in enumerate(states):
+            if not isinstance(s, _MLXSeq):
+                out[i] = next(s, None)      # speculative / unbatchable sequence
+            elif not s.done:
+                live.append((i, s))
+        if not live: return out
+        groups = self._regroup([s for _, s in live])
+        steps = {}
+        for group in groups:
+            steps.update(self._decode(group))
+        for i, s in live:
+            out[i] = steps[id(s)]
+        return out
+
+    def end(self, state):
+        if isinstance(state, _MLXSeq):
+            if state.group is not None: self._leave(state)
+        else:
+            super().end(state)
+
+    def _regroup(self, seqs):
+        """Groups covering exactly `seqs`: absent members are split off, new sequences merged in."""
+        present = {id(s) for s in seqs}
+        groups = {}
+        for s in seqs:
+            if s.group is not None: groups[id(s.group)] = s.group
+        for group in list(groups.values()):
+            keep = [i for i, m in enumerate(group.seqs) if id(m) in present]
+            if len(keep) < len(group.seqs):
+                self._split(group, keep)
+        new = [s for s in seqs if s.group is None]
+        if new:
+            cache = [type(layers[0]).merge(list(layers)) for layers in zip(*(s.cache for s in new))]
+            target = max(groups.values(), key=lambda g: len(g.seqs), default=None)
+            if target is None:
+                target = _MLXGroup([], cache)
+                groups[id(target)] = target
+            else:
+                for a, b in zip(target.cache, cache): a.extend(b)
+            target.seqs.extend(new)
+            for s in new: s.group = target
+        return list(groups.values())
+
+    def _split(self, group, keep):
+        """Move the members not in `keep` into a group of their own."""
+        import copy
+        move = [i for i in range(len(group.seqs)) if i not in keep]
+        moved = _MLXGroup([group.seqs[i] for i in move], [copy.copy(c) for c in group.cache])
+        for c in moved.cache: c.filter(move)
+        for c in group.cache: c.filter(keep)
+        group.seqs = [group.seqs[i] for i in keep]
+        for s in moved.seqs: s.group = moved
+
+    def _leave(self, seq):
+        """Write the sequence's KV back into the engine's cache and drop it from its group."""
+        group = seq.group
+        idx = group.seqs.index(seq)
+        for c, layer in zip(seq.cache, group.cache):
+            row = layer.extract(idx)
+            c.keys, c.values, c.offset = row.keys, row.values, row.offset
+        keep = [i for i in range(len(group.seqs)) if i != idx]
+        if keep:
+            for layer in group.cache: layer.filter(keep)
+        group.seqs.pop(idx)
+        seq.group = None
+
+    def _decode(self, group):
+        """One batched forward pass: feeds each member's pending token, samples the next. {id(seq): Step}."""
+        mx = self.mx
+        seqs = list(group.seqs)
+        inputs = mx.array([s.pending for s in seqs], dtype=mx.uint32)
+        logits = self.model(inputs[:, None], cache=group.cache)[:, -1, :]
+        if any(s.processors for s in seqs):
+            rows = []
+            for i, s in enumerate(seqs):
+                row = logits[i:i + 1]
+                if s.processors:
+                    s.history = mx.concatenate([s.history, inputs[i:i + 1]])
+                    for proc in s.processors: row = proc(s.history, row)
+                rows.append(row)
+            logits = mx.concatenate(rows, axis=0)
+        logprobs = logits - mx.logsumexp(logits, axis=-1, keepdims=True)
+        if all(s.sampler is None for s in seqs):
+            tokens = mx.argmax(logprobs, axis=-1)
+        else:
+            tokens = mx.concatenate([s.sampler(logprobs[i:i + 1]) if s.sampler else mx.argmax(logprobs[i:i + 1], axis=-1)
+                                     for i, s in enumerate(seqs)])
+        chosen = mx.take_along_axis(logprobs, tokens[:, None], axis=-1)[:, 0]
+        mx.eval(tokens, chosen)
+        want_logprobs = bool(self.meta.get("logprobs"))
+        steps = {}
+        for s, tok, lp in zip(seqs, tokens.tolist(), chosen.tolist()):
+            s.n += 1
+            lp = lp if want_logprobs else None
+            if tok in self.tokenizer.eos_token_ids:
+                s.detokenizer.finalize()
+                s.done = True
+            else:
+                s.detokenizer.add_token(tok)
+                s.pending = tok
+                if s.n >= s.max_tokens:
+                    s.detokenizer.finalize()
+                    s.done = True
+            steps[id(s)] = Step(s.detokenizer.last_segment, tok, False, lp)
+            if s.done: self._leave(s)
+        return steps
+
+    @classmethod
+    def sharing(cls, meta, model, tokenizer):
+        """A backend over weights that are already loaded (the main backend's draft model)."""
+        import mlx.core as mx
+        b = cls(meta, use_draft=False)
+        b.mx, b.model, b.tokenizer = mx, model, tokenizer
+        b.draft_model, b.num_draft_tokens = None, 0
+        return b
+
+
+# --- CPU (PyTorch + transformers) ---
+class _StreamDecoder:
+    """Incremental detokenizer: emits text once it is stable (no dangling partial characters)."""
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.pending = []
+        self.emitted = 0
+
+    def add(self, token):
+        self.pending.append(token)
+        text = self.tokenizer.decode(self.pending, skip_special_tokens=True)
+        if text.endswith("�"):
+            return ""
+        out = text[self.emitted:]
+        if text.endswith("\n"):
+            self.pending, self.emitted = [], 0
+        else:
+            self.emitted = len(text)
+        return out
+
+    def flush(self):
+        text = self.tokenizer.decode(self.pending, skip_special_tokens=True)
+        out = text[self.emitted:]
+        self.pending, self.emitted = [], 0
+        return out
+
+
+class TransformersBackend(Backend):
+    name = "cpu"
+    cache_ext = ".pt"
+    PREFILL_STEP = 256
+
+    def load(self):
+        try:
+            import torch
+            from transformers import AutoModelForCausalLM, AutoTokenizer, DynamicCache
+        except ImportError:
+            raise RuntimeError("CPU backend needs PyTorch + transformers. Run: pip install torch transformers")
+        self.torch, self.DynamicCache = torch, DynamicCache
+
+        repo = self.meta.get("repo")
+        device = self.meta.get("device", "cpu")
+        print(f"🔹 Loading Model from Repo: {repo} (transformers, {device})")
+        source = self.meta.get("repo_path") or repo
+        self.tokenizer = AutoTokenizer.from_pretrained(source)
+        self.model = AutoModelForCausalLM.from_pretrained(source, torch_dtype="auto").to(device).eval()
+        self.device = device
+        eos = self.model.generation_config.eos_token_id
+        self.eos_ids = set(eos if isinstance(eos, list) else [eos]) | {self.tokenizer.eos_token_id}
+        if self.meta.get("draft_repo") and self.use_draft:
+            print("⚠️  Speculative decoding is not supported by the CPU backend; ignoring draft_repo.")
+
+    def render(self, messages, add_generation_prompt=True, **template_kwargs):
+        return self.tokenizer.apply_chat_template(messages, tokenize=False,
+                                                  add_generation_prompt=add_generation_prompt,
+                                                  **template_kwargs)
+
+    def encode(self, text):
+        return self.tokenizer.encode(text, add_special_tokens=False)
+
+    def new_cache(self):
+        return self.DynamicCache()
+
+    def cache_offset(self, cache):
+        return cache.get_seq_length()
+
+    def trim_to(self, cache, n):
+        cache.crop(n)
+        return True
+
+    def _forward(self, ids, cache):
+        torch = self.torch
+        x = torch.tensor([ids], device=self.device)
+        return self.model(input_ids=x, past_key_values=cache, use_cache=True).logits[0, -1]
+
+    def prefill(self, cache, tokens):
+        with self.torch.inference_mode():
+            for i in range(0, len(tokens), self.PREFILL_STEP):
+                self._forward(tokens[i:i + self.PREFILL_STEP], cache)
+
+    def save_cache(self, path, cache, metadata):
+        self.torch.save({"kv": cache.to_legacy_cache(), "meta": metadata}, path)
+
+    def load_cache(self, path):
+        data = self.torch.load(path, mmap=True, weights_only=True)
+        return self.DynamicCache.from_legacy_cache(data["kv"]), data["meta"]
+
+    def cache_segment(self, cache, start, end):
+        if cache.get_seq_length() < end: return None
+        return [(k[..., start:end, :].clone(), v[..., start:end, :].clone()) for k, v in cache.to_legacy_cache()]
+
+    def join_segments(self, segments):
+        torch = self.torch
+        return self.DynamicCache.from_legacy_cache(tuple(
+            (torch.cat([k for k, _ in layer], dim=-2), torch.cat([v for _, v in layer], dim=-2))
+            for layer in zip(*segments)))
+
+    def segment_bytes(self, segment):
+        return sum(k.nelement() * k.element_size() + v.nelement() * v.element_size() for k, v in segment)
+
+    def _sample(self, logits, temperature=0.0, top_p=1.0, top_k=0, **_):
+        torch = self.torch
+        if not temperature or temperature <= 0:
+            return int(torch.argmax(logits))
+        logits = logits.float() / temperature
+        if top_k and top_k > 0:
+            kth = torch.topk(logits, min(top_k, logits.shape[-1])).values[-1]
+            logits[logits < kth] = float("-inf")
+        probs = torch.softmax(logits, dim=-1)
+        if top_p and top_p < 1.0:
+            sorted_p, idx = torch.sort(probs, descending=True)
+            drop = torch.cumsum(sorted_p, dim=-1) - sorted_p > top_p
+            sorted_p[drop] = 0.0
+            probs = torch.zeros_like(probs).scatter(0, idx, sorted_p)
+        return int(torch.multinomial(probs / probs.sum(), 1))
+
+    def generate(self, tokens, cache, max_tokens=1024, **sampling):
+        decoder = _StreamDecoder(self.tokenizer)
+        logprobs = bool(self.meta.get("logprobs"))
+        with self.torch.inference_mode():
+            # Prefill all but the last prompt token in chunks, then decode one token at a time
+            self.prefill(cache, tokens[:-1])
+            ids = tokens[-1:]
+            for _ in range(max_tokens):
+                logits = self._forward(ids, cache)
+                tok = self._sample(logits, **sampling)
+                lp = self.torch.log_softmax(logits.float(), dim=-1)[tok].item() if logprobs else None
+                if tok in self.eos_ids:
+                    yield Step(decoder.flush(), tok, False, lp)
+                    return
+                yield Step(decoder.add(tok), tok, False, lp)
+                ids = [tok]
+        tail = decoder.flush()
+        if tail:
+            yield Step(tail, None, False)
+
+
+# --- FAKE (deterministic, for tests and benchmarks) ---
+class _FakeSeq:
+    def __init__(self, cache, reply, max_tokens):
+        self.cache = cache
+        self.reply = reply
+        self.max_tokens = max_tokens
+        self.pos = 0
+        self.done = False
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+
+class _FakeCache:
+    """The fake "KV cache" is just the token list it has seen."""
+    def __init__(self, tokens=None):
+        self.tokens = list(tokens or [])
+
+    @property
+    def offset(self):
+        return len(self.tokens)
+
+
+class FakeBackend(Backend):
+    """
+    Byte-level tokenizer (1 token = 1 UTF-8 byte), ChatML template and canned replies.
+    Manifest knobs:
+      fake_responses   : [[regex, reply], ...] matched against the last user message
+      fake_think       : wrap replies in a <think> block (an int N pads it with N-1 more lines)
+      fake_logprob     : log-probability reported for every token (with "logprobs": true)
+      fake_prefill_ms  : simulated cost per prefilled token
+      fake_decode_ms   : simulated cost per generated token
+      fake_kv_bytes    : pretend KV size of one token (prefix cache accounting)
+    """
+    name = "fake"
+    cache_ext = ".json"
+    EOS = 256
+    USER_RE = re.compile(r"<\|im_start\|>user\n(.*?)<\|im_end\|>", re.DOTALL)
+
+    def load(self):
+        self.rules = [(re.compile(p, re.IGNORECASE), r) for p, r in self.meta.get("fake_responses", [])]
+        self.logprob = float(self.meta.get("fake_logprob", 0.0)) if self.meta.get("logprobs") else None
+        self.think = int(self.meta.get("fake_think", 0))
+        self.prefill_s = float(self.meta.get("fake_prefill_ms", 0.0)) / 1000.0
+        self.decode_s = float(self.meta.get("fake_decode_ms", 0.0)) / 1000.0
+        self.kv_token_bytes = int(self.meta.get("fake_kv_bytes", 147456))   # Qwen3-8B, bf16
+        print("🔹 Loading Model: fake backend (deterministic)")
+
+    def render(self, messages, add_generation_prompt=True, **template_kwargs):
+        out = "".join(f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>\n" for m in messages)
+        if add_generation_prompt:
+            out += "<|im_start|>assistant\n"
+            # Same switch as Qwen3's template: an empty think block turns reasoning off
+            if template_kwargs.get("enable_thinking") is False:
+                out += "<think>\n\n</think>\n\n"
+        return out
+
+    def encode(self, text):
+        return list(text.encode("utf-8"))
+
+    def new_cache(self):
+        return _FakeCache()
+
+    def cache_offset(self, cache):
+        return cache.offset
+
+    def trim_to(self, cache, n):
+        del cache.tokens[n:]
+        return True
+
+    def prefill(self, cache, tokens):
+        if self.prefill_s: time.sleep(self.prefill_s * len(tokens))
+        cache.tokens.extend(tokens)
+
+    def save_cache(self, path, cache, metadata):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"tokens": cache.tokens, "meta": metadata}, f)
+
+    def load_cache(self, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return _FakeCache(data["tokens"]), data["meta"]
+
+    def cache_segment(self, cache, start, end):
+        if len(cache.tokens) < end: return None
+        return cache.tokens[start:end]
+
+    def join_segments(self, segments):
+        return _FakeCache([t for seg in segments for t in seg])
+
+    def segment_bytes(self, segment):
+        return len(segment) * self.kv_token_bytes
+
+    def reply_for(self, prompt_text):
+        users = self.USER_RE.findall(prompt_text)
+        user = users[-1].strip() if users else ""
+        reply = f"Echo: {user}"
+        for pattern, canned in self.rules:
+            if pattern.search(user):
+                reply = canned
+                break
+        # No new block if reasoning is switched off or was already closed for us
+        if self.think and not prompt_text.endswith("</think>\n\n"):
+            padding = "Let me think about that.\n" * (self.think - 1)
+            reply = f"<think>\nThe user said: {user}\n{padding}</think>\n\n{reply}"
+        return reply
+
+    def begin(self, tokens, cache, max_tokens=1024, **sampling):
+        self.prefill(cache, tokens)
+        prompt = bytes(t for t in cache.tokens if t < 256).decode("utf-8", errors="replace")
+        return _FakeSeq(cache, self.reply_for(prompt).encode("utf-8"), max_tokens)
+
+    def step(self, states):
+        # One simulated forward pass advances the whole batch, like a fused kernel would
+        if self.decode_s: time.sleep(self.decode_s)
+        return [self._advance(s) for s in states]
+
+    def end(self, state):
+        pass
+
+    def _advance(self, s):
+        if s.done: return None
+        if s.pos < len(s.reply) and s.pos < s.max_tokens:
+            tok = s.reply[s.pos]
+            s.pos += 1
+            s.cache.tokens.append(tok)
+            return Step(s.decoder.decode(bytes([tok])), tok, False, self.logprob)
+        s.done = True
+        if s.pos < len(s.reply): return None  # max_tokens reached
+        return Step(s.decoder.decode(b"", final=True), self.EOS, False, self.logprob)
+
+    def generate(self, tokens, cache, max_tokens=1024, **sampling):
+        state = self.begin(tokens, cache, max_tokens=max_tokens, **sampling)
+        while True:
+            step = self.step([state])[0]
+            if step is None: return
+            yield step
+
+
+# --- REGISTRY ---
+BACKENDS = {
+    "mlx": MLXBackend,
+    "cpu": TransformersBackend,
+    "transformers": TransformersBackend,
+    "fake": FakeBackend,
+}
+
+def make_backend(meta, use_draft=True):
+    name = str(meta.get("engine") or "mlx").lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown engine '{name}' (choose from: {', '.join(sorted(BACKENDS))})")
+    return BACKENDS[name](meta, use_draft=use_draft)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Offline batch inference for Amber: `ai.py batch --input prompts.jsonl --output results.jsonl`.
+Input is one JSON object per line:
+  {"id": "t1", "prompt": "Open the calculator"}                  (id defaults to the line number)
+  {"id": "t2", "messages": [{"role": "user", "content": "..."}], "profile": "summary",
+   "max_tokens": 256, "think": false, "system": "optional system prompt instead of Amber's"}
+Output gets one line per finished input, in completion order:
+  {"id": "t1", "reply": "...", "tokens": 31, "prefill_tokens": 12, "latency_s": 0.41,
+   "tool_call": {"tool": "calclaunch", "args": {...}}}           (tool_call with --parse-tools)
+Prompts are decoded together through the engine's continuous batching (up to --max-batch at
+once). Each one gets its own KV cache, primed from the system-prompt snapshot, so only its
+own tokens are prefilled. The output file is the checkpoint: a rerun skips ids that are
+already in it and appends the rest. Tools are never run.
+"""
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from engine import Engine, BACKGROUND
+from context import strip_think
+
+# --- CONFIGURATION ---
+SYNC_EVERY = 50          # results between fsyncs of the output file
+REPORT_EVERY = 5.0       # seconds between progress lines
+
+
+# --- INPUT / CHECKPOINT ---
+def read_inputs(path):
+    """[(id, record)] from a JSONL file. Raises ValueError on bad lines or duplicate ids."""
+    items, seen = [], set()
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line: continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                raise ValueError(f"{path}:{n}: not valid JSON")
+            if isinstance(rec, str):
+                rec = {"prompt": rec}
+            elif not isinstance(rec, dict):
+                raise ValueError(f"{path}:{n}: expected a JSON object or string, got {type(rec).__name__}")
+            if not (rec.get("prompt") or rec.get("messages")):
+                raise ValueError(f"{path}:{n}: needs \"prompt\" or \"messages\"")
+            rid = str(rec.get("id", n))
+            if rid in seen:
+                raise ValueError(f"{path}:{n}: duplicate id '{rid}'")
+            seen.add(rid)
+            items.append((rid, rec))
+    return items
+
+def completed_ids(path):
+    """Ids already in the output file. A torn last line (killed mid-write) is cut off."""
+    done = set()
+    if not os.path.exists(path): return done
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+        for line in data[:end].splitlines():
+            try:
+                done.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError, TypeError):
+                pass
+    return done
+
+def build_messages(rec, system_prompt):
+    messages = list(rec.get("messages") or [{"role": "user", "content": rec["prompt"]}])
+    if messages[0].get("role") != "system":
+        messages.insert(0, {"role": "system", "content": rec.get("system") or system_prompt})
+    return messages
+
+
+# --- RUNNER ---
+class BatchRunner:
+    """Feeds records through an EngineThread and appends results to `output`."""
+    def __init__(self, runner, system_prompt, output, profile="chat", max_tokens=None,
+                 parse_tools=None, concurrency=8, report=print):
+        self.runner = runner
+        self.system_prompt = system_prompt
+        self.output = output
+        self.profile = profile
+        self.max_tokens = max_tokens
+        self.parse_tools = parse_tools   # callable(reply) -> {"tool", "args"} | None, or None
+        self.concurrency = max(1, concurrency)
+        self.report = report
+        self.stats = {"done": 0, "failed": 0, "tokens": 0, "prefill_tokens": 0, "tool_calls": 0}
+        self._lock = threading.Lock()
+        self._since_sync = 0
+
+    def _open(self, shared, system):
+        """Engine thread: a scratch cache over the shared weights, system prompt from its snapshot."""
+        engine = Engine(shared.backend)
+        if system == self.system_prompt:
+            engine.prime([{"role": "system", "content": system}])
+        return engine
+
+    def run_one(self, rid, rec):
+        messages = build_messages(rec, self.system_prompt)
+        t0 = time.perf_counter()
+        engine = self.runner.submit(self._open, messages[0]["content"]).result()
+        reply = "".join(self.runner.stream(engine, messages, profile=rec.get("profile") or self.profile,
+                                           max_tokens=rec.get("max_tokens") or self.max_tokens,
+                                           stop=rec.get("stop"), thinking=rec.get("think"), priority=BACKGROUND,
+                                           **(rec.get("sampling") or {})))
+        turn = engine.last_turn
+        result = {"id": rid, "reply": strip_think(reply).strip(), "tokens": turn.get("tokens", 0),
+                  "prefill_tokens": turn.get("prefill_tokens", 0), "thinking_tokens": turn.get("thinking_tokens", 0),
+                  "latency_s": round(time.perf_counter() - t0, 4)}
+        if self.parse_tools:
+            result["tool_call"] = self.parse_tools(reply)
+        return result
+
+    def _write(self, f, result):
+        with self._lock:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+            f.flush()
+            self._since_sync += 1
+            if self._since_sync >= SYNC_EVERY:
+                os.fsync(f.fileno())
+                self._since_sync = 0
+            s = self.stats
+            s["done"] += 1
+            s["tokens"] += result["tokens"]
+            s["prefill_tokens"] += result["prefill_tokens"]
+            s["tool_calls"] += bool(result.get("tool_call"))
+
+    def run(self, items):
+        """Runs every (id, record); returns the stats. Failed records are left for the next run."""
+        self.runner.loaded.result()
+        start = last = time.perf_counter()
+        total = len(items)
+        with open(self.output, "a", encoding="utf-8") as f, \
+                ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = {pool.submit(self.run_one, rid, rec): rid for rid, rec in items}
+            try:
+                for fut in as_completed(futures):
+                    try:
+                        self._write(f, fut.result())
+                    except Exception as e:
+                        self.stats["failed"] += 1
+                        self.report(f"⚠️  {futures[fut]}: {e}")
+                    now = time.perf_counter()
+                    if now - last >= REPORT_EVERY:
+                        last = now
+                        self.report(self.progress(now - start, total))
+            except KeyboardInterrupt:
+                for fut in futures: fut.cancel()
+                self.report("🔹 Interrupted; rerun the same command to resume")
+                raise
+            finally:
+                f.flush()
+                os.fsync(f.fileno())
+        self.stats["wall_s"] = round(time.perf_counter() - start, 3)
+        return self.stats
+
+    def progress(self, elapsed, total):
+        s = self.stats
+        rate = s["done"] / elapsed if elapsed else 0.0
+        eta = (total - s["done"] - s["failed"]) / rate if rate else 0.0
+        return (f"🔹 {s['done']}/{total} done · {s['tokens'] / elapsed:.1f} tok/s · "
+                f"{rate:.2f} prompts/s · ETA {eta:.0f}s")
@@ -0,0 +1,753 @@
+#!/usr/bin/env python3
+"""
+Amber benchmarks.
+
+  load   : concurrent chat sessions against the engine (in-process or a running daemon),
+           reporting aggregate decode tokens/sec and time-to-first-token as concurrency rises.
+           Throughput numbers only mean something on a real model (mlx decodes in batches;
+           cpu interleaves one sequence at a time); with --engine fake they test scheduling.
+  stream : think-filter / renderer microbenchmark on a long synthetic token stream,
+           reporting per-chunk cost across the stream and terminal writes.
+  memory : long-term memory top-k query latency over a store of N random embeddings.
+  turns  : end-to-end turn latency: scripted multi-turn conversations replayed through the
+           full chat pipeline (context, routing, tool dispatch), reporting startup time,
+           per-turn TTFT / latency / tool time and memory, compared against a baseline.
+  routing: tool-routing eval: utterance -> expected {"tool", "args"} (routing-eval.jsonl),
+           reporting tool / argument accuracy, malformed calls, tokens and latency per
+           configuration (system prompt, catalog encoding, profile, thinking).
+
+  python bench.py load --engine fake --concurrency 1,2,4,8,16
+  python bench.py load --daemon --concurrency 1,4,16      # against `ai.py serve`
+  python bench.py load --engine fake --background 8       # chat TTFT under background load
+  python bench.py stream --tokens 100000
+  python bench.py memory --entries 1000000
+  python bench.py turns --engine fake --save-baseline bench-baseline.json
+  python bench.py turns --engine fake --baseline bench-baseline.json    # exit 1 on regression
+  python bench.py routing --configs default,chat,compact
+"""
+import argparse
+import json
+import io
+import math
+import random
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import ai
+import batch
+import daemon
+import memory
+from profiles import route_profile
+from streaming import ThinkFilter, FrameWriter
+
+LOAD_PROMPTS = [
+    "Open the calculator",
+    "What's the weather like in Lisbon?",
+    "Write two sentences about the ocean.",
+    "Find my notes about the quarterly report",
+]
+
+# Scripted conversations for `turns`. A turn is a chat message; with the fake backend, turns
+# matching `fake_tool` get a tool call as their reply, which dispatches the bench_echo tool.
+TURN_SCRIPTS = [
+    {"name": "small-talk",
+     "turns": ["Hi Amber, how are you today?",
+               "Write two sentences about the ocean.",
+               "Now make them rhyme.",
+               "Thanks, that's all."]},
+    {"name": "tools",
+     "turns": ["Open the calculator",
+               "What's the weather like in Lisbon?",
+               "And in Porto?",
+               "Find my notes about the quarterly report"]},
+    {"name": "long-context",
+     "turns": ["Here is my plan for the week: " + "review the budget, call the bank, draft the memo; " * 40,
+               "Which of those should I do first?",
+               "Summarize the plan in one line."]},
+]
+FAKE_TOOL_RE = r"^(open|find|what's the weather|and in)\b"
+BENCH_TOOL = {"name": "bench_echo", "description": "Benchmark tool: prints its arguments.",
+              "parameters": {"type": "object", "properties": {"text": {"type": "string"}}}}
+ROUTING_DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "routing-eval.jsonl")
+TURN_METRICS = ("startup_s", "ttft_p50_ms", "ttft_p95_ms", "latency_p50_ms", "latency_p95_ms",
+                "tool_p50_ms", "peak_rss_mb")
+
+
+# --- HELPERS ---
+def percentile(values, pct):
+    if not values: return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+class _Client:
+    """Blocking request/response over a protocol connection (shared by many threads)."""
+    def __init__(self, conn):
+        self.conn = conn
+        self.conn.on_event = self._on_event
+        self.waiting = {}
+        self._ids = iter(range(1, 1 << 62))
+        self._lock = threading.Lock()
+
+    def _on_event(self, ev):
+        slot = self.waiting.get(ev.get("id"))
+        if slot: slot(ev)
+
+    def chat(self, content, session, max_tokens, priority="interactive"):
+        """Returns (ttft, latency, tokens)."""
+        r = self.request({"op": "chat", "content": content, "session": session,
+                          "max_tokens": max_tokens, "priority": priority})
+        return r["ttft"], r["latency"], r["tokens"]
+
+    def request(self, req):
+        """Sends `req` and waits for "done": {ttft, latency, tokens, metrics, tool}."""
+        with self._lock:
+            rid = f"b{next(self._ids)}"
+        done = threading.Event()
+        result = {"first": None, "tokens": 0, "error": None, "metrics": {}, "tool": None}
+
+        def on_event(ev):
+            kind = ev.get("event")
+            if kind == "token" and result["first"] is None:
+                result["first"] = time.perf_counter()
+            elif kind == "metrics":
+                result["metrics"] = ev
+            elif kind == "tool":
+                result["tool"] = ev.get("output")
+            elif kind in ("done", "error"):
+                result["tokens"] = ev.get("tokens", 0)
+                result["error"] = ev.get("message") if kind == "error" else None
+                done.set()
+
+        self.waiting[rid] = on_event
+        start = time.perf_counter()
+        self.conn.send({"id": rid, **req})
+        done.wait()
+        end = time.perf_counter()
+        self.waiting.pop(rid, None)
+        if result["error"]: raise RuntimeError(result["error"])
+        return {"ttft": (result["first"] or end) - start, "latency": end - start, "tokens": result["tokens"],
+                "metrics": result["metrics"], "tool": result["tool"]}
+
+
+# --- LOAD GENERATOR ---
+def run_level(client, concurrency, requests, max_tokens, background=0, background_tokens=512):
+    ttfts, latencies, tokens = [], [], []
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def background_user(i):
+        while not stop.is_set():
+            client.chat("Summarize my inbox in detail.", f"bench-bg-{i}", background_tokens, "background")
+
+    def user(i):
+        for n in range(requests):
+            prompt = LOAD_PROMPTS[(i + n) % len(LOAD_PROMPTS)]
+            ttft, latency, toks = client.chat(prompt, f"bench-{concurrency}-{i}", max_tokens)
+            with lock:
+                ttfts.append(ttft); latencies.append(latency); tokens.append(toks)
+
+    filler = [threading.Thread(target=background_user, args=(i,), daemon=True) for i in range(background)]
+    for t in filler: t.start()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(concurrency)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    wall = time.perf_counter() - start
+    stop.set()
+    for t in filler: t.join()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "tokens": sum(tokens),
+        "wall_s": round(wall, 3),
+        "tok_per_s": round(sum(tokens) / wall, 1) if wall else 0.0,
+        "ttft_p50_ms": round(percentile(ttfts, 50) * 1000, 1),
+        "ttft_p95_ms": round(percentile(ttfts, 95) * 1000, 1),
+        "latency_p95_ms": round(percentile(latencies, 95) * 1000, 1),
+    }
+
+def load_main(args):
+    if args.daemon:
+        conn = daemon.SocketConnection(daemon.SOCKET_PATH)
+        print(f"🔹 Benchmarking daemon at {daemon.SOCKET_PATH}")
+        host = None
+    else:
+        overrides = {}
+        if (args.engine or "").lower() == "fake":
+            overrides = {"fake_decode_ms": args.fake_decode_ms, "fake_prefill_ms": args.fake_prefill_ms}
+            print("🔹 Fake backend: every batched step costs --fake-decode-ms, so tok/s scales with the batch "
+                  "by construction; this measures the scheduler, not the model")
+        host = ai.start_host(args, overrides)
+        host.runner.loaded.result()
+        conn = daemon.LocalConnection(host)
+    client = _Client(conn)
+
+    results = []
+    print(f"{'conc':>5} {'reqs':>5} {'tokens':>7} {'tok/s':>8} {'ttft p50':>9} {'ttft p95':>9} {'lat p95':>9}")
+    for c in [int(x) for x in args.concurrency.split(",")]:
+        r = run_level(client, c, args.requests, args.max_tokens, args.background, args.background_tokens)
+        results.append(r)
+        print(f"{r['concurrency']:>5} {r['requests']:>5} {r['tokens']:>7} {r['tok_per_s']:>8} "
+              f"{r['ttft_p50_ms']:>7}ms {r['ttft_p95_ms']:>7}ms {r['latency_p95_ms']:>7}ms")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    conn.close()
+    if host: host.runner.shutdown()
+
+
+# --- STREAM MICROBENCHMARK ---
+def synthetic_stream(n_tokens, think_fraction=0.9, seed=0):
+    """Token-sized chunks: one long reasoning block followed by the answer."""
+    rng = random.Random(seed)
+    words = ["the", " user", " wants", " to", " open", " a", " file", ",", " so", " I", " should", "\n"]
+    n_think = int(n_tokens * think_fraction)
+    chunks = ["<", "think", ">"]
+    chunks += [rng.choice(words) for _ in range(n_think)]
+    chunks += ["</", "think", ">\n\n"]
+    chunks += [rng.choice(words) for _ in range(n_tokens - n_think)]
+    return chunks
+
+def legacy_filter(chunks):
+    """The REPL's original suppression loop (growing buffer, full rescans), output discarded."""
+    output_buffer, is_thinking = "", False
+    for chunk in chunks:
+        output_buffer += chunk
+        if not is_thinking:
+            if "<think>" in output_buffer:
+                output_buffer = output_buffer.split("<think>", 1)[1]
+                is_thinking = True
+            elif not any(output_buffer.endswith(x) for x in ["<", "<t", "<th", "<thi", "<thin", "<think"]):
+                output_buffer = ""
+        elif "</think>" in output_buffer:
+            output_buffer = output_buffer.split("</think>", 1)[1]
+            is_thinking = False
+            output_buffer = ""
+        yield
+
+def think_filter(chunks):
+    f = ThinkFilter()
+    for chunk in chunks:
+        f.feed(chunk)
+        yield
+
+def per_chunk_costs(run, chunks, windows):
+    """Mean microseconds per chunk in each of `windows` equal slices of the stream."""
+    size = max(1, len(chunks) // windows)
+    costs, it = [], run(chunks)
+    for w in range(windows):
+        start = time.perf_counter()
+        for _ in range(size): next(it, None)
+        costs.append((time.perf_counter() - start) / size * 1e6)
+    return costs
+
+class _Counting(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.flushes = 0
+    def flush(self):
+        self.flushes += 1
+
+def stream_main(args):
+    chunks = synthetic_stream(args.tokens)
+    print(f"🔹 {len(chunks)} chunks ({sum(map(len, chunks))} chars), {args.windows} windows")
+    rows = [("think filter", per_chunk_costs(think_filter, chunks, args.windows))]
+    if not args.skip_legacy:
+        rows.append(("legacy buffer", per_chunk_costs(legacy_filter, chunks, args.windows)))
+    for name, costs in rows:
+        print(f"{name:>14}: first {costs[0]:.2f}µs  last {costs[-1]:.2f}µs  "
+              f"max {max(costs):.2f}µs per chunk  (last/first {costs[-1] / costs[0]:.1f}x)")
+
+    # Terminal writes at a simulated decode rate: per-token print(flush=True) vs. frames
+    clock = iter(i / args.tok_per_s for i in range(len(chunks) + 2))
+    sink = _Counting()
+    writer = FrameWriter(sink, fps=args.fps, clock=lambda: next(clock))
+    for chunk in chunks: writer.write(chunk)
+    writer.flush()
+    print(f"{'renderer':>14}: {len(chunks)} flushes per-token vs {sink.flushes} at {args.fps} fps "
+          f"({args.tok_per_s:.0f} tok/s)")
+
+
+# --- MEMORY ---
+def memory_main(args):
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory(dir=args.dir) as root:
+        store = memory.MemoryStore(root, memory.HashEmbedder(args.dim),
+                                   index_factory=memory.MLXIndex if args.mlx else memory.NumpyIndex)
+        t0 = time.perf_counter()
+        for start in range(0, args.entries, args.batch):
+            n = min(args.batch, args.entries - start)
+            vecs = rng.standard_normal((n, args.dim), dtype=np.float32)
+            vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+            store.add([f"memory {start + i}" for i in range(n)], vectors=vecs)
+        print(f"🔹 {args.entries:,} x {args.dim} float16 ({os.path.getsize(store.vec_path) / 2**20:.0f} MB) "
+              f"stored in {time.perf_counter() - t0:.1f}s, index: {type(store.index).__name__}")
+
+        queries = rng.standard_normal((args.queries + 1, args.dim), dtype=np.float32)
+        store.search_vector(queries[0], args.k, min_score=-1)   # upload / warm up
+        times = []
+        for q in queries[1:]:
+            t = time.perf_counter()
+            store.search_vector(q, args.k, min_score=-1)
+            times.append((time.perf_counter() - t) * 1000)
+        print(f"{'top-' + str(args.k):>8}: p50 {percentile(times, 50):.2f}ms  p99 {percentile(times, 99):.2f}ms  "
+              f"max {max(times):.2f}ms over {args.queries} queries")
+        t = time.perf_counter()
+        store.embedder.embed(["where does my sister live and what music does she like?"])
+        print(f"{'embed':>8}: {(time.perf_counter() - t) * 1000:.2f}ms per query ({store.embedder.name})")
+        store.close()
+
+
+# --- END-TO-END TURNS ---
+def peak_rss_mb():
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 1024   # bytes on macOS, KB on Linux
+
+def install_bench_tool(tmpdir):
+    """Registers bench_echo: a real subprocess dispatch through agent.py, without side effects."""
+    path = os.path.join(tmpdir, "bench_echo.py")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("import sys, json\nprint('echo', json.loads(sys.argv[2]).get('text', ''))\n")
+    ai.agent.registry[BENCH_TOOL["name"]] = {"path": path, "meta": BENCH_TOOL}
+
+def load_scripts(path):
+    if not path: return TURN_SCRIPTS
+    with open(path, "r", encoding="utf-8") as f:
+        scripts = json.load(f)
+    return scripts if isinstance(scripts, list) else scripts["scripts"]
+
+def replay(client, scripts, max_tokens, repeat, forget=None, count_tokens=None):
+    """
+    [{script, turn, ttft_ms, latency_ms, tool_ms, tokens, ...}], medians over `repeat` runs.
+    `forget()` runs before each repeat so no run is served from the KV an earlier one left
+    behind; with `count_tokens`, rows also carry the tokens of the user's message and the
+    smallest prefill seen, to check that against.
+    """
+    samples = {}
+    for _ in range(repeat):
+        if forget: forget()
+        for script in scripts:
+            session = f"bench-turns-{script['name']}"
+            client.request({"op": "reset", "session": session})
+            for i, content in enumerate(script["turns"]):
+                r = client.request({"op": "chat", "content": content, "session": session, "max_tokens": max_tokens})
+                m = r["metrics"]
+                samples.setdefault((script["name"], i), []).append({
+                    "ttft_ms": r["ttft"] * 1000, "latency_ms": r["latency"] * 1000,
+                    "tool_ms": m["tool_s"] * 1000 if m.get("tool_s") is not None else None,
+                    "tokens": r["tokens"], "prefill_tokens": m.get("prefill_tokens"),   # None: no generation
+                    "peak_mem_mb": m.get("peak_mem_mb") or 0})
+    rows = []
+    for (name, i), runs in samples.items():
+        row = {"script": name, "turn": i + 1}
+        for key in runs[0]:
+            vals = [r[key] for r in runs if r[key] is not None]
+            row[key] = round(statistics.median(vals), 2) if vals else None
+        if count_tokens:
+            prefills = [r["prefill_tokens"] for r in runs if r["prefill_tokens"] is not None]
+            row["min_prefill"] = min(prefills) if prefills else None
+            row["message_tokens"] = count_tokens(next(s for s in scripts if s["name"] == name)["turns"][i])
+        rows.append(row)
+    return rows
+
+def cached_turns(rows):
+    """Rows whose prefill was shorter than the user's own message: served from leftover KV."""
+    return [r for r in rows if r.get("min_prefill") is not None and r["min_prefill"] < r["message_tokens"]]
+
+def summarize_turns(rows, startup_s):
+    ttfts = [r["ttft_ms"] for r in rows]
+    latencies = [r["latency_ms"] for r in rows]
+    tools = [r["tool_ms"] for r in rows if r["tool_ms"] is not None]
+    return {"startup_s": round(startup_s, 3) if startup_s is not None else None,
+            "turns": len(rows),
+            "ttft_p50_ms": round(percentile(ttfts, 50), 2), "ttft_p95_ms": round(percentile(ttfts, 95), 2),
+            "latency_p50_ms": round(percentile(latencies, 50), 2),
+            "latency_p95_ms": round(percentile(latencies, 95), 2),
+            "tool_p50_ms": round(percentile(tools, 50), 2) if tools else None,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "engine_peak_mb": round(max((r["peak_mem_mb"] for r in rows), default=0), 1)}
+
+def compare(summary, baseline, threshold, floor_ms):
+    """[(metric, baseline, now, change, regressed)] for every metric both runs have."""
+    out = []
+    for key in TURN_METRICS:
+        old, new = baseline.get(key), summary.get(key)
+        if old is None or new is None: continue
+        change = (new - old) / old if old else 0.0
+        floor = floor_ms / 1000 if key.endswith("_s") else 0 if key.endswith("_mb") else floor_ms
+        out.append((key, old, new, change, change > threshold and new - old > floor))
+    return out
+
+def turns_main(args):
+    scripts = load_scripts(args.script)
+    fake = (args.engine or "").lower() == "fake"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if args.daemon:
+            conn = daemon.SocketConnection(daemon.SOCKET_PATH)
+            print(f"🔹 Benchmarking daemon at {daemon.SOCKET_PATH} (startup not measured)")
+            host, startup = None, None
+        else:
+            overrides = {}
+            if fake:
+                install_bench_tool(tmpdir)
+                call = json.dumps({"tool": BENCH_TOOL["name"], "args": {"text": "bench"}})
+                overrides = {"fake_decode_ms": args.fake_decode_ms, "fake_prefill_ms": args.fake_prefill_ms,
+                             "fake_responses": [[FAKE_TOOL_RE, call]]}
+            t0 = time.perf_counter()
+            host = ai.start_host(args, overrides)
+            host.runner.loaded.result()
+            startup = time.perf_counter() - t0
+            conn = daemon.LocalConnection(host)
+        client = _Client(conn)
+        forget = count = None
+        if host:
+            forget, count = host.forget_shared_kv, host.runner.engine.count_tokens
+        elif args.repeat > 1 or args.warmup:
+            print("⚠️  The daemon's shared prefixes can't be cleared from here: repeats after the first "
+                  "may reuse KV from earlier runs")
+        if args.warmup:
+            replay(client, scripts[:1], args.max_tokens, 1)
+        rows = replay(client, scripts, args.max_tokens, args.repeat, forget=forget, count_tokens=count)
+        conn.close()
+        if host: host.runner.shutdown()
+
+    summary = summarize_turns(rows, startup)
+    print(f"{'script':<14} {'turn':>4} {'prefill':>8} {'tokens':>7} {'ttft':>10} {'latency':>10} {'tool':>10}")
+    for r in rows:
+        tool = f"{r['tool_ms']:.1f}ms" if r["tool_ms"] is not None else "-"
+        prefill = f"{r['prefill_tokens']:.0f}" if r["prefill_tokens"] is not None else "-"
+        print(f"{r['script']:<14} {r['turn']:>4} {prefill:>8} {r['tokens']:>7.0f} "
+              f"{r['ttft_ms']:>8.1f}ms {r['latency_ms']:>8.1f}ms {tool:>10}")
+    startup = f"{summary['startup_s']:.2f}s" if summary["startup_s"] is not None else "-"
+    print(f"🔹 startup {startup} · ttft p50 {summary['ttft_p50_ms']}ms p95 {summary['ttft_p95_ms']}ms · "
+          f"latency p50 {summary['latency_p50_ms']}ms p95 {summary['latency_p95_ms']}ms · "
+          f"peak RSS {summary['peak_rss_mb']} MB")
+
+    cached = cached_turns(rows)
+    if cached:
+        for r in cached:
+            print(f"❌ {r['script']} turn {r['turn']}: prefilled {r['min_prefill']} tokens, its message alone "
+                  f"has {r['message_tokens']}")
+        print("❌ Some turns were served from KV left by earlier runs; these numbers don't measure real turns")
+        sys.exit(1)
+
+    result = {"engine": args.engine or "manifest", "weights": args.weights, "repeat": args.repeat,
+              "summary": summary, "turns": rows}
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"🔹 Baseline saved to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            base = json.load(f)
+        if base.get("engine") != result["engine"]:
+            print(f"⚠️  Baseline was recorded with engine '{base.get('engine')}', this run used '{result['engine']}'")
+        regressions = 0
+        for key, old, new, change, regressed in compare(summary, base.get("summary", {}), args.threshold, args.floor_ms):
+            regressions += regressed
+            print(f"{'❌' if regressed else '✅'} {key:<15} {old:>10} → {new:<10} ({change:+.1%})")
+        if regressions:
+            print(f"❌ {regressions} metric(s) regressed more than {args.threshold:.0%}")
+            sys.exit(1)
+
+
+# --- TOOL ROUTING EVAL ---
+def compact_catalog(registry):
+    """Catalog variant: first sentence of each description, argument names only."""
+    lines = []
+    for name, entry in sorted(registry.items()):
+        meta = entry.get("meta") or {}
+        desc = re.split(r"(?<=[.!?])\s|\n", (meta.get("description") or "").strip(), maxsplit=1)[0]
+        args = ", ".join(meta.get("parameters", {}).get("properties", {}))
+        lines.append(f'- "{name}": {desc} [Args: {args}]')
+    return ("\n\n[AVAILABLE TOOLS]\nReply with {\"tool\": \"name\", \"args\": {...}} to use one:\n"
+            + "\n".join(lines))
+
+def routing_configs(names, config_file=None):
+    """
+    {name: {"system", "profile", "think", "max_tokens", "dispatcher"}}; profile None = route
+    like chat does, dispatcher = the manifest's dispatcher model answers first, as in chat.
+    """
+    system = ai.build_system_prompt()
+    registry = getattr(ai.agent, "registry", {})
+    addendum = ai.agent.get_system_prompt_addendum() if hasattr(ai.agent, "get_system_prompt_addendum") else ""
+    builtin = {
+        "default": {"system": system},
+        "chat": {"system": system, "profile": "chat"},
+        "tool-call": {"system": system, "profile": "tool_call"},
+        "compact": {"system": system.replace(addendum, compact_catalog(registry)) if addendum else system},
+        "no-think": {"system": system, "think": False},
+        "dispatcher": {"system": system, "dispatcher": True},
+    }
+    if config_file:
+        with open(config_file, "r", encoding="utf-8") as f:
+            for c in json.load(f):
+                if c.get("system_file"):
+                    with open(c["system_file"], "r", encoding="utf-8") as sf:
+                        c["system"] = sf.read()
+                builtin[c["name"]] = {"system": c.get("system") or system, **{k: c[k] for k in
+                                      ("profile", "think", "max_tokens", "dispatcher") if k in c}}
+    unknown = [n for n in names if n not in builtin]
+    if unknown:
+        raise SystemExit(f"❌ Unknown config(s) {', '.join(unknown)}; have: {', '.join(builtin)}")
+    return {n: builtin[n] for n in names}
+
+def _norm(value):
+    if isinstance(value, str): return value.strip().strip(".!?").casefold()
+    if isinstance(value, list): return [_norm(v) for v in value]
+    if isinstance(value, dict): return {k: _norm(v) for k, v in value.items() if v not in ("", None, [], {})}
+    return value
+
+def score_call(expect, call, reply, registry):
+    """(tool_ok, args_ok, malformed) for one reply."""
+    attempted = '"tool"' in reply or "'tool'" in reply or reply.lstrip().startswith("{")
+    malformed = (call is None and attempted) or (call is not None and call["tool"] not in registry)
+    if expect is None:
+        return call is None and not malformed, call is None and not malformed, malformed
+    tool_ok = call is not None and call["tool"] == expect["tool"]
+    return tool_ok, tool_ok and _norm(call.get("args") or {}) == _norm(expect.get("args") or {}), malformed
+
+def routing_decisions(dispatcher, cases, path, concurrency):
+    """{id: dispatcher decision} for every case; kept in `path`, so a rerun only decides what is missing."""
+    batch.completed_ids(path)   # cuts a torn last line
+    decisions = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            decisions = {d["id"]: d for d in map(json.loads, f)}
+
+    def decide(case):
+        if not dispatcher.applies(case["utterance"]):
+            return {"id": case["id"], "route": "chat", "reason": "skipped", "call": None, "reply": "",
+                    "confidence": None, "latency_s": 0.0, "tokens": 0}
+        d = dispatcher.decide(case["utterance"])
+        return {"id": case["id"], "route": d.route, "reason": d.reason, "call": d.call, "reply": d.reply,
+                "confidence": d.confidence, "latency_s": d.latency_s, "tokens": d.tokens}
+
+    todo = [c for c in cases if c["id"] not in decisions]
+    with open(path, "a", encoding="utf-8") as f, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for d in pool.map(decide, todo):
+            f.write(json.dumps(d, ensure_ascii=False) + "\n")
+            decisions[d["id"]] = d
+    return decisions
+
+def routing_main(args):
+    with open(args.dataset, "r", encoding="utf-8") as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+    registry = getattr(ai.agent, "registry", {})
+    missing = sorted({c["expect"]["tool"] for c in cases if c.get("expect")} - set(registry))
+    if missing:
+        print(f"⚠️  Dataset expects tools that are not registered: {', '.join(missing)}")
+    names = args.configs.split(",")
+    configs = routing_configs(names, args.config_file)
+    if any(c.get("dispatcher") for c in configs.values()) and "default" not in configs:
+        configs = {**routing_configs(["default"]), **configs}   # the baseline the dispatcher is measured against
+
+    overrides = {}
+    if (args.engine or "").lower() == "fake":
+        overrides = {"fake_decode_ms": args.fake_decode_ms, "fake_prefill_ms": args.fake_prefill_ms}
+    host = ai.start_host(args, overrides)
+    host.runner.loaded.result()
+    default_system = host.system_prompt
+    dispatcher = host.dispatcher()
+    if dispatcher is None and any(c.get("dispatcher") for c in configs.values()):
+        host.runner.shutdown()
+        raise SystemExit("❌ The manifest has no dispatcher model (see dispatch.py)")
+
+    out_dir = args.keep or tempfile.mkdtemp(prefix="amber-routing-")
+    os.makedirs(out_dir, exist_ok=True)
+    report, failures = [], {}
+    try:
+        for name, cfg in configs.items():
+            path = os.path.join(out_dir, f"{name}.jsonl")
+            decisions = {}
+            if cfg.get("dispatcher"):
+                decisions = routing_decisions(dispatcher, cases, os.path.join(out_dir, f"{name}.dispatch.jsonl"),
+                                              args.concurrency)
+            # Dispatched calls never reach the chat model; escalations are answered as in chat
+            chat_cases = [c for c in cases if decisions.get(c["id"], {}).get("route") != "tool"]
+            items = [(c["id"], {"prompt": c["utterance"], "system": cfg["system"],
+                                "profile": cfg.get("profile") or route_profile(c["utterance"], registry),
+                                "think": cfg.get("think"), "max_tokens": cfg.get("max_tokens")})
+                     for c in chat_cases]
+            done = batch.completed_ids(path)
+            runner = batch.BatchRunner(host.runner, default_system, path, parse_tools=ai.agent.parse_intent,
+                                       concurrency=args.concurrency, report=lambda line: None)
+            runner.run([(rid, rec) for rid, rec in items if rid not in done])
+            with open(path, "r", encoding="utf-8") as f:
+                results = {r["id"]: r for r in map(json.loads, f)}
+            for rid, d in decisions.items():
+                if d["route"] == "tool":
+                    results[rid] = {"id": rid, "reply": d["reply"], "tool_call": d["call"], "tokens": d["tokens"],
+                                    "prefill_tokens": None, "latency_s": d["latency_s"]}
+                elif rid in results:
+                    results[rid] = {**results[rid], "latency_s": results[rid]["latency_s"] + d["latency_s"]}
+
+            tool_ok = args_ok = malformed = false_calls = missed = 0
+            expected_calls = sum(1 for c in cases if c.get("expect"))
+            for c in cases:
+                r = results[c["id"]]
+                t, a, m = score_call(c.get("expect"), r.get("tool_call"), r["reply"], registry)
+                tool_ok += t; args_ok += a and bool(c.get("expect")); malformed += m
+                false_calls += c.get("expect") is None and r.get("tool_call") is not None
+                missed += bool(c.get("expect")) and r.get("tool_call") is None
+                if not (t and a):
+                    failures.setdefault(name, []).append((c["id"], c.get("expect"), r.get("tool_call"), r["reply"]))
+            latencies = [results[c["id"]]["latency_s"] * 1000 for c in cases]
+            report.append({
+                "config": name, "cases": len(cases),
+                "tool_acc": round(tool_ok / len(cases), 3),
+                "args_acc": round(args_ok / expected_calls, 3) if expected_calls else None,
+                "malformed_rate": round(malformed / len(cases), 3),
+                "false_calls": false_calls, "missed_calls": missed,
+                "tokens_per_call": round(statistics.mean(results[c["id"]]["tokens"] for c in cases), 1),
+                "prefill_per_call": round(statistics.mean([results[c["id"]]["prefill_tokens"] for c in chat_cases]
+                                                          or [0]), 1),
+                "system_tokens": host.runner.engine.count_tokens(cfg["system"]),
+                "latency_p50_ms": round(percentile(latencies, 50), 1),
+                "latency_p95_ms": round(percentile(latencies, 95), 1),
+                "dispatched": sum(d["route"] == "tool" for d in decisions.values()) if decisions else None,
+                "dispatch_p50_ms": round(percentile([d["latency_s"] * 1000 for d in decisions.values()
+                                                     if d["reason"] != "skipped"] or [0], 50), 1)
+                                   if decisions else None,
+            })
+    finally:
+        host.runner.shutdown()
+
+    print(f"{'config':<12} {'tool':>6} {'args':>6} {'malformed':>9} {'false':>6} {'missed':>6} "
+          f"{'tok/call':>8} {'sys tok':>8} {'p50':>9} {'p95':>9}")
+    for r in report:
+        args_acc = f"{r['args_acc']:.0%}" if r["args_acc"] is not None else "-"
+        print(f"{r['config']:<12} {r['tool_acc']:>6.0%} {args_acc:>6} {r['malformed_rate']:>9.0%} "
+              f"{r['false_calls']:>6} {r['missed_calls']:>6} {r['tokens_per_call']:>8} {r['system_tokens']:>8} "
+              f"{r['latency_p50_ms']:>7}ms {r['latency_p95_ms']:>7}ms")
+    base = next((r for r in report if r["config"] == "default"), None)
+    for r in report:
+        if r["dispatched"] is None: continue
+        print(f"🔹 {r['config']}: {r['dispatched']}/{r['cases']} dispatched without the chat model "
+              f"(dispatcher p50 {r['dispatch_p50_ms']}ms), the rest escalated")
+        if base:
+            print(f"   vs default: tool {(r['tool_acc'] - base['tool_acc']) * 100:+.1f} pts, p50 "
+                  f"{r['latency_p50_ms'] - base['latency_p50_ms']:+.1f}ms, p95 "
+                  f"{r['latency_p95_ms'] - base['latency_p95_ms']:+.1f}ms")
+    if args.show_failures:
+        for name, rows in failures.items():
+            print(f"\n🔹 {name}: {len(rows)} miss(es)")
+            for rid, expect, got, reply in rows:
+                print(f"   {rid:<16} expected {json.dumps(expect)} got {json.dumps(got)}"
+                      + ("" if got else f"  reply: {reply[:60]!r}"))
+    print(f"🔹 Raw replies in {out_dir}" + ("" if args.keep else " (pass --keep DIR to reuse them)"))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+# --- CLI ---
+def main():
+    parser = argparse.ArgumentParser(description="Amber benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("load", help="Concurrent sessions: aggregate tokens/sec and TTFT")
+    p.add_argument("--weights", type=str, default="qwen.npz", help="Path to qwen.npz")
+    p.add_argument("--engine", type=str, default=None, help="Override the manifest's engine (mlx, cpu, fake)")
+    p.add_argument("--no-draft", action="store_true", help="Disable speculative decoding")
+    p.add_argument("--context-budget", type=int, default=ai.DEFAULT_BUDGET)
+    p.add_argument("--max-batch", type=int, default=16, help="Concurrent generations decoded together")
+    p.add_argument("--background-stride", type=int, default=ai.BACKGROUND_STRIDE)
+    p.add_argument("--starvation-steps", type=int, default=ai.STARVATION_STEPS)
+    p.add_argument("--background", type=int, default=0, help="Background sessions generating during each level")
+    p.add_argument("--background-tokens", type=int, default=512, help="Token budget of each background request")
+    p.add_argument("--daemon", action="store_true", help="Benchmark a running `ai.py serve` instead")
+    p.add_argument("--concurrency", type=str, default="1,2,4,8,16", help="Comma-separated levels")
+    p.add_argument("--requests", type=int, default=4, help="Requests per simulated user")
+    p.add_argument("--max-tokens", type=int, default=128)
+    p.add_argument("--fake-decode-ms", type=float, default=20.0, help="Fake backend: cost per batched decode step")
+    p.add_argument("--fake-prefill-ms", type=float, default=0.05, help="Fake backend: cost per prefilled token")
+    p.add_argument("--json", type=str, default=None, help="Also write results to this file")
+    p.set_defaults(func=load_main)
+
+    p = sub.add_parser("stream", help="Think filter and renderer cost on a long token stream")
+    p.add_argument("--tokens", type=int, default=100_000)
+    p.add_argument("--windows", type=int, default=10, help="Slices of the stream to time separately")
+    p.add_argument("--fps", type=int, default=30)
+    p.add_argument("--tok-per-s", type=float, default=60.0, help="Simulated decode rate for the renderer")
+    p.add_argument("--skip-legacy", action="store_true", help="Do not time the original buffer loop")
+    p.set_defaults(func=stream_main)
+
+    p = sub.add_parser("memory", help="Long-term memory query latency")
+    p.add_argument("--entries", type=int, default=1_000_000)
+    p.add_argument("--dim", type=int, default=384, help="Embedding size (all-MiniLM-L6-v2: 384)")
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--k", type=int, default=memory.TOP_K * 4, help="Candidates per query (search uses 4x TOP_K)")
+    p.add_argument("--batch", type=int, default=50_000, help="Entries per insert")
+    p.add_argument("--mlx", action="store_true", help="Measure the MLX index (AMBER_MEMORY_INDEX=mlx)")
+    p.add_argument("--dir", type=str, default=None, help="Where to build the temporary store")
+    p.set_defaults(func=memory_main)
+
+    p = sub.add_parser("turns", help="End-to-end turn latency over scripted conversations, vs a baseline")
+    p.add_argument("--weights", type=str, default="qwen.npz", help="Path to qwen.npz")
+    p.add_argument("--engine", type=str, default=None, help="Override the manifest's engine (mlx, cpu, fake)")
+    p.add_argument("--no-draft", action="store_true", help="Disable speculative decoding")
+    p.add_argument("--context-budget", type=int, default=ai.DEFAULT_BUDGET)
+    p.add_argument("--max-batch", type=int, default=16)
+    p.add_argument("--background-stride", type=int, default=ai.BACKGROUND_STRIDE)
+    p.add_argument("--starvation-steps", type=int, default=ai.STARVATION_STEPS)
+    p.add_argument("--daemon", action="store_true", help="Benchmark a running `ai.py serve` instead")
+    p.add_argument("--prefix-cache-mb", type=float, default=ai.prefixcache.BUDGET_MB, metavar="MB",
+                   help="Shared-prefix tree per model (cleared before every repeat); 0 disables")
+    p.add_argument("--script", type=str, default=None,
+                   help='JSON list of {"name": ..., "turns": [...]} (default: built-in conversations)')
+    p.add_argument("--repeat", type=int, default=3, help="Runs per script; each turn reports the median")
+    p.add_argument("--warmup", action="store_true", help="Replay the first script once before measuring")
+    p.add_argument("--max-tokens", type=int, default=256)
+    p.add_argument("--fake-decode-ms", type=float, default=0.0, help="Fake backend: cost per batched decode step")
+    p.add_argument("--fake-prefill-ms", type=float, default=0.0, help="Fake backend: cost per prefilled token")
+    p.add_argument("--baseline", type=str, default=None, help="Compare against this saved run")
+    p.add_argument("--save-baseline", type=str, default=None, help="Save this run as the baseline")
+    p.add_argument("--threshold", type=float, default=0.10, help="Relative slowdown that counts as a regression")
+    p.add_argument("--floor-ms", type=float, default=2.0, help="Ignore slowdowns smaller than this (noise)")
+    p.add_argument("--json", type=str, default=None, help="Also write results to this file")
+    p.set_defaults(func=turns_main)
+
+    p = sub.add_parser("routing", help="Tool-routing accuracy and latency per configuration")
+    p.add_argument("--weights", type=str, default="qwen.npz", help="Path to qwen.npz")
+    p.add_argument("--engine", type=str, default=None, help="Override the manifest's engine (mlx, cpu, fake)")
+    p.add_argument("--no-draft", action="store_true", help="Disable speculative decoding")
+    p.add_argument("--context-budget", type=int, default=ai.DEFAULT_BUDGET)
+    p.add_argument("--max-batch", type=int, default=8)
+    p.add_argument("--background-stride", type=int, default=ai.BACKGROUND_STRIDE)
+    p.add_argument("--starvation-steps", type=int, default=ai.STARVATION_STEPS)
+    p.add_argument("--dataset", type=str, default=ROUTING_DATASET,
+                   help='JSONL of {"id", "utterance", "expect": {"tool", "args"} | null}')
+    p.add_argument("--configs", type=str, default="default",
+                   help="Comma-separated: default, chat, tool-call, compact, no-think, dispatcher "
+                        "(+ --config-file names)")
+    p.add_argument("--config-file", type=str, default=None,
+                   help='JSON list of {"name", "system" | "system_file", "profile", "think", "max_tokens", '
+                        '"dispatcher"}')
+    p.add_argument("--concurrency", type=int, default=1, help="Utterances decoded together (1 = true per-call latency)")
+    p.add_argument("--keep", type=str, default=None, metavar="DIR",
+                   help="Keep raw replies here; a rerun only runs what is missing")
+    p.add_argument("--show-failures", action="store_true", help="List every mis-routed utterance")
+    p.add_argument("--fake-decode-ms", type=float, default=0.0)
+    p.add_argument("--fake-prefill-ms", type=float, default=0.0)
+    p.add_argument("--json", type=str, default=None, help="Also write results to this file")
+    p.set_defaults(func=routing_main)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,8 @@ set -euo pipefail
 # - Uses Python from .venv if available, otherwise system Python 3.12
 # - Defaults to MLX manifest qwen.npz
 # - STREAM=1 enables JSON stream mode for GUI
+# - SERVE=1 starts the shared model daemon; later chats connect to it
+# - RESUME=<name> continues a saved conversation (created if new)
 # ===============================================
 
 ROOT="${ROOT:-$HOME/Developer/llm}"
@@ -32,6 +34,11 @@ fi
 [ -f "$AI" ] || { echo "❌ Missing ai.py at $AI"; exit 1; }
 [ -f "$WEIGHTS" ] || { echo "❌ Missing weights manifest ($WEIGHTS)"; exit 1; }
 
+# --- stream mode: stdout carries only protocol lines, banners go to stderr ---
+if [ "${STREAM:-0}" = "1" ]; then
+  exec 3>&1 1>&2
+fi
+
 # --- summary ---
 echo "🔹 Launching AgentF (MLX)"
 echo "   Python: $PY"
@@ -40,9 +47,15 @@ echo "   Agent: $AGENT"
 echo
 
 # --- run mode ---
-if [ "${STREAM:-0}" = "1" ]; then
-  echo "🌀 Stream mode enabled (JSON stdin)"
-  exec "$PY" "$AI" chat --weights "$WEIGHTS" --agent "$AGENT" --stream
+if [ "${SERVE:-0}" = "1" ]; then
+  echo "🛰  Daemon mode (shared model on a Unix socket)"
+  exec "$PY" "$AI" serve --weights "$WEIGHTS" --agent "$AGENT"
+elif [ "${STREAM:-0}" = "1" ]; then
+  echo "🌀 Stream mode enabled (JSON lines on stdin/stdout)"
+  exec "$PY" "$AI" chat --weights "$WEIGHTS" --agent "$AGENT" --stream 1>&3 3>&-
+elif [ -n "${RESUME:-}" ]; then
+  echo "💾 Session: $RESUME"
+  exec "$PY" "$AI" chat --weights "$WEIGHTS" --agent "$AGENT" --resume "$RESUME"
 else
   exec "$PY" "$AI" chat --weights "$WEIGHTS" --agent "$AGENT"
 fi
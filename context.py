@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Token-budgeted conversation context for Amber.
+- Reasoning traces (<think>...</think>) never enter the history.
+- Old tool outputs are truncated; only the latest one is kept in full.
+- When the history exceeds its budget, the oldest turns are compacted into a rolling
+  summary on a background thread. A hard cap drops the oldest turns if a prompt is
+  needed before the summary is ready, so prompt size stays bounded either way.
+- An optional journal receives every change (turns and compactions) so a conversation
+  can be persisted as an append-only log and replayed with restore() (see sessions.py).
+"""
+import re
+import threading
+
+# --- CONFIGURATION ---
+DEFAULT_BUDGET = 8192        # tokens for summary + history (system prompt excluded)
+KEEP_RECENT = 6              # messages never compacted
+COMPACT_TARGET = 0.6         # compact down to this fraction of the budget
+TOOL_CHARS_LATEST = 4000     # latest tool output
+TOOL_CHARS_OLD = 400         # older tool outputs
+MESSAGE_OVERHEAD = 4         # role markers / separators per message
+
+SUMMARY_INSTRUCTIONS = (
+    "Summarize the conversation below in a few short bullet points. "
+    "Keep names, facts, user preferences, decisions and open tasks. /no_think"
+)
+
+THINK_RE = re.compile(r"<think>.*?(?:</think>|$)", re.DOTALL)
+
+
+# --- HELPERS ---
+def strip_think(text):
+    """Remove reasoning blocks (including an unterminated trailing one)."""
+    return THINK_RE.sub("", text or "").strip()
+
+def _clip(text, limit):
+    if len(text) <= limit: return text
+    head = limit * 2 // 3
+    return f"{text[:head]}\n…[{len(text) - limit} chars truncated]…\n{text[-(limit - head):]}"
+
+def extractive_summary(previous, turns, limit=1500):
+    """Model-free fallback: keep the first line of each compacted message."""
+    lines = [previous] if previous else []
+    for m in turns:
+        first = m["content"].strip().splitlines()[0] if m["content"].strip() else ""
+        if first:
+            lines.append(f"{m['role']}: {first[:160]}")
+    return _clip("\n".join(lines), limit)
+
+def make_summarizer(complete, max_tokens=None):
+    """Wrap a `complete(messages, profile, max_tokens)` callable (EngineThread.complete) as a summarizer."""
+    def summarize(previous, turns):
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in turns)
+        if previous:
+            transcript = f"Earlier summary:\n{previous}\n\nConversation:\n{transcript}"
+        msgs = [{"role": "system", "content": SUMMARY_INSTRUCTIONS},
+                {"role": "user", "content": transcript}]
+        return strip_think(complete(msgs, profile="summary", max_tokens=max_tokens))
+    return summarize
+
+
+# --- CONTEXT MANAGER ---
+class ContextManager:
+    def __init__(self, system_prompt, count_tokens, budget=DEFAULT_BUDGET, summarize=None, journal=None):
+        """
+        count_tokens: callable(str) -> int
+        summarize:    callable(previous_summary, messages) -> str, run off the main thread.
+        journal:      callable(record) receiving {"type": "turn", "role", "content"} and
+                      {"type": "summary", "summary", "dropped"} records.
+        """
+        self.system = {"role": "system", "content": system_prompt}
+        self.count_tokens = count_tokens
+        self.budget = budget
+        self.summarize = summarize or extractive_summary
+        self.journal = journal
+        self.summary = ""
+        self.summary_tokens = 0
+        self.turns = []            # [{"role", "content", "tokens"}]
+        self._lock = threading.Lock()
+        self._worker = None
+
+    # ---- bookkeeping
+    def _entry(self, role, content):
+        return {"role": role, "content": content,
+                "tokens": self.count_tokens(content) + MESSAGE_OVERHEAD}
+
+    def used_tokens(self):
+        return self.summary_tokens + sum(t["tokens"] for t in self.turns)
+
+    def add(self, role, content):
+        if role == "assistant":
+            content = strip_think(content)
+        elif role == "tool":
+            content = _clip(content, TOOL_CHARS_LATEST)
+        with self._lock:
+            self._append(role, content)
+        if self.journal:
+            self.journal({"type": "turn", "role": role, "content": content})
+        self._maybe_compact()
+
+    def _append(self, role, content):
+        if role == "tool":
+            # Only the newest tool output stays long
+            for i, t in enumerate(self.turns):
+                if t["role"] == "tool" and len(t["content"]) > TOOL_CHARS_OLD:
+                    self.turns[i] = self._entry("tool", _clip(t["content"], TOOL_CHARS_OLD))
+        self.turns.append(self._entry(role, content))
+
+    def restore(self, records):
+        """Rebuild the state from journal records (no summarization is triggered)."""
+        with self._lock:
+            for r in records:
+                if r.get("type") == "turn":
+                    self._append(r["role"], r["content"])
+                elif r.get("type") == "summary":
+                    self.turns = self.turns[int(r.get("dropped", 0)):]
+                    self.summary = r.get("summary", "")
+                    self.summary_tokens = self.count_tokens(self.summary) + MESSAGE_OVERHEAD
+
+    def messages(self):
+        """Prompt messages for the next turn, never exceeding the budget."""
+        with self._lock:
+            turns = list(self.turns)
+            summary = self.summary
+            used = self.summary_tokens + sum(t["tokens"] for t in turns)
+        # Hard cap: if a compaction is still pending, drop the oldest turns from this prompt
+        while used > self.budget and len(turns) > 1:
+            used -= turns.pop(0)["tokens"]
+        out = [self.system]
+        if summary:
+            out.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+        out.extend({"role": t["role"], "content": t["content"]} for t in turns)
+        return out
+
+    # ---- compaction
+    def _maybe_compact(self):
+        if self.used_tokens() <= self.budget: return
+        if self._worker and self._worker.is_alive(): return
+
+        with self._lock:
+            target = int(self.budget * COMPACT_TARGET)
+            used, cut = self.used_tokens(), 0
+            while used > target and len(self.turns) - cut > KEEP_RECENT:
+                used -= self.turns[cut]["tokens"]
+                cut += 1
+            if cut == 0: return
+            chunk = [{"role": t["role"], "content": t["content"]} for t in self.turns[:cut]]
+            previous = self.summary
+
+        self._worker = threading.Thread(target=self._compact, args=(previous, chunk), daemon=True)
+        self._worker.start()
+
+    def _compact(self, previous, chunk):
+        try:
+            summary = self.summarize(previous, chunk).strip()
+        except Exception:
+            summary = extractive_summary(previous, chunk)
+        # The summary itself may use at most a quarter of the budget
+        limit, n = self.budget // 4, self.count_tokens(summary)
+        if n > limit:
+            summary = _clip(summary, len(summary) * limit // n)
+        with self._lock:
+            # Turns are only ever appended, so the compacted chunk is still the head of the list
+            self.turns = self.turns[len(chunk):]
+            self.summary = summary
+            self.summary_tokens = self.count_tokens(summary) + MESSAGE_OVERHEAD
+            if self.journal:
+                self.journal({"type": "summary", "summary": summary, "dropped": len(chunk)})
+
+    def wait(self):
+        """Block until a pending compaction finishes (used on exit / in benchmarks)."""
+        if self._worker: self._worker.join()
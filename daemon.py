@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Amber inference daemon: one loaded model shared by every frontend.
+`ai.py serve` listens on a Unix socket. `ai.py chat` (and so chat.sh, the GUI terminal
+and FTerminal) connects to it when it is running and only loads its own copy otherwise.
+
+Protocol: one JSON object per line in each direction.
+  requests : {"id": "r1", "op": "chat", "content": "...", "session": "optional-name",
+              "profile": "chat" | "tool_call" | "summary", "max_tokens": 512, "stop": ["..."],
+              "sampling": {"temperature": 0.7, "top_p": 0.8, "top_k": 20},
+              "priority": "interactive" | "background", "think": true | false}
+             (profile settings come from the manifest; the other fields override them.
+              Without "profile", short tool dispatches get "tool_call", which never thinks.)
+             {"id": "r2", "op": "cancel", "target": "r1"}
+             {"id": "r3", "op": "tool", "call": {"tool": "...", "args": {...}}}
+             {"id": "r4", "op": "status"} | {"op": "ping"} | {"op": "reset", "session": "..."}
+             {"id": "r5", "op": "open", "session": "name"}    persistent session (log + KV snapshot);
+             {"id": "r6", "op": "close", "session": "name"}   chats then pass "persist": true
+  events   : {"id": "r1", "event": "status", "state": "queued" | "running", ...}
+             {"id": "r1", "event": "token", "text": "..."}
+             {"id": "r1", "event": "tool", "output": "..."}
+             {"id": "r1", "event": "metrics", "ttft_s": 0.21, "decode_tok_s": 31.5, ...}  (see metrics.py)
+             {"id": "r1", "event": "done", "text": "...", "tokens": 42, "thinking_tokens": 0,
+              "profile": "chat", "cancelled": false}
+             {"id": "r1", "event": "error", "message": "..."}
+             every request ends with exactly one "done" or "error"
+             {"id": "r5", "event": "status", "state": "open", "session": "name", "resumed": true, "turns": 12}
+The same handler drives the in-process REPL (LocalConnection) and `ai.py --stream`
+(the same protocol on stdin/stdout), so every frontend behaves identically.
+"""
+import os
+import json
+import socket
+import socketserver
+import threading
+import itertools
+
+from engine import CACHE_DIR
+
+# --- CONFIGURATION ---
+SOCKET_PATH = os.environ.get("AMBER_SOCKET", os.path.join(CACHE_DIR, "amber.sock"))
+
+
+# --- PROTOCOL ---
+class ProtocolHandler:
+    """
+    Executes protocol requests against a host and reports events through `write`.
+    The host provides: chat(session, content, emit, cancel, request), run_tool(call),
+    status() -> dict, reset(session), open(session) -> dict, close(session).
+    """
+    def __init__(self, host, write, default_session="default"):
+        self.host = host
+        self.write = write
+        self.default_session = default_session
+        self.cancels = {}
+        self.opened = set()           # persistent sessions to save when the client goes away
+        self._seq = itertools.count(1)
+
+    def emit(self, rid, event, **fields):
+        self.write({"id": rid, "event": event, **fields})
+
+    def handle(self, req):
+        rid = req.get("id") or f"s{next(self._seq)}"
+        op = req.get("op", "chat")
+        try:
+            if op == "ping":
+                self.emit(rid, "status", state="pong")
+                self.emit(rid, "done")
+            elif op == "status":
+                self.emit(rid, "status", **self.host.status())
+                self.emit(rid, "done")
+            elif op == "cancel":
+                target = self.cancels.get(req.get("target"))
+                if target: target.set()
+                self.emit(rid, "done", cancelled=bool(target))
+            elif op == "reset":
+                self.host.reset(req.get("session") or self.default_session)
+                self.emit(rid, "done")
+            elif op == "open":
+                info = self.host.open(req.get("session") or self.default_session)
+                self.opened.add(info["session"])
+                self.emit(rid, "status", state="open", **info)
+                self.emit(rid, "done")
+            elif op == "close":
+                name = req.get("session") or self.default_session
+                self.host.close(name)
+                self.opened.discard(name)
+                self.emit(rid, "done")
+            elif op == "tool":
+                self.emit(rid, "tool", output=self.host.run_tool(req.get("call") or {}))
+                self.emit(rid, "done")
+            elif op == "chat":
+                cancel = threading.Event()
+                self.cancels[rid] = cancel
+                threading.Thread(target=self._chat, args=(rid, req, cancel), daemon=True).start()
+            else:
+                self.emit(rid, "error", message=f"unknown op '{op}'")
+        except Exception as e:
+            self.emit(rid, "error", message=str(e))
+        return rid
+
+    def _chat(self, rid, req, cancel):
+        try:
+            self.host.chat(req.get("session") or self.default_session, req.get("content", ""),
+                           lambda ev: self.write({"id": rid, **ev}), cancel, req)
+        except Exception as e:
+            self.emit(rid, "error", message=str(e))
+        finally:
+            self.cancels.pop(rid, None)
+
+    def cancel_all(self):
+        for ev in list(self.cancels.values()): ev.set()
+
+
+# --- SERVER ---
+class _ClientHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server
+        wlock = threading.Lock()
+
+        def write(event):
+            data = (json.dumps(event) + "\n").encode("utf-8")
+            with wlock:
+                try: self.wfile.write(data); self.wfile.flush()
+                except OSError: pass  # client went away mid-stream
+
+        # Each connection gets its own conversation unless it names a shared session
+        session = f"conn-{next(server.conn_ids)}"
+        proto = ProtocolHandler(server.host, write, default_session=session)
+        try:
+            for line in self.rfile:
+                line = line.strip()
+                if not line: continue
+                try:
+                    req = json.loads(line)
+                except ValueError:
+                    write({"id": None, "event": "error", "message": "invalid JSON"})
+                    continue
+                proto.handle(req)
+        finally:
+            proto.cancel_all()
+            for name in proto.opened | {session}:
+                server.host.close(name)
+
+
+class AmberServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, host):
+        self.host = host
+        self.conn_ids = itertools.count(1)
+        if os.path.exists(path):
+            if ping(path):
+                raise RuntimeError(f"Amber daemon already running on {path}")
+            os.remove(path)  # stale socket from a crashed daemon
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        super().__init__(path, _ClientHandler)
+        os.chmod(path, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        try: os.remove(self.server_address)
+        except OSError: pass
+
+
+# --- CLIENTS ---
+class SocketConnection:
+    """Client side of the Unix socket. Events are delivered to `on_event` from a reader thread."""
+    def __init__(self, path=SOCKET_PATH, on_event=None, timeout=2.0):
+        self.on_event = on_event
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.sock.settimeout(None)
+        self._rfile = self.sock.makefile("r", encoding="utf-8")
+        self._wlock = threading.Lock()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def send(self, req):
+        with self._wlock:
+            self.sock.sendall((json.dumps(req) + "\n").encode("utf-8"))
+
+    def _read(self):
+        try:
+            for line in self._rfile:
+                if line.strip() and self.on_event:
+                    self.on_event(json.loads(line))
+        except (OSError, ValueError):
+            pass
+        if self.on_event:
+            self.on_event({"id": None, "event": "closed"})
+
+    def close(self):
+        try: self.sock.close()
+        except OSError: pass
+
+
+class LocalConnection:
+    """In-process connection: same protocol, no socket."""
+    def __init__(self, host, on_event=None):
+        self.on_event = on_event
+        self.handler = ProtocolHandler(host, lambda ev: self.on_event and self.on_event(ev))
+
+    def send(self, req):
+        self.handler.handle(req)
+
+    def close(self):
+        self.handler.cancel_all()
+
+
+def ping(path=SOCKET_PATH, timeout=0.25):
+    """True if a daemon answers on `path`."""
+    if not os.path.exists(path): return False
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(timeout)
+            s.connect(path)
+            s.sendall(b'{"id": "ping", "op": "ping"}\n')
+            return b"pong" in s.recv(4096)
+    except OSError:
+        return False
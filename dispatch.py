@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Dispatcher model for Amber.
+Most turns are tool dispatches ("open calculator", "weather in Lisbon") that don't need the
+8B model. With a `dispatcher` in the manifest,
+  "dispatcher": {"repo": "Qwen/Qwen3-0.6B-MLX-4bit", "min_confidence": 0.6, "max_tokens": 96}
+a small model is loaded next to the chat model (on the same engine thread; when it is the
+chat model's draft, the already loaded draft weights are reused). It reads each short,
+self-contained message and answers either with the tool call JSON or with CHAT:
+  - a valid call (registered tool, required arguments present, enum values allowed) whose
+    tokens averaged at least `min_confidence` probability is dispatched directly
+  - CHAT, anything malformed or anything less confident goes to the chat model
+Messages with more than `max_words` words, or that refer back to the conversation, skip the
+dispatcher. Every decision (route, confidence, reason, dispatcher latency) lands in the
+turn's metrics.
+"""
+import math
+import time
+import threading
+from collections import namedtuple
+
+from engine import Engine, INTERACTIVE
+from responses import self_contained
+
+# --- CONFIGURATION ---
+MIN_CONFIDENCE = 0.6      # mean token probability of a call dispatched without the chat model
+MAX_WORDS = 24            # longer messages are conversation, not dispatches
+MAX_TOKENS = 96
+
+# route: "tool" (dispatched) or "chat" (the chat model answers); reason says why.
+Decision = namedtuple("Decision", "route call reply confidence reason latency_s tokens")
+
+
+# --- LOADING ---
+def dispatcher_meta(meta):
+    """Manifest for the dispatcher model, or None if the manifest has none (or it is the chat model)."""
+    d = meta.get("dispatcher")
+    if isinstance(d, str): d = {"repo": d}
+    if not d or str(d.get("repo", "")).lower() in ("", "none") or d["repo"] == meta.get("repo"):
+        return None
+    out = {k: meta[k] for k in ("engine", "precision", "profiles", "local", "device") if k in meta}
+    out.update({k: v for k, v in d.items() if k not in ("min_confidence", "max_words", "max_tokens")})
+    out["logprobs"] = True
+    return out
+
+def load_backend(meta, main):
+    """Loads (or shares) the dispatcher's backend. Returns None without a dispatcher."""
+    import models
+    from backends import make_backend
+    dmeta = dispatcher_meta(meta)
+    if dmeta is None: return None
+    if main.name == "fake":
+        dmeta["engine"] = "fake"
+    if dmeta["repo"] == meta.get("draft_repo") and getattr(main, "draft_model", None) is not None:
+        print(f"🔹 Dispatcher: {dmeta['repo']} (sharing the draft model's weights)")
+        return type(main).sharing(dmeta, main.draft_model, main.tokenizer)
+    dmeta = models.localize(dmeta)
+    print(f"🔹 Dispatcher: {dmeta['repo']}")
+    backend = make_backend(dmeta, use_draft=False)
+    backend.load()
+    return backend
+
+
+# --- PROMPT ---
+def dispatcher_prompt(registry):
+    lines = []
+    for name, entry in sorted(registry.items()):
+        meta = entry.get("meta") or {}
+        desc = (meta.get("description") or "").strip().split("\n")[0][:160]
+        props = meta.get("parameters", {}).get("properties", {})
+        args = ", ".join(f"{k}" + (f" ({'|'.join(map(str, v['enum']))})" if v.get("enum") else "")
+                         for k, v in props.items())
+        lines.append(f'- "{name}": {desc} [Args: {args}]')
+    return (
+        "You route requests for Amber, an assistant on a Mac. If the user's message is a request "
+        "one of these tools can carry out, reply ONLY with the JSON call, e.g. "
+        '{"tool": "weather", "args": {"location": "Paris"}}. '
+        "For anything else (questions, writing, conversation) reply ONLY with: CHAT\n\n"
+        "Tools:\n" + "\n".join(lines)
+    )
+
+def check_call(call, registry):
+    """Problem with a parsed call ("" if it is valid)."""
+    entry = registry.get(call.get("tool")) if isinstance(call.get("tool"), str) else None
+    if entry is None: return f"unknown tool {call.get('tool')!r}"
+    args = call.get("args")
+    if not isinstance(args, dict): return "args is not an object"
+    params = (entry.get("meta") or {}).get("parameters") or {}
+    for name in params.get("required") or []:
+        if name not in args: return f"missing {name}"
+    for name, value in args.items():
+        enum = (params.get("properties", {}).get(name) or {}).get("enum")
+        if enum and value not in enum: return f"{name}={value!r} not allowed"
+    return ""
+
+
+# --- DISPATCHER ---
+class Dispatcher:
+    def __init__(self, runner, backend, registry, parse, min_confidence=MIN_CONFIDENCE,
+                 max_words=MAX_WORDS, max_tokens=MAX_TOKENS):
+        self.runner = runner
+        self.backend = backend
+        self.registry = registry
+        self.parse = parse                # agent.parse_intent
+        self.min_confidence = min_confidence
+        self.max_words = max_words
+        self.max_tokens = max_tokens
+        self.prompt = dispatcher_prompt(registry)
+        self.counts = {"dispatched": 0, "chat": 0, "escalated": 0}
+        self._free = []                   # primed engines not in use (one per concurrent decision)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_engine(cls, runner, engine, registry, parse):
+        """Dispatcher for the loaded engine, or None if the manifest has none."""
+        backend = getattr(engine, "dispatcher_backend", None)
+        if backend is None: return None
+        d = engine.backend.meta.get("dispatcher")
+        d = d if isinstance(d, dict) else {}
+        return cls(runner, backend, registry, parse,
+                   min_confidence=float(d.get("min_confidence", MIN_CONFIDENCE)),
+                   max_words=int(d.get("max_words", MAX_WORDS)),
+                   max_tokens=int(d.get("max_tokens", MAX_TOKENS)))
+
+    def applies(self, content):
+        words = (content or "").split()
+        return 0 < len(words) <= self.max_words and self_contained(content)
+
+    def _open(self, _shared):
+        engine = Engine(self.backend)
+        engine.prime([{"role": "system", "content": self.prompt}])
+        return engine
+
+    def decide(self, content, cancel=None):
+        t0 = time.perf_counter()
+        with self._lock:
+            engine = self._free.pop() if self._free else None
+        if engine is None:
+            engine = self.runner.submit(self._open).result()
+        try:
+            messages = [{"role": "system", "content": self.prompt}, {"role": "user", "content": content}]
+            reply = "".join(self.runner.stream(engine, messages, profile="tool_call", max_tokens=self.max_tokens,
+                                               cancel=cancel, priority=INTERACTIVE)).strip()
+            turn = dict(engine.last_turn)
+        finally:
+            with self._lock:
+                self._free.append(engine)
+        lp = turn.get("mean_logprob")
+        confidence = round(math.exp(lp), 3) if lp is not None else None
+        route, call, reason = self._judge(reply, confidence)
+        with self._lock:
+            self.counts["dispatched" if route == "tool" else "chat" if reason == "chat" else "escalated"] += 1
+        return Decision(route, call, reply, confidence, reason, round(time.perf_counter() - t0, 4),
+                        turn.get("tokens", 0))
+
+    def _judge(self, reply, confidence):
+        """(route, call, reason)."""
+        if reply.upper().startswith("CHAT"):
+            return "chat", None, "chat"
+        call = self.parse(reply)
+        if call is None:
+            return "chat", None, "no valid call"
+        problem = check_call(call, self.registry)
+        if problem:
+            return "chat", None, problem
+        if confidence is not None and confidence < self.min_confidence:
+            return "chat", None, f"low confidence {confidence:.2f}"
+        return "tool", call, "confident"
+
+    def forget(self):
+        """Drop the idle engines (and the KV of the messages they last decided)."""
+        with self._lock:
+            self._free = []
+
+    def describe(self):
+        return {"repo": self.backend.meta.get("repo"), "min_confidence": self.min_confidence, **self.counts}
@@ -0,0 +1,551 @@
+#!/usr/bin/env python3
+"""
+Amber inference engine.
+Owns the loaded backend (see backends.py) and keeps the KV prompt cache alive between
+turns, so each turn only prefills the tokens that changed since the previous one.
+If the manifest declares a draft model, decoding is speculative: the draft proposes
+tokens and the main model verifies them in one batch (outputs are unchanged).
+"""
+import os
+import glob
+import hashlib
+import json
+import re
+import threading
+import time
+import queue
+from collections import deque
+from concurrent.futures import Future
+
+from profiles import Profiles, StopMatcher
+from streaming import ThinkFilter, CLOSE_TAG
+
+# --- CONFIGURATION ---
+CACHE_DIR = os.environ.get("AMBER_CACHE_DIR", os.path.expanduser("~/Library/Caches/AgentF"))
+SNAPSHOT_DIR = os.path.join(CACHE_DIR, "kv")
+
+# Scheduling: interactive chat turns always go first; background work (summaries, digests)
+# fills the remaining capacity and is paused at token boundaries when a chat turn arrives.
+INTERACTIVE, BACKGROUND = 0, 1
+PRIORITIES = {"interactive": INTERACTIVE, "background": BACKGROUND}
+BACKGROUND_STRIDE = 4      # while chat turns decode, background sequences step every Nth step
+STARVATION_STEPS = 256     # a background sequence held back this long runs at interactive priority
+
+
+# --- HELPERS ---
+def _common_prefix(a, b):
+    """Length of the shared token prefix of two sequences."""
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+def snapshot_key(*parts):
+    """Content hash identifying a prefix snapshot. Any change to the prompt (e.g. the tool set) changes it."""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def _snapshot_stem(*parts):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", "-".join(str(p) for p in parts))
+
+
+# --- ENGINE ---
+class Engine:
+    def __init__(self, backend):
+        self.backend = backend
+        self.cache = None        # backend KV cache (draft layers included when speculative)
+        self.cache_tokens = []   # token ids the cache currently represents
+        self.profiles = Profiles(backend.meta)  # per-request-type decoding settings
+        # Speculative decoding counters (whole session and last turn)
+        self.spec_total = {"tokens": 0, "draft_accepted": 0}
+        self.last_turn = {}
+        self.thinking_total = 0  # reasoning tokens over the session
+        self.shared_tokens = 0   # prompt tokens the last _prepare took from the shared prefix cache
+
+    @property
+    def has_draft(self):
+        return self.backend.has_draft
+
+    def count_tokens(self, text):
+        return len(self.backend.encode(text))
+
+    def tokenize_messages(self, messages, thinking=None):
+        """Prompt tokens; `thinking` flips the chat template's reasoning switch (None = template default)."""
+        kwargs = {} if thinking is None else {"enable_thinking": thinking}
+        return self.backend.encode(self.backend.render(messages, add_generation_prompt=True, **kwargs))
+
+    def reset_cache(self):
+        self.cache = self.backend.new_cache()
+        self.cache_tokens = []
+
+    def _prefill(self, tokens):
+        """Run `tokens` through the model (and draft) into a fresh cache without sampling."""
+        self.reset_cache()
+        self.backend.prefill(self.cache, tokens)
+        self.cache_tokens = list(tokens)
+
+    def prime(self, messages):
+        """
+        Take the KV cache for a fixed prefix (the system prompt) from the shared prefix
+        cache, load it from disk, or prefill and save it. Snapshots are keyed by backend, repo, precision and the exact rendered
+        prompt, so editing the persona or the tool catalog invalidates them automatically.
+        """
+        b = self.backend
+        repo, precision, draft_repo = self._model_parts()
+
+        text = b.render(messages, add_generation_prompt=False)
+        tokens = b.encode(text)
+        key = snapshot_key(b.name, repo, precision, draft_repo, text)
+        stem = _snapshot_stem(b.name, repo, precision)
+        path = os.path.join(SNAPSHOT_DIR, f"{stem}-{key[:16]}{b.cache_ext}")
+
+        shared = b.prefix_cache.lookup(tokens) if b.prefix_cache is not None else None
+        if shared is not None and shared[1] == len(tokens):
+            self.cache, self.cache_tokens = shared[0], list(tokens)
+            return "shared"
+
+        if os.path.exists(path):
+            try:
+                cache, saved = b.load_cache(path)
+                if saved.get("key") == key and int(saved.get("n_tokens", -1)) == len(tokens):
+                    self.cache, self.cache_tokens = cache, list(tokens)
+                    self.share(tokens)
+                    return "hit"
+            except Exception as e:
+                print(f"⚠️  Ignoring unreadable KV snapshot ({e})")
+
+        self._prefill(tokens)
+        self.share(tokens)
+        try:
+            os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+            # Drop snapshots for this model that belong to an older prompt / tool set
+            for old in glob.glob(os.path.join(SNAPSHOT_DIR, f"{stem}-*{b.cache_ext}")):
+                if old != path: os.remove(old)
+            tmp = path[:-len(b.cache_ext)] + ".tmp" + b.cache_ext
+            b.save_cache(tmp, self.cache, {"key": key, "n_tokens": str(len(tokens))})
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"⚠️  Could not save KV snapshot ({e})")
+        return "miss"
+
+    def _model_parts(self):
+        meta = self.backend.meta
+        draft_repo = meta.get("draft_repo", "") if self.backend.has_draft else ""
+        return meta.get("repo", ""), meta.get("precision", ""), draft_repo
+
+    def save_snapshot(self, path):
+        """Write the conversation's KV cache and the tokens it holds to `path` (atomically)."""
+        b = self.backend
+        if self.cache is None or not self.cache_tokens: return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path[:-len(b.cache_ext)] + ".tmp" + b.cache_ext
+        b.save_cache(tmp, self.cache, {"model": snapshot_key(b.name, *self._model_parts()),
+                                       "tokens": json.dumps(self.cache_tokens)})
+        os.replace(tmp, path)
+        return True
+
+    def load_snapshot(self, path):
+        """Map a snapshot written by save_snapshot back in. Returns the tokens restored (0 if unusable)."""
+        b = self.backend
+        if not os.path.exists(path): return 0
+        try:
+            cache, saved = b.load_cache(path)
+            tokens = json.loads(saved.get("tokens", "[]"))
+            if saved.get("model") != snapshot_key(b.name, *self._model_parts()): return 0
+            if b.cache_offset(cache) < len(tokens): return 0
+        except Exception as e:
+            print(f"⚠️  Ignoring unreadable session snapshot ({e})")
+            return 0
+        self.cache, self.cache_tokens = cache, tokens
+        return len(tokens)
+
+    def _prepare(self, tokens):
+        """
+        Reuse the cached prefix of `tokens`; trim on divergence. A longer prefix from the
+        shared prefix cache (see prefixcache.py) replaces our own. Returns the tokens left to prefill.
+        """
+        if self.cache is None:
+            self.reset_cache()
+
+        common = _common_prefix(self.cache_tokens, tokens)
+        self.shared_tokens = 0
+        tree = self.backend.prefix_cache
+        shared = tree.lookup(tokens, have=common, limit=len(tokens) - 1) if tree is not None else None
+        if shared is not None:
+            self.cache, n = shared
+            self.cache_tokens = list(tokens[:n])
+            self.shared_tokens = n - common
+            common = n
+        # Always prefill at least one token so the model has logits to sample from.
+        if common == len(tokens):
+            common -= 1
+
+        if len(self.cache_tokens) > common:
+            if self.backend.trim_to(self.cache, common):
+                self.cache_tokens = self.cache_tokens[:common]
+            else:
+                self.reset_cache()
+                common = 0
+
+        return tokens[common:]
+
+    def _sync(self, seen):
+        """
+        Align `cache_tokens` with what the model actually consumed (handles early stops,
+        Ctrl-C and draft layers that ran ahead of or behind the main model).
+        """
+        target = min(len(seen), self.backend.cache_offset(self.cache))
+        if not self.backend.trim_to(self.cache, target):
+            self.reset_cache()
+            return
+        self.cache_tokens = seen[:target]
+
+    def share(self, tokens):
+        """Offer the prompt `tokens` (now at the start of our cache) to the shared prefix cache."""
+        tree = self.backend.prefix_cache
+        if tree is not None and self.cache is not None and self.cache_tokens[:len(tokens)] == list(tokens):
+            tree.insert(tokens, self.cache)
+
+    def _record_turn(self, n_tokens, n_draft, n_thinking=0, **metrics):
+        """Counters for the turn that just finished; `metrics` adds timings (see metrics.py)."""
+        self.spec_total["tokens"] += n_tokens
+        self.spec_total["draft_accepted"] += n_draft
+        self.thinking_total += n_thinking
+        self.last_turn = {"tokens": n_tokens, "draft_accepted": n_draft, "thinking_tokens": n_thinking,
+                          "acceptance": round(n_draft / n_tokens, 3) if n_tokens else 0.0, **metrics}
+
+    def acceptance_rate(self):
+        t = self.spec_total
+        return t["draft_accepted"] / t["tokens"] if t["tokens"] else 0.0
+
+
+# --- ENGINE THREAD (scheduler) ---
+class _Sequence:
+    """One generation request inside the running batch."""
+    def __init__(self, engine, tokens, profile, cancel, priority=INTERACTIVE):
+        self.engine = engine          # owns the KV cache this sequence extends
+        self.tokens = tokens
+        self.max_tokens = profile.max_tokens
+        self.sampling = profile.sampling
+        self.stop = StopMatcher(profile.stop)
+        self.max_thinking = profile.max_thinking
+        self.think = ThinkFilter()    # only its `inside` state is used (thinking-token cap)
+        self.cancel = cancel or threading.Event()
+        self.priority = priority
+        self.held = 0                 # consecutive scheduler steps without a decode
+        self.abandoned = False        # consumer stopped reading
+        self.out = queue.SimpleQueue()  # text chunks, then None (or an exception)
+        self.state = None
+        self.seen = None
+        self.n_tokens = self.n_draft = self.n_thinking = 0
+        self.logprob_sum, self.n_logprob = 0.0, 0   # only for backends that report logprobs
+        # Timings (perf_counter) and prompt accounting for per-turn metrics
+        self.t_submit = time.perf_counter()
+        self.t_admit = self.t_first = None
+        self.prompt_tokens = len(tokens)
+        self.prefill_tokens = 0
+        self.shared_tokens = 0
+
+
+class EngineThread:
+    """
+    Loads the engine in the background, then runs the scheduler loop on that same thread
+    (MLX streams belong to the thread that created them).
+    - Jobs (submit) run between decode steps: session setup, snapshots, etc.
+    - Generations (stream) are continuously batched: new sequences join the running
+      batch at token boundaries and finished or cancelled ones leave it.
+    - Interactive sequences are admitted first. A full batch makes room for one by pausing
+      a background sequence (its state is kept and it resumes later), and while chat turns
+      decode, background sequences only step every `background_stride` steps. Background
+      work held back for `starvation_steps` is promoted to interactive priority.
+    - Sequences of a second model on the same thread (the dispatcher, see dispatch.py) are
+      scheduled alongside and stepped in their own sub-batch.
+    Work submitted while the weights are still loading simply waits for the load.
+    """
+    def __init__(self, load, max_batch=8, background_stride=BACKGROUND_STRIDE,
+                 starvation_steps=STARVATION_STEPS):
+        """load: callable(report) -> Engine, where report(percent, status) updates progress."""
+        self.engine = None
+        self.error = None
+        self.progress, self.status = 0, "queued"
+        self.started = time.time()
+        self.load_seconds = None
+        self.max_batch = max_batch
+        self.background_stride = max(1, background_stride)
+        self.starvation_steps = starvation_steps
+        self.loaded = Future()
+        self.active = []              # sequences in the running batch
+        self.waiting = {INTERACTIVE: deque(), BACKGROUND: deque()}  # new and paused sequences
+        self.preemptions = 0
+        self._steps = 0
+        self._inbox = queue.Queue()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, args=(load,), name="amber-engine", daemon=True)
+        self._thread.start()
+
+    def _report(self, percent, status):
+        self.progress, self.status = percent, status
+
+    # ---- public API
+    @property
+    def ready(self):
+        return self.loaded.done() and self.error is None
+
+    def describe(self):
+        if self.ready:
+            return f"model ready (loaded in {self.load_seconds:.1f}s)"
+        return f"model {self.status} ({self.progress}%, {time.time() - self.started:.0f}s)"
+
+    def submit(self, fn, *args, **kwargs):
+        """Run fn(engine, *args, **kwargs) on the engine thread. Returns a Future."""
+        fut = Future()
+        self._inbox.put((fn, args, kwargs, fut))
+        return fut
+
+    def load(self):
+        """Scheduler counters for status reports."""
+        return {"running": len(self.active), "waiting": len(self.waiting[INTERACTIVE]),
+                "background_waiting": len(self.waiting[BACKGROUND]), "preemptions": self.preemptions}
+
+    def stream(self, engine, messages, profile="chat", max_tokens=None, stop=None, cancel=None,
+               priority=INTERACTIVE, **sampling):
+        """
+        Yields text chunks for `messages`, continuing `engine`'s KV cache. Call from any thread.
+        Decoding follows the manifest profile; max_tokens, stop and sampler keys override it.
+        """
+        p = engine.profiles.get(profile, max_tokens, stop, **sampling)
+        seq = _Sequence(engine, engine.tokenize_messages(messages, p.thinking), p, cancel, priority)
+        self._inbox.put(seq)
+        try:
+            while True:
+                item = seq.out.get()
+                if item is None: return
+                if isinstance(item, Exception): raise item
+                yield item
+        finally:
+            seq.abandoned = True
+
+    def complete(self, messages, profile="summary", max_tokens=None, priority=BACKGROUND, **sampling):
+        """One-off generation on a scratch cache (summaries and other background work)."""
+        engine = self.loaded.result()
+        return "".join(self.stream(Engine(engine.backend), messages, profile=profile, max_tokens=max_tokens,
+                                   priority=priority, **sampling))
+
+    def shutdown(self):
+        self._stopping = True
+        self._inbox.put(None)
+
+    # ---- engine thread
+    def _run(self, load):
+        try:
+            self.engine = load(self._report)
+            self.load_seconds = time.time() - self.started
+            self._report(100, "ready")
+            self.loaded.set_result(self.engine)
+        except Exception as e:
+            self.error = e
+            self._report(self.progress, f"failed: {e}")
+            self.loaded.set_exception(e)
+        self._loop()
+
+    def _loop(self):
+        while not self._stopping:
+            self._drain(block=not (self.active or any(self.waiting.values())))
+            self._admit()
+            if self.active:
+                self._step()
+
+    def _drain(self, block):
+        try:
+            item = self._inbox.get(block=block)
+        except queue.Empty:
+            return
+        while True:
+            if item is None:
+                self._stopping = True
+            elif isinstance(item, _Sequence):
+                self.waiting[item.priority].append(item)
+            else:
+                self._run_job(*item)
+            try:
+                item = self._inbox.get_nowait()
+            except queue.Empty:
+                return
+
+    def _run_job(self, fn, args, kwargs, fut):
+        if not fut.set_running_or_notify_cancel(): return
+        try:
+            if self.error is not None:
+                raise RuntimeError(f"Model failed to load: {self.error}")
+            fut.set_result(fn(self.engine, *args, **kwargs))
+        except Exception as e:
+            fut.set_exception(e)
+
+    def _admit(self):
+        """Token boundary: move waiting sequences into the batch, interactive ones first."""
+        for priority in (INTERACTIVE, BACKGROUND):
+            pending = self.waiting[priority]
+            while pending:
+                if len(self.active) >= self.max_batch and not (priority == INTERACTIVE and self._preempt()):
+                    break
+                self._start(pending.popleft())
+
+    def _preempt(self):
+        """Pause the most recently admitted background sequence to free a slot."""
+        for seq in reversed(self.active):
+            if seq.priority == BACKGROUND:
+                self.active.remove(seq)
+                self.waiting[BACKGROUND].appendleft(seq)
+                self.preemptions += 1
+                return True
+        return False
+
+    def _start(self, seq):
+        if seq.state is not None:     # resuming a paused sequence; _step retires it if cancelled
+            self.active.append(seq)
+            return
+        if self.error is not None:
+            seq.out.put(RuntimeError(f"Model failed to load: {self.error}"))
+            return
+        if seq.cancel.is_set() or seq.abandoned:
+            seq.out.put(None)
+            return
+        try:
+            if not self.active:
+                self.engine.backend.reset_peak_memory()  # peaks are per turn unless turns overlap
+            seq.t_admit = time.perf_counter()
+            suffix = seq.engine._prepare(seq.tokens)
+            seq.prefill_tokens = len(suffix)
+            seq.shared_tokens = seq.engine.shared_tokens
+            seq.seen = list(seq.tokens)
+            seq.state = seq.engine.backend.begin(suffix, seq.engine.cache,
+                                                 max_tokens=seq.max_tokens, **seq.sampling)
+            self.active.append(seq)
+        except Exception as e:
+            seq.out.put(e)
+
+    def _age(self, held_back):
+        """Count steps each background sequence spent without decoding; promote the starved."""
+        for seq in held_back:
+            seq.held += 1
+            if seq.held >= self.starvation_steps:
+                seq.priority = INTERACTIVE
+                if seq in self.waiting[BACKGROUND]:
+                    self.waiting[BACKGROUND].remove(seq)
+                    self.waiting[INTERACTIVE].append(seq)
+
+    def _step(self):
+        for seq in [s for s in self.active if s.cancel.is_set() or s.abandoned]:
+            self._finish(seq)
+        for pending in self.waiting.values():
+            for seq in [s for s in pending if s.cancel.is_set() or s.abandoned]:
+                pending.remove(seq)
+                if seq.state is None: seq.out.put(None)
+                else: self._finish(seq)
+        if not self.active: return
+
+        # Fairness: with chat turns in the batch, background sequences only take every Nth step
+        self._steps += 1
+        chatting = any(s.priority == INTERACTIVE for s in self.active)
+        batch = [s for s in self.active if s.priority == INTERACTIVE or not chatting
+                 or self._steps % self.background_stride == 0]
+        self._age([s for s in self.active if s not in batch] + list(self.waiting[BACKGROUND]))
+        # Sequences of different models (the chat model, the dispatcher) step in separate calls
+        groups = {}
+        for seq in batch:
+            groups.setdefault(id(seq.engine.backend), []).append(seq)
+        for group in groups.values():
+            try:
+                steps = group[0].engine.backend.step([s.state for s in group])
+            except Exception as e:
+                for seq in group: self._finish(seq, e)
+                continue
+            self._advance(group, steps)
+
+    def _advance(self, batch, steps):
+        for seq, step in zip(batch, steps):
+            seq.held = 0
+            if step is None:
+                self._finish(seq)
+                continue
+            if step.token is not None:
+                if seq.t_first is None: seq.t_first = time.perf_counter()
+                seq.seen.append(step.token)
+                seq.n_tokens += 1
+                seq.n_thinking += seq.think.inside
+                if step.logprob is not None:
+                    seq.logprob_sum += step.logprob
+                    seq.n_logprob += 1
+            seq.n_draft += step.from_draft
+            if step.text:
+                seq.think.feed(step.text)
+            text = seq.stop.feed(step.text) if step.text else ""
+            if text:
+                seq.out.put(text)
+            if seq.stop.stopped:
+                self._finish(seq)
+            elif seq.think.inside and seq.n_thinking >= seq.max_thinking:
+                self._close_think(seq)
+
+    def _close_think(self, seq):
+        """
+        Thinking budget spent: end the block ourselves and restart decoding after it.
+        The reasoning so far stays in the KV cache, so only the closing tag is prefilled.
+        """
+        close = "\n" + CLOSE_TAG + "\n\n"
+        try:
+            seq.engine.backend.end(seq.state)
+            seq.engine._sync(seq.seen)
+            seq.tokens = seq.seen + seq.engine.backend.encode(close)
+            suffix = seq.engine._prepare(seq.tokens)
+            seq.seen = list(seq.tokens)
+            seq.state = seq.engine.backend.begin(suffix, seq.engine.cache,
+                                                 max_tokens=max(1, seq.max_tokens - seq.n_tokens), **seq.sampling)
+        except Exception as e:
+            self._finish(seq, e)
+            return
+        seq.think.feed(close)
+        seq.out.put(seq.stop.flush() + close)
+
+    def _timings(self, seq):
+        """
+        Prefill runs lazily inside the first step on some backends, so it is measured from
+        admission to the first token; decode speed covers the tokens after that.
+        """
+        end = time.perf_counter()
+        admit = seq.t_admit or end
+        first = seq.t_first or end
+        prefill_s, decode_s = first - admit, end - first
+        peak = self.engine.backend.peak_memory()
+        return {
+            "prompt_tokens": seq.prompt_tokens,
+            "prefill_tokens": seq.prefill_tokens,
+            "shared_tokens": seq.shared_tokens,
+            "queue_s": round(admit - seq.t_submit, 4),
+            "prefill_s": round(prefill_s, 4),
+            "ttft_s": round(first - seq.t_submit, 4),
+            "decode_s": round(decode_s, 4),
+            "prefill_tok_s": round(seq.prefill_tokens / prefill_s, 1) if prefill_s > 0 else 0.0,
+            "decode_tok_s": round((seq.n_tokens - 1) / decode_s, 1) if decode_s > 0 and seq.n_tokens > 1 else 0.0,
+            "peak_mem_mb": round(peak / 2**20, 1) if peak else None,
+            **({"mean_logprob": round(seq.logprob_sum / seq.n_logprob, 4)} if seq.n_logprob else {}),
+        }
+
+    def _finish(self, seq, error=None):
+        if seq in self.active: self.active.remove(seq)
+        try:
+            seq.engine.backend.end(seq.state)
+            seq.engine._sync(seq.seen)
+            if error is None:   # the prompt only: reasoning a closed think block added isn't re-sent
+                seq.engine.share(seq.seen[:seq.prompt_tokens])
+            seq.engine._record_turn(seq.n_tokens, seq.n_draft, seq.n_thinking, **self._timings(seq))
+        except Exception as e:
+            error = error or e
+        tail = seq.stop.flush()
+        if tail and error is None:
+            seq.out.put(tail)
+        seq.out.put(error)
@@ -4,13 +4,16 @@
 AgentF Installer — robust macOS bootstrap (loop-proof)
 - Venv: ~/Library/Application Support/AgentF/.venv
 - Deps: PySide6, packaging, torch, transformers, tokenizers, huggingface-hub, safetensors, accelerate
+- Apple Silicon also gets mlx + mlx-lm (default "mlx" engine); torch/transformers back the "cpu" engine
 - Retries package installs; falls back to PyTorch extra index if needed (CPU wheel)
+- Prefetches the model files the manifest needs (parallel, resumable, checksummed; see
+  prefetch.py) while pip runs; AGENTF_NO_PREFETCH=1 skips it
 - Verifies imports and MPS availability; checks ai.py/agent.py/weights
 - If run directly (no --from-gui), launches gui.py using venv python
 """
 
 from __future__ import annotations
-import os, sys, subprocess, pathlib, datetime, shutil, time, errno, platform, json
+import os, sys, subprocess, pathlib, datetime, shutil, time, errno, platform, json, threading
 from typing import Optional, List, Tuple
 
 # GUI (PySide6 is bundled in the app so we can import it before creating the venv)
@@ -40,12 +43,14 @@ LOG_DIR.mkdir(parents=True, exist_ok=True)
 LOG_PATH    = LOG_DIR / f"{APP_NAME}_{datetime.datetime.now():%Y-%m-%d_%H-%M-%S}.log"
 
 LIGHTWEIGHT = os.environ.get("AGENTF_LIGHTWEIGHT", "0") == "1"
+PREFETCH    = os.environ.get("AGENTF_NO_PREFETCH", "0") != "1"
 RETRIES     = 3
 
 # Install set (Torch first; others later)
 GUI_DEPS        = ["PySide6>=6.7", "packaging>=24"]  # usually already satisfied in app runtime
 RUNTIME_DEPS    = ["transformers>=4.45", "huggingface-hub>=0.24", "safetensors>=0.4", "tokenizers>=0.20", "accelerate>=0.33"]
 TORCH_SPEC      = "torch"  # macOS arm64 wheels include MPS; fallback index is CPU wheels only
+MLX_DEPS        = ["mlx>=0.22", "mlx-lm>=0.22"]  # Apple Silicon only
 
 
 # ----------------------------
@@ -171,6 +176,14 @@ def torch_probe() -> dict:
         return {"ok": False, "err": str(e)}
 
 
+def find_weights() -> Optional[pathlib.Path]:
+    for pat in ("qwen*.npz", "*.npz"):
+        found = sorted(RES_DIR.glob(pat))
+        if found:
+            return found[0]
+    return None
+
+
 # ----------------------------
 # Worker (runs in thread)
 # ----------------------------
@@ -178,6 +191,61 @@ class InstallerWorker(QObject):
     progress = Signal(int, str)
     done = Signal(bool, str)
 
+    def __init__(self):
+        super().__init__()
+        self._pct = 0
+        self._prefetch: Optional[threading.Thread] = None
+        self._prefetch_error: Optional[str] = None
+
+    def _stage(self, pct: int, text: str):
+        self._pct = pct
+        self.progress.emit(pct, text)
+
+    # ---- model prefetch (runs next to the pip steps)
+    def start_prefetch(self):
+        weights = find_weights()
+        if not PREFETCH or LIGHTWEIGHT or not weights:
+            log("[prefetch] skipped" + ("" if weights else " (no manifest)"))
+            return
+        try:
+            sys.path.insert(0, str(RES_DIR))
+            import models, prefetch
+            meta = models.read_manifest(str(weights))
+            if meta.get("engine") == "fake":
+                return
+            repos = prefetch.manifest_plan(meta)
+        except Exception as e:
+            log(f"[prefetch] cannot read {weights.name}: {e}")
+            return
+        log(f"[prefetch] {', '.join(repos)} -> {models.HF_CACHE}")
+
+        def report(done: int, total: int, text: str):
+            gb = 2 ** 30
+            self.progress.emit(self._pct, f"Downloading model weights… {done / gb:.2f} / {total / gb:.2f} GB")
+
+        def run():
+            t0 = time.time()
+            try:
+                fetcher = prefetch.Prefetcher(progress=report, report_every=2.0)
+                fetcher.fetch(repos, meta.get("local"))
+                log(f"[prefetch] {fetcher.total / 2**20:.0f} MB fetched in {time.time() - t0:.1f}s")
+            except Exception as e:
+                self._prefetch_error = str(e)
+                log(f"[prefetch] ERROR: {e}")
+
+        self._prefetch = threading.Thread(target=run, name="prefetch", daemon=True)
+        self._prefetch.start()
+
+    def wait_prefetch(self):
+        if self._prefetch is None:
+            return
+        if self._prefetch.is_alive():
+            self._stage(86, "Finishing model download…")
+            self._prefetch.join()
+        if self._prefetch_error:
+            # Non-fatal: ai.py fetches the missing files on first start instead
+            log("[installer] WARNING: model prefetch incomplete; the first start will download the rest.")
+
     def run(self):
         acquire_lock()
         try:
@@ -189,22 +257,25 @@ class InstallerWorker(QObject):
             host_py = find_python()
             log(f"[installer] host python: {host_py}")
 
+            # Model weights download in the background while the environment is built
+            self.start_prefetch()
+
             # Step 1: venv
-            self.progress.emit(5, "Preparing environment…")
+            self._stage(5, "Preparing environment…")
             if not venv_python_ok():
-                self.progress.emit(8, "Creating virtual environment…")
+                self._stage(8, "Creating virtual environment…")
                 run_stream([host_py, "-I", "-m", "venv", str(VENV_DIR)])
             else:
                 log("[installer] Using existing venv")
 
             # Step 2: toolchain
-            self.progress.emit(20, "Upgrading pip/setuptools/wheel…")
+            self._stage(20, "Upgrading pip/setuptools/wheel…")
             # ensurepip (idempotent), then upgrade
             run_stream([str(PY_IN_VENV), "-I", "-m", "ensurepip", "--upgrade"])
             pip_install(["pip", "setuptools", "wheel"])
 
             # Step 3: GUI deps (mainly no-op; useful if user runs installer standalone)
-            self.progress.emit(30, "Ensuring GUI dependencies…")
+            self._stage(30, "Ensuring GUI dependencies…")
             try:
                 pip_install(GUI_DEPS)
             except Exception as e:
@@ -214,7 +285,7 @@ class InstallerWorker(QObject):
             if LIGHTWEIGHT:
                 log("[installer] AGENTF_LIGHTWEIGHT=1 — skipping torch/LLM deps.")
             else:
-                self.progress.emit(55, "Installing PyTorch (this may take a bit)…")
+                self._stage(55, "Installing PyTorch (this may take a bit)…")
                 try:
                     pip_install_with_retry([TORCH_SPEC])
                 except Exception as e:
@@ -227,15 +298,22 @@ class InstallerWorker(QObject):
                     raise RuntimeError(f"Torch failed to import: {probe.get('err')}")
 
                 # Remaining deps
-                self.progress.emit(75, "Installing Transformers & friends…")
+                self._stage(75, "Installing Transformers & friends…")
                 pip_install_with_retry(RUNTIME_DEPS)
 
+                if sys_name == "Darwin" and machine == "arm64":
+                    self._stage(82, "Installing MLX…")
+                    pip_install_with_retry(MLX_DEPS)
+
+            self.wait_prefetch()
+
             # Step 5: verify environment
-            self.progress.emit(88, "Verifying environment…")
+            self._stage(88, "Verifying environment…")
             verify_code = "\n".join([
                 "import sys",
                 "mods=['PySide6','packaging']",
                 "try:\n import transformers, huggingface_hub, safetensors, tokenizers; mods+=['transformers','huggingface-hub','safetensors','tokenizers']\nexcept Exception: pass",
+                "try:\n import mlx_lm; mods+=['mlx-lm']\nexcept Exception: pass",
                 "try:\n import torch; mods+=['torch']; mps_ok = bool(getattr(torch.backends,'mps',None) and torch.backends.mps.is_available())\n print('Torch', torch.__version__, 'MPS:', mps_ok)\nexcept Exception as e:\n print('Torch import error:', e)",
                 "print('OK', ','.join(mods))",
             ])
@@ -248,19 +326,14 @@ class InstallerWorker(QObject):
             missing = []
             if not AI_PY.exists():    missing.append("ai.py")
             if not AGENT_PY.exists(): missing.append("agent.py")
-            weights = None
-            for pat in ("qwen*.npz", "*.npz"):
-                found = sorted(RES_DIR.glob(pat))
-                if found:
-                    weights = found[0]
-                    break
+            weights = find_weights()
             if not weights:
                 log("[installer] WARNING: no .npz weights found in Resources.")
             log(f"[installer] ai.py: {AI_PY.exists()}  agent.py: {AGENT_PY.exists()}  weights: {weights.name if weights else 'NONE'}")
             if missing:
                 log("[installer] WARNING: missing: " + ", ".join(missing))
 
-            self.progress.emit(100, "Installation complete.")
+            self._stage(100, "Installation complete.")
             self.done.emit(True, "Done.")
         except Exception as e:
             log(f"[installer] ERROR: {e}")
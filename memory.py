@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+Long-term memory for Amber.
+Finished chat turns are embedded on the CPU and kept in a local store, so what the user
+said in earlier (or other) conversations can come back into the prompt without keeping
+the whole history in context:
+  ~/Library/Caches/AgentF/memory/vectors.f16   contiguous float16 matrix, one row per memory
+  ~/Library/Caches/AgentF/memory/memory.db     SQLite side-table: id (= row + 1), time, session, text
+The store is opt-in (`ai.py --memory`). Retrieval embeds the query and scores every row,
+then takes the top k with argpartition. NumPy (no BLAS path for float16) scores an int8
+copy, one scale per row, in blocks through BLAS and re-scores the best candidates exactly
+from the float16 file, which it maps rather than loads. At 1M x 384 that is ~0.5 GB resident where a float32
+copy took 1.5 GB, and ~165ms a query on one x86 core (~140ms with the float32 copy):
+NumPy does not get 1M rows under 10ms. AMBER_MEMORY_INDEX=mlx keeps the float16 matrix
+in unified memory and does the product on the GPU instead; that path has not been
+measured yet, so it is not the default.
+Hits are prepended to the user's message for that turn only and never enter the
+conversation history.
+
+Embedders (AMBER_MEMORY_EMBEDDER):
+  - a sentence-transformers model id (default all-MiniLM-L6-v2), run with transformers on CPU;
+    only loaded from the local cache, feature hashing stands in until it is downloaded
+  - "hash" / "hash-<dim>": word and bigram feature hashing, no download (tests, fallback)
+"""
+import os
+import re
+import time
+import zlib
+import sqlite3
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import models
+from engine import CACHE_DIR
+
+# --- CONFIGURATION ---
+MEMORY_DIR = os.environ.get("AMBER_MEMORY", os.path.join(CACHE_DIR, "memory"))
+EMBEDDER = os.environ.get("AMBER_MEMORY_EMBEDDER", "sentence-transformers/all-MiniLM-L6-v2")
+INDEX = os.environ.get("AMBER_MEMORY_INDEX", "numpy").lower()   # "mlx": the unmeasured GPU index
+TOP_K = 4                    # memories injected per turn
+MIN_SCORE = 0.35             # cosine similarity below this is not worth the prompt tokens (MiniLM)
+HASH_MIN_SCORE = 0.2         # the same for feature hashing, which only sees shared words
+SNIPPET_CHARS = 600          # per side of a remembered exchange
+HASH_DIM = 384
+EMBED_BATCH = 64
+SCORE_BLOCK = 16384          # int8 rows widened to float32 per product (24 MB of scratch at 384)
+RESCORE = 8                  # candidates re-scored exactly per result
+READY_WAIT = 1.0             # seconds a search waits for the store to finish opening
+
+WORD_RE = re.compile(r"[a-z0-9']+")
+
+# One retrieved memory
+Memory = namedtuple("Memory", "id score ts session text")
+
+
+# --- EMBEDDERS ---
+def _normalize(vecs):
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    return vecs / np.maximum(norms, 1e-9)
+
+class HashEmbedder:
+    """Signed feature hashing of words and word pairs. Deterministic, instant, no weights."""
+    min_score = HASH_MIN_SCORE
+
+    def __init__(self, dim=HASH_DIM):
+        self.dim = dim
+        self.name = f"hash-{dim}"
+
+    def embed(self, texts):
+        out = np.zeros((len(texts), self.dim), np.float32)
+        for i, text in enumerate(texts):
+            words = WORD_RE.findall(text.lower())
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                h = zlib.crc32(feature.encode("utf-8"))
+                out[i, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return _normalize(out)
+
+class TransformerEmbedder:
+    """Mean-pooled sentence embeddings from a small encoder on CPU."""
+    min_score = MIN_SCORE
+
+    def __init__(self, repo, path=None):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+        self.torch = torch
+        path = path or repo
+        self.tokenizer = AutoTokenizer.from_pretrained(path)
+        self.model = AutoModel.from_pretrained(path).eval()
+        self.dim = self.model.config.hidden_size
+        self.name = repo
+
+    def embed(self, texts):
+        with self.torch.inference_mode():
+            batch = self.tokenizer(list(texts), padding=True, truncation=True, max_length=256,
+                                   return_tensors="pt")
+            hidden = self.model(**batch).last_hidden_state
+            mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(1) / mask.sum(1).clamp(min=1e-9)
+        return _normalize(pooled.float().numpy())
+
+def make_embedder(spec=EMBEDDER):
+    if not spec or spec.startswith("hash"):
+        dim = spec.partition("-")[2] if spec else ""
+        return HashEmbedder(int(dim) if dim.isdigit() else HASH_DIM)
+    # Never from the hub: opening the store must not wait on (or fail without) the network
+    path = models.find_snapshot(spec)
+    if path is None:
+        print(f"🔹 Memory: {spec} is not downloaded (huggingface-cli download {spec}); "
+              f"using feature hashing until it is")
+        return HashEmbedder()
+    try:
+        return TransformerEmbedder(spec, path)
+    except Exception as e:
+        print(f"⚠️  Embedding model {spec} unavailable ({e}); memory uses feature hashing")
+        return HashEmbedder()
+
+
+# --- INDEXES ---
+class NumpyIndex:
+    """
+    int8 codes scored in blocks through BLAS; the top candidates are re-scored exactly
+    from the float16 rows of `vec_path` (memory-mapped), or of a float16 copy without one.
+    """
+    def __init__(self, dim, vec_path=None):
+        stored = os.path.getsize(vec_path) // (2 * dim) if vec_path and os.path.exists(vec_path) else 0
+        size = max(1024, stored)          # opening a large store doesn't grow (and copy) its way up
+        self.codes = np.empty((size, dim), np.int8)
+        self.scale = np.empty(size, np.float32)
+        self.vec_path = vec_path
+        self.rows = None if vec_path else np.empty((size, dim), np.float16)
+        self.n = 0
+
+    def extend(self, rows):
+        rows = np.asarray(rows, np.float32)
+        need = self.n + len(rows)
+        if need > len(self.codes):
+            size = max(need, 2 * len(self.codes))
+            self.codes = _grown(self.codes, self.n, size)
+            self.scale = _grown(self.scale, self.n, size)
+            if self.vec_path is None: self.rows = _grown(self.rows, self.n, size)
+        peak = np.abs(rows).max(axis=1) if len(rows) else np.empty(0, np.float32)
+        self.scale[self.n:need] = peak / 127
+        self.codes[self.n:need] = np.rint(rows * (127 / np.maximum(peak, 1e-9))[:, None])
+        if self.vec_path is None:
+            self.rows[self.n:need] = rows
+        elif self.rows is not None and len(self.rows) < need:
+            self.rows = None          # remapped on the next query
+        self.n = need
+
+    def _exact(self, idx):
+        if self.rows is None:
+            self.rows = np.memmap(self.vec_path, np.float16, "r", shape=(self.n, self.codes.shape[1]))
+        return self.rows[idx].astype(np.float32)
+
+    def top(self, q, k):
+        """(rows, scores) of the k best rows, unordered."""
+        k = min(k, self.n)
+        if k == 0: return np.empty(0, np.int64), np.empty(0, np.float32)
+        q = q.astype(np.float32)
+        approx = np.empty(self.n, np.float32)
+        for start in range(0, self.n, SCORE_BLOCK):
+            end = min(start + SCORE_BLOCK, self.n)
+            approx[start:end] = self.codes[start:end].astype(np.float32) @ q
+        approx *= self.scale[:self.n]
+        c = min(self.n, k * RESCORE)
+        cand = np.sort(np.argpartition(-approx, c - 1)[:c])
+        scores = self._exact(cand) @ q
+        best = np.argpartition(-scores, k - 1)[:k]
+        return cand[best], scores[best]
+
+class MLXIndex:
+    """
+    float16 matrix in unified memory; the product runs on the GPU. MLX streams belong to
+    the thread that created them, so every MLX call runs on the index's own thread.
+    """
+    def __init__(self, dim, vec_path=None):
+        import mlx.core as mx
+        self.mx = mx
+        self._thread = ThreadPoolExecutor(max_workers=1)
+        self.mat = self._thread.submit(mx.zeros, (0, dim), dtype=mx.float16).result()
+        self.pending = []     # rows added since the last query, uploaded in one go
+        self.n = 0
+
+    def extend(self, rows):
+        self.pending.append(np.asarray(rows, np.float16))
+        self.n += len(rows)
+
+    def top(self, q, k):
+        return self._thread.submit(self._top, q, k).result()
+
+    def _top(self, q, k):
+        mx = self.mx
+        if self.pending:
+            self.mat = mx.concatenate([self.mat, mx.array(np.concatenate(self.pending))])
+            self.pending = []
+        k = min(k, self.n)
+        if k == 0: return np.empty(0, np.int64), np.empty(0, np.float32)
+        scores = self.mat @ mx.array(q.astype(np.float16))
+        idx = mx.argpartition(-scores, k - 1)[:k]
+        return np.array(idx), np.array(scores[idx].astype(mx.float32))
+
+def make_index(dim, vec_path=None):
+    """NumpyIndex; MLXIndex only when asked for (AMBER_MEMORY_INDEX=mlx) until it is measured."""
+    if INDEX == "mlx":
+        try:
+            return MLXIndex(dim, vec_path)
+        except Exception as e:
+            print(f"⚠️  MLX memory index unavailable ({e}); using NumPy")
+    return NumpyIndex(dim, vec_path)
+
+
+# --- STORE ---
+class MemoryStore:
+    """
+    Append-only memory. The embedder, layout check and index load run on a background
+    thread at open; a search that comes too early waits at most READY_WAIT seconds and
+    then returns nothing rather than hold up the turn.
+    """
+    def __init__(self, root=MEMORY_DIR, embedder=None, index_factory=make_index):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.vec_path = os.path.join(root, "vectors.f16")
+        self._db = sqlite3.connect(os.path.join(root, "memory.db"), check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS memories (id INTEGER PRIMARY KEY, ts REAL, "
+                         "session TEXT, text TEXT, deleted INTEGER DEFAULT 0)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1)  # embedding and writes, off the request path
+        self.embedder = embedder
+        self.index = None
+        self._index_factory = index_factory
+        self.ready = self._writer.submit(self._load, embedder)
+
+    # ---- loading
+    def _meta(self, key, value=None):
+        if value is None:
+            row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+            return row[0] if row else None
+        self._db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, str(value)))
+
+    def _load(self, embedder):
+        self.embedder = embedder or make_embedder()
+        dim = self.embedder.dim
+        with self._lock:
+            n_db = self._db.execute("SELECT COALESCE(MAX(id), 0) FROM memories").fetchone()[0]
+            if self._meta("embedder") not in (None, self.embedder.name) or self._meta("dim") not in (None, str(dim)):
+                self._reembed(n_db)
+            self._meta("embedder", self.embedder.name)
+            self._meta("dim", dim)
+            # A crash between the vector append and the SQLite commit leaves them out of step
+            rows = os.path.getsize(self.vec_path) // (2 * dim) if os.path.exists(self.vec_path) else 0
+            n = min(rows, n_db)
+            if rows != n:
+                with open(self.vec_path, "r+b") as f: f.truncate(n * 2 * dim)
+            if n_db != n:
+                self._db.execute("DELETE FROM memories WHERE id > ?", (n,))
+            self._db.commit()
+            self._reindex(n)
+
+    def _reembed(self, n):
+        """The embedder changed: rebuild every vector from the stored texts."""
+        print(f"🔹 Memory: re-embedding {n} entries with {self.embedder.name}")
+        with open(self.vec_path + ".tmp", "wb") as f:
+            for start in range(0, n, EMBED_BATCH):
+                rows = self._db.execute("SELECT id, text, deleted FROM memories WHERE id > ? ORDER BY id LIMIT ?",
+                                        (start, EMBED_BATCH)).fetchall()
+                vecs = self.embedder.embed([text for _, text, _ in rows])
+                vecs[[i for i, r in enumerate(rows) if r[2]]] = 0
+                f.write(vecs.astype(np.float16).tobytes())
+        os.replace(self.vec_path + ".tmp", self.vec_path)
+
+    def _reindex(self, n):
+        """A fresh index over the first n rows of the vector file, read a block at a time."""
+        dim = self.embedder.dim
+        self.index = self._index_factory(dim, self.vec_path)
+        if not n: return
+        with open(self.vec_path, "rb") as f:
+            for start in range(0, n, SCORE_BLOCK):
+                rows = min(SCORE_BLOCK, n - start)
+                self.index.extend(np.fromfile(f, np.float16, rows * dim).reshape(rows, dim))
+
+    def is_ready(self, timeout=0):
+        try:
+            self.ready.result(timeout=timeout)
+            return True
+        except Exception:
+            return False
+
+    # ---- writing
+    def add(self, texts, session=None, vectors=None):
+        """Store `texts` (embedded here unless `vectors` is given). Returns their ids."""
+        self.ready.result()
+        if vectors is None:
+            vectors = self.embedder.embed(texts)
+        vectors = np.asarray(vectors, np.float16)
+        now = time.time()
+        with self._lock:
+            first = self._db.execute("SELECT COALESCE(MAX(id), 0) FROM memories").fetchone()[0] + 1
+            with open(self.vec_path, "ab") as f:
+                f.write(vectors.tobytes())
+            ids = list(range(first, first + len(texts)))
+            self._db.executemany("INSERT INTO memories (id, ts, session, text) VALUES (?, ?, ?, ?)",
+                                 [(i, now, session, t) for i, t in zip(ids, texts)])
+            self._db.commit()
+            self.index.extend(vectors)
+        return ids
+
+    def remember(self, session, user, reply):
+        """Queue one exchange for storage (returns immediately)."""
+        text = f"User: {_clip(user)}\nAmber: {_clip(reply)}"
+        return self._writer.submit(self.add, [text], session)
+
+    def forget(self, ids):
+        """Blank the vectors and mark the rows deleted."""
+        self.ready.result()
+        dim = self.embedder.dim
+        with self._lock:
+            with open(self.vec_path, "r+b") as f:
+                for i in ids:
+                    f.seek((i - 1) * 2 * dim)
+                    f.write(bytes(2 * dim))
+            self._db.executemany("UPDATE memories SET deleted = 1 WHERE id = ?", [(i,) for i in ids])
+            self._db.commit()
+            self._reindex(self.index.n)
+
+    # ---- reading
+    def search(self, query, k=TOP_K, min_score=None, exclude_session=None, since=None):
+        """
+        Best memories for `query`, best first. Memories of `exclude_session` newer than
+        `since` are skipped (they are still in that conversation's context).
+        """
+        if not query.strip() or not self.is_ready(READY_WAIT): return []
+        return self.search_vector(self.embedder.embed([query])[0], k, min_score, exclude_session, since)
+
+    def search_vector(self, q, k=TOP_K, min_score=None, exclude_session=None, since=None):
+        if min_score is None:
+            min_score = getattr(self.embedder, "min_score", MIN_SCORE)
+        with self._lock:
+            rows, scores = self.index.top(q, k * 4)
+            order = np.argsort(-scores)
+            ranked = [(int(rows[i]) + 1, float(scores[i])) for i in order if scores[i] >= min_score]
+            if not ranked: return []
+            found = {r[0]: r for r in self._db.execute(
+                f"SELECT id, ts, session, text FROM memories WHERE deleted = 0 AND id IN "
+                f"({', '.join('?' * len(ranked))})", [i for i, _ in ranked])}
+        out = []
+        for i, score in ranked:
+            row = found.get(i)
+            if not row: continue
+            if exclude_session is not None and row[2] == exclude_session and (since is None or row[1] >= since):
+                continue
+            out.append(Memory(i, score, row[1], row[2], row[3]))
+            if len(out) == k: break
+        return out
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM memories WHERE deleted = 0").fetchone()[0]
+
+    def close(self):
+        self._writer.shutdown(wait=True)
+        self._db.close()
+
+
+# --- HELPERS ---
+def _grown(a, n, size):
+    out = np.empty((size,) + a.shape[1:], a.dtype)
+    out[:n] = a[:n]
+    return out
+
+def _clip(text, limit=SNIPPET_CHARS):
+    text = " ".join((text or "").split())
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+def format_memories(hits):
+    """Prompt block for retrieved memories."""
+    lines = ["Relevant notes from earlier conversations (use them only if they help):"]
+    for m in hits:
+        lines.append(f"- [{time.strftime('%Y-%m-%d', time.localtime(m.ts))}] {m.text}")
+    return "\n".join(lines)
+
+def open_store(path):
+    """MemoryStore at `path`; None when memory is disabled ("" / "none")."""
+    if not path or path.lower() == "none": return None
+    try:
+        return MemoryStore(path)
+    except (OSError, sqlite3.Error) as e:
+        print(f"⚠️  Memory disabled ({e})")
+        return None
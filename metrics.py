@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Per-turn inference metrics for Amber.
+Every chat turn records where its time went: queueing, prefill (with how much of the
+prompt came from the KV cache), time-to-first-token, decode speed, reasoning tokens,
+peak memory and tool dispatch latency. Turns are appended to a metrics file, JSON lines
+or SQLite depending on the extension (.jsonl / .db, .sqlite, .sqlite3), and `--stats`
+prints them after each reply.
+"""
+import os
+import json
+import sqlite3
+import threading
+
+from engine import CACHE_DIR
+
+# --- CONFIGURATION ---
+METRICS_PATH = os.environ.get("AMBER_METRICS", os.path.join(CACHE_DIR, "metrics.jsonl"))
+SQLITE_EXTS = (".db", ".sqlite", ".sqlite3")
+
+# Columns of the SQLite table; anything else goes into its `extra` JSON column
+FIELDS = ("ts", "session", "profile", "prompt_tokens", "prefill_tokens", "queue_s", "prefill_s",
+          "ttft_s", "tokens", "decode_s", "prefill_tok_s", "decode_tok_s", "thinking_tokens",
+          "draft_accepted", "peak_mem_mb", "tool_s", "cancelled")
+
+
+# --- STORAGE ---
+class MetricsLog:
+    """Append-only turn log. Safe to share between request threads."""
+    def __init__(self, path=METRICS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if path.lower().endswith(SQLITE_EXTS):
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            cols = ", ".join(f"{f} {'TEXT' if f in ('session', 'profile') else 'REAL'}" for f in FIELDS)
+            self._db.execute(f"CREATE TABLE IF NOT EXISTS turns ({cols}, extra TEXT)")
+            self._db.commit()
+
+    def append(self, record):
+        with self._lock:
+            if self._db is None:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+                return
+            extra = {k: v for k, v in record.items() if k not in FIELDS}
+            values = [record.get(f) for f in FIELDS] + [json.dumps(extra)]
+            self._db.execute(f"INSERT INTO turns VALUES ({', '.join('?' * len(values))})", values)
+            self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+
+
+def open_log(path):
+    """MetricsLog for `path`; None when metrics are disabled ("" / "none")."""
+    if not path or path.lower() == "none": return None
+    try:
+        return MetricsLog(path)
+    except (OSError, sqlite3.Error) as e:
+        print(f"⚠️  Metrics disabled ({e})")
+        return None
+
+
+# --- FORMATTING ---
+def format_turn(m):
+    """One-line summary for --stats."""
+    if m.get("cached"):
+        near = f" (near {m.get('similarity', 0):.2f})" if m.get("near") else ""
+        tool = f" · tool {m['tool_s']:.2f}s" if m.get("tool_s") is not None else ""
+        return f"📊 cached reply in {m.get('cache_s', 0) * 1000:.1f}ms{near}, {m.get('cache_age_s', 0):.0f}s old{tool}"
+    if m.get("route") == "dispatcher":
+        conf = f", confidence {m['confidence']:.2f}" if m.get("confidence") is not None else ""
+        tool = f" · tool {m['tool_s']:.2f}s" if m.get("tool_s") is not None else ""
+        return f"📊 dispatched by the small model in {m.get('dispatch_s', 0) * 1000:.0f}ms{conf}{tool}"
+    parts = [f"ttft {m.get('ttft_s', 0):.2f}s"]
+    if m.get("dispatch_s") is not None:
+        parts.append(f"dispatcher {m['dispatch_s'] * 1000:.0f}ms → chat ({m.get('escalation')})")
+    cached = m.get("prompt_tokens", 0) - m.get("prefill_tokens", 0)
+    shared = f", {m['shared_tokens']} shared" if m.get("shared_tokens") else ""
+    parts.append(f"prefill {m.get('prefill_tokens', 0)} tok ({cached} cached{shared}) @ {m.get('prefill_tok_s', 0):.0f} tok/s")
+    parts.append(f"decode {m.get('tokens', 0)} tok @ {m.get('decode_tok_s', 0):.1f} tok/s")
+    if m.get("thinking_tokens"):
+        parts.append(f"think {m['thinking_tokens']} tok")
+    if m.get("memories"):
+        parts.append(f"memory {m['memories']} hit(s) {m.get('memory_s', 0) * 1000:.1f}ms")
+    if m.get("queue_s", 0) >= 0.01:
+        parts.append(f"queued {m['queue_s']:.2f}s")
+    if m.get("peak_mem_mb"):
+        parts.append(f"peak {m['peak_mem_mb'] / 1024:.2f} GB")
+    if m.get("tool_s") is not None:
+        parts.append(f"tool {m['tool_s']:.2f}s")
+    return "📊 " + " · ".join(parts)
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Model variants for Amber.
+A manifest can list several builds of the model, e.g.
+  "variants": [{"name": "8B-4bit",   "repo": "Qwen/Qwen3-8B-MLX-4bit",   "size_gb": 4.6},
+               {"name": "4B-4bit",   "repo": "Qwen/Qwen3-4B-MLX-4bit",   "size_gb": 2.3},
+               {"name": "1.7B-4bit", "repo": "Qwen/Qwen3-1.7B-MLX-4bit", "size_gb": 1.0,
+                "draft_repo": "none"}]
+At startup the loader measures the memory the system can still hand out and takes the
+largest variant whose weights, draft model, KV-cache allowance (`kv_reserve_gb`) and
+shared-prefix trees (`prefix_cache_mb`, one per loaded model) leave
+`memory_headroom_gb` free for everything else (QtWebEngine windows, the browser). Fields a
+variant sets (repo, precision, draft_repo, ...) override the top-level manifest fields.
+Manifests without `variants` load their single `repo` as before.
+
+Local weights (manifest v2): `ai.py models pin` resolves every repo the manifest names to
+its local snapshot and records the path, size and SHA-256 of each file under `local`:
+  "manifest_version": 2,
+  "local": {"Qwen/Qwen3-8B-MLX-4bit": {"path": ".../snapshots/<rev>", "revision": "<rev>",
+                                       "files": {"model.safetensors": {"size": 4620000000, "sha256": "..."}}}}
+Startup then loads straight from those directories (existence and size checked, no hashing)
+and only falls back to the Hugging Face hub when a file is missing or has the wrong size.
+`ai.py models verify` hashes every shard in parallel against the manifest.
+"""
+import os
+import re
+import sys
+import json
+import hashlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# --- CONFIGURATION ---
+MEMORY_HEADROOM_GB = float(os.environ.get("AMBER_MEMORY_HEADROOM", 2.0))  # kept free for the system
+KV_RESERVE_GB = 1.0          # KV caches and activations on top of the weights
+PREFIX_CACHE_MB = 256        # shared-prefix tree per loaded model (see prefixcache.py)
+PARAMS_RE = re.compile(r"(\d+(?:\.\d+)?)B(?![a-z])", re.IGNORECASE)
+BITS_RE = re.compile(r"(\d+)\s*-?bit", re.IGNORECASE)
+GB = 2**30
+MANIFEST_VERSION = 2
+HF_CACHE = os.environ.get("HF_HUB_CACHE") or os.path.join(
+    os.environ.get("HF_HOME", os.path.join(os.path.expanduser("~"), ".cache", "huggingface")), "hub")
+HASH_CHUNK = 8 * 2**20
+VERIFY_WORKERS = min(8, os.cpu_count() or 1)
+
+
+# --- MEMORY PROBE ---
+def available_memory():
+    """Bytes the system can give us without swapping, or None if it can't be measured."""
+    try:
+        import psutil
+        return int(psutil.virtual_memory().available)
+    except Exception:
+        pass
+    if sys.platform == "darwin":
+        return _vm_stat_available()
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def _vm_stat_available():
+    """Free + inactive + speculative + purgeable pages: what macOS reclaims before swapping."""
+    try:
+        out = subprocess.run(["vm_stat"], capture_output=True, text=True, timeout=2).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    m = re.search(r"page size of (\d+) bytes", out)
+    page = int(m.group(1)) if m else 4096
+    pages = 0
+    for key in ("Pages free", "Pages inactive", "Pages speculative", "Pages purgeable"):
+        m = re.search(rf"^{key}:\s+(\d+)", out, re.MULTILINE)
+        if m: pages += int(m.group(1))
+    return pages * page if pages else None
+
+
+# --- SIZES ---
+def estimate_bytes(repo, precision=None, size_gb=None):
+    """Weight bytes: the manifest's `size_gb`, else parameters x bits from the names (+10%)."""
+    if size_gb is not None:
+        return int(float(size_gb) * GB)
+    m = PARAMS_RE.search(repo or "")
+    if not m: return None
+    bits = BITS_RE.search(f"{precision or ''} {repo}")
+    bits = int(bits.group(1)) if bits else 16
+    return int(float(m.group(1)) * 1e9 * bits / 8 * 1.1)
+
+def _dispatcher_repo(meta):
+    d = meta.get("dispatcher")
+    repo = d.get("repo") if isinstance(d, dict) else d
+    return repo if repo and str(repo).lower() != "none" and repo != meta.get("repo") else None
+
+def required_bytes(meta, use_draft=True):
+    """Weights + draft + KV allowance + prefix trees for an (already merged) manifest; None if unknown."""
+    weights = estimate_bytes(meta.get("repo"), meta.get("precision"), meta.get("size_gb"))
+    if weights is None: return None
+    draft = meta.get("draft_repo")
+    if use_draft and draft:
+        weights += estimate_bytes(draft, meta.get("precision"), meta.get("draft_size_gb")) or 0
+    dispatcher = _dispatcher_repo(meta)
+    if dispatcher and not (use_draft and dispatcher == draft):   # a draft dispatcher shares its weights
+        weights += estimate_bytes(dispatcher, meta.get("precision"), meta.get("dispatcher_size_gb")) or 0
+    # The dispatcher gets its own tree even when it shares the draft's weights
+    trees = float(meta.get("prefix_cache_mb", PREFIX_CACHE_MB)) * 2**20 * (2 if dispatcher else 1)
+    return weights + int(float(meta.get("kv_reserve_gb", KV_RESERVE_GB)) * GB) + int(trees)
+
+
+# --- SELECTION ---
+def merge_variant(meta, variant):
+    """Manifest with `variant`'s fields applied; draft_repo "none" disables the draft."""
+    out = {k: v for k, v in meta.items() if k != "variants"}
+    out.update({k: v for k, v in variant.items() if k != "name"})
+    out["variant"] = variant_name(variant)
+    if str(out.get("draft_repo", "")).lower() in ("", "none"):
+        out.pop("draft_repo", None)
+        out.pop("draft_size_gb", None)
+    return out
+
+def variant_name(variant):
+    return variant.get("name") or (variant.get("repo") or "?").rsplit("/", 1)[-1]
+
+def choose_variant(meta, available=None, headroom_gb=None, use_draft=True, name=None):
+    """
+    (merged manifest, reason). `name` forces a variant (by name or repo). Otherwise the
+    largest variant that fits `available - headroom`; the smallest one if none does.
+    """
+    variants = [v for v in (meta.get("variants") or []) if v.get("repo")]
+    if not variants:
+        return meta, None
+    if name:
+        for v in variants:
+            if name in (variant_name(v), v["repo"]):
+                return merge_variant(meta, v), "requested with --variant"
+        raise ValueError(f"Unknown model variant '{name}' (manifest has: "
+                         f"{', '.join(variant_name(v) for v in variants)})")
+
+    headroom = float(meta.get("memory_headroom_gb", MEMORY_HEADROOM_GB) if headroom_gb is None else headroom_gb)
+    candidates = [merge_variant(meta, v) for v in variants]
+    sized = sorted(((required_bytes(c, use_draft) or 0, c) for c in candidates), key=lambda p: p[0], reverse=True)
+    if available is None:
+        need, pick = sized[0]
+        return pick, "available memory unknown, using the largest variant"
+
+    budget = available - headroom * GB
+    skipped = []
+    for need, pick in sized:
+        if need <= budget:
+            reason = f"needs {need / GB:.1f} GB, {available / GB:.1f} GB available, {headroom:g} GB headroom"
+            if skipped: reason += f"; skipped {', '.join(skipped)}"
+            return pick, reason
+        skipped.append(f"{pick['variant']} ({need / GB:.1f} GB)")
+    need, pick = sized[-1]
+    return pick, (f"nothing fits {available / GB:.1f} GB available with {headroom:g} GB headroom; "
+                  f"using the smallest ({need / GB:.1f} GB)")
+
+
+# --- LOCAL WEIGHTS (manifest v2) ---
+def manifest_repos(meta):
+    """Every repo a manifest may load: the model, its draft, its dispatcher and each variant's."""
+    repos = [meta.get("repo"), meta.get("draft_repo"), _dispatcher_repo(meta)]
+    for v in meta.get("variants") or []:
+        repos += [v.get("repo"), v.get("draft_repo", meta.get("draft_repo")), _dispatcher_repo({**meta, **v})]
+    out = []
+    for r in repos:
+        if r and str(r).lower() != "none" and r not in out: out.append(r)
+    return out
+
+def find_snapshot(repo, download=False, revision=None):
+    """Local directory holding `repo` (a path, or a Hugging Face cache snapshot), or None."""
+    if os.path.isdir(repo):
+        return os.path.abspath(repo)
+    try:
+        from huggingface_hub import snapshot_download
+        return snapshot_download(repo, revision=revision, local_files_only=not download)
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    # No huggingface_hub: read the cache layout directly (models--org--name/refs/main)
+    base = os.path.join(HF_CACHE, "models--" + repo.replace("/", "--"))
+    rev = revision
+    try:
+        if rev is None:
+            with open(os.path.join(base, "refs", "main"), "r") as f:
+                rev = f.read().strip()
+    except OSError:
+        return None
+    path = os.path.join(base, "snapshots", rev)
+    return path if os.path.isdir(path) else None
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _walk(root):
+    for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+        dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+        for name in filenames:
+            if not name.startswith("."):
+                yield os.path.relpath(os.path.join(dirpath, name), root)
+
+def pin(repo, download=False, workers=VERIFY_WORKERS):
+    """Manifest `local` entry for `repo`: path, revision and size + SHA-256 per file; None if absent."""
+    path = find_snapshot(repo, download=download)
+    if not path: return None
+    names = sorted(_walk(path))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        hashes = list(pool.map(lambda n: file_sha256(os.path.join(path, n)), names))
+    return {"path": path, "revision": os.path.basename(path),
+            "files": {n: {"size": os.path.getsize(os.path.join(path, n)), "sha256": h}
+                      for n, h in zip(names, hashes)}}
+
+def quick_check(entry):
+    """Problems found without hashing: missing files or wrong sizes ([] means usable)."""
+    problems = []
+    for name, info in (entry.get("files") or {}).items():
+        try:
+            size = os.path.getsize(os.path.join(entry["path"], name))
+        except OSError:
+            problems.append(f"{name} missing")
+            continue
+        if size != info.get("size"):
+            problems.append(f"{name} is {size} bytes, expected {info.get('size')}")
+    return problems
+
+def verify(entry, workers=VERIFY_WORKERS):
+    """[(file, "ok" | "missing" | "size" | "hash")] with every shard hashed in parallel."""
+    def check(item):
+        name, info = item
+        path = os.path.join(entry["path"], name)
+        if not os.path.exists(path): return name, "missing"
+        if os.path.getsize(path) != info.get("size"): return name, "size"
+        return name, "ok" if file_sha256(path) == info.get("sha256") else "hash"
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(check, sorted((entry.get("files") or {}).items())))
+
+def localize(meta):
+    """
+    Points the backends at local copies: sets `repo_path` / `draft_path` when the pinned
+    files are all present with the right sizes. Otherwise the repo id is left to the hub.
+    """
+    local = meta.get("local") or {}
+    for key, field in (("repo", "repo_path"), ("draft_repo", "draft_path")):
+        repo = meta.get(key)
+        entry = local.get(repo) if repo else None
+        if not entry: continue
+        if not os.path.isdir(entry.get("path") or ""):
+            # Pinned on another machine (or prefetched by the installer): same revision, local cache
+            entry = {**entry, "path": find_snapshot(repo, revision=entry.get("revision")) or entry.get("path", "")}
+        problems = quick_check(entry)
+        if problems:
+            print(f"⚠️  Local copy of {repo} unusable ({problems[0]}"
+                  f"{f' +{len(problems) - 1} more' if len(problems) > 1 else ''}); resolving from the hub")
+        else:
+            meta[field] = entry["path"]
+    return meta
+
+def read_manifest(path):
+    """Manifest dict from an .npz without numpy (the installer runs before the venv exists)."""
+    import struct
+    import zipfile
+    with zipfile.ZipFile(path) as z:
+        if "meta_json.npy" not in z.namelist():
+            return {"repo": path}
+        raw = z.read("meta_json.npy")
+    # .npy: magic (6) + version (2) + header length (2 bytes in v1, 4 after) + header + data
+    fmt, start = ("<H", 10) if raw[6] == 1 else ("<I", 12)
+    header_len = struct.unpack(fmt, raw[8:start])[0]
+    return json.loads(raw[start + header_len:].rstrip(b"\0").decode("utf-8"))
+
+def write_manifest(path, meta):
+    """Rewrites an .npz manifest in place (atomically)."""
+    import numpy as np
+    tmp = f"{path}.tmp.npz"
+    np.savez(tmp, meta_json=json.dumps(meta).encode("utf-8"))
+    os.replace(tmp, path)
@@ -15,8 +15,30 @@ OUT="${4:-qwen.npz}"                      # output filename
 # Optional env vars (kept for backward compatibility)
 PROMPT_TMPL="${PROMPT_TMPL:-You: {user}\nAI: }"
 PREAMBLE="${PREAMBLE:-You: Hello\nAI: }"
-ENABLE_THINKING="${ENABLE_THINKING:-false}"   # "true" or "false"
+ENABLE_THINKING="${ENABLE_THINKING:-false}"   # "true" or "false" (chat turns; tool dispatches never think)
+MAX_THINKING_TOKENS="${MAX_THINKING_TOKENS:-1024}"  # hard cap per <think> block
 SYSTEM_PROMPT="${SYSTEM_PROMPT:-You are a helpful assistant.}"
+DRAFT_REPO="${DRAFT_REPO:-Qwen/Qwen3-0.6B-MLX-4bit}"   # speculative-decoding draft ("none" to disable)
+NUM_DRAFT_TOKENS="${NUM_DRAFT_TOKENS:-3}"               # tokens proposed per verification step
+# Small model answering tool dispatches ("none" to disable); the draft model's weights are reused
+DISPATCHER_REPO="${DISPATCHER_REPO:-$DRAFT_REPO}"
+DISPATCHER_MIN_CONFIDENCE="${DISPATCHER_MIN_CONFIDENCE:-0.6}"   # below this, the chat model answers
+# Model variants, largest first: name=repo[@size_gb][+nodraft]. At startup ai.py picks the largest
+# one that fits in free memory minus MEMORY_HEADROOM_GB ("" = only REPO)
+VARIANTS="${VARIANTS-8B-4bit=Qwen/Qwen3-8B-MLX-4bit@4.6,4B-4bit=Qwen/Qwen3-4B-MLX-4bit@2.3,1.7B-4bit=Qwen/Qwen3-1.7B-MLX-4bit@1.0+nodraft}"
+MEMORY_HEADROOM_GB="${MEMORY_HEADROOM_GB:-2}"
+PIN_LOCAL="${PIN_LOCAL:-1}"     # record local snapshot paths, sizes and hashes (manifest v2)
+DOWNLOAD="${DOWNLOAD:-0}"       # 1 = fetch repos missing from the local cache while pinning
+# Chat profile sampling (tool calls are always greedy with a short budget; see profiles.py)
+TEMPERATURE="${TEMPERATURE:-0.6}"
+TOP_P="${TOP_P:-0.95}"
+TOP_K="${TOP_K:-20}"
+MAX_TOKENS="${MAX_TOKENS:-1024}"
+TOOL_MAX_TOKENS="${TOOL_MAX_TOKENS:-128}"
+SUMMARY_MAX_TOKENS="${SUMMARY_MAX_TOKENS:-256}"
+export REPO ENGINE PRECISION OUT PROMPT_TMPL PREAMBLE ENABLE_THINKING SYSTEM_PROMPT DRAFT_REPO NUM_DRAFT_TOKENS
+export TEMPERATURE TOP_P TOP_K MAX_TOKENS TOOL_MAX_TOKENS SUMMARY_MAX_TOKENS MAX_THINKING_TOKENS
+export VARIANTS MEMORY_HEADROOM_GB DISPATCHER_REPO DISPATCHER_MIN_CONFIDENCE
 
 # --- Go to project & activate venv if present ---
 cd "$LLM_DIR"
@@ -51,6 +73,9 @@ tmpl   = sanitize_prompt_template(os.environ.get("PROMPT_TMPL", "You: {user}\nAI
 prem   = os.environ.get("PREAMBLE", "You: Hello\nAI: ")
 enable = os.environ.get("ENABLE_THINKING", "false").lower() == "true"
 sysmsg = os.environ.get("SYSTEM_PROMPT", "You are a helpful assistant.")
+draft  = os.environ.get("DRAFT_REPO", "Qwen/Qwen3-0.6B-MLX-4bit")
+ndraft = int(os.environ.get("NUM_DRAFT_TOKENS", "3"))
+env    = os.environ.get
 
 meta = {
   "type": "hf",
@@ -58,21 +83,61 @@ meta = {
   "engine": engine,
   "precision": prec,
   "enable_thinking": enable,
+  "max_thinking_tokens": int(env("MAX_THINKING_TOKENS", "1024")),
   "system_prompt": sysmsg,
   "prompt_template": tmpl,
-  "chat_preamble": prem
+  "chat_preamble": prem,
+  "profiles": {
+    "chat": {"temperature": float(env("TEMPERATURE", "0.6")), "top_p": float(env("TOP_P", "0.95")),
+             "top_k": int(env("TOP_K", "20")), "max_tokens": int(env("MAX_TOKENS", "1024")), "stop": []},
+    "tool_call": {"temperature": 0.0, "max_tokens": int(env("TOOL_MAX_TOKENS", "128")), "stop": ["\n\n"]},
+    "summary": {"temperature": 0.3, "top_p": 0.9, "top_k": 20,
+                "max_tokens": int(env("SUMMARY_MAX_TOKENS", "256")), "stop": []}
+  }
 }
+if draft and draft.lower() != "none":
+  meta["draft_repo"] = draft
+  meta["num_draft_tokens"] = ndraft
+dispatcher = env("DISPATCHER_REPO", "none")
+if dispatcher and dispatcher.lower() != "none" and dispatcher != repo:
+  meta["dispatcher"] = {"repo": dispatcher, "min_confidence": float(env("DISPATCHER_MIN_CONFIDENCE", "0.6"))}
+
+variants = []
+for spec in filter(None, (s.strip() for s in env("VARIANTS", "").split(","))):
+  name, _, rest = spec.rpartition("=")
+  rest, nodraft = (rest[:-len("+nodraft")], True) if rest.endswith("+nodraft") else (rest, False)
+  vrepo, _, size = rest.partition("@")
+  v = {"name": name or vrepo.rsplit("/", 1)[-1], "repo": vrepo}
+  if size: v["size_gb"] = float(size)
+  if nodraft: v["draft_repo"] = "none"
+  variants.append(v)
+if variants:
+  meta["variants"] = variants
+  meta["memory_headroom_gb"] = float(env("MEMORY_HEADROOM_GB", "2"))
 
 np.savez(out, meta_json=json.dumps(meta).encode("utf-8"))
 print(f"✅ wrote {out}")
 print("   repo           :", repo)
 print("   engine         :", engine)
 print("   precision      :", prec)
-print("   enable_thinking:", enable)
+print("   enable_thinking:", enable, f"(max {meta['max_thinking_tokens']} tokens)")
 print("   system_prompt  :", repr(sysmsg))
+print("   draft_repo     :", meta.get("draft_repo", "none"))
+print("   dispatcher     :", meta.get("dispatcher", {}).get("repo", "none"))
+if variants:
+  print("   variants       :", ", ".join(v["name"] for v in variants), f"(headroom {meta['memory_headroom_gb']:g} GB)")
+print("   profiles       :", ", ".join(f"{k} (max {v['max_tokens']})" for k, v in meta["profiles"].items()))
 PY
 
+# --- Pin local weights (startup then never resolves repos on the hub) ---
+if [[ "$PIN_LOCAL" == "1" && -f ai.py ]]; then
+  PIN_ARGS=(models pin --weights "$OUT")
+  [[ "$DOWNLOAD" == "1" ]] && PIN_ARGS+=(--download)
+  python3 ai.py "${PIN_ARGS[@]}" || echo "⚠️  Could not pin local weights; $OUT stays a v1 manifest (hub lookups at startup)."
+fi
+
 echo
 echo "✅ Done. Your manifest qwen.npz points to Qwen3-8B-MLX-4bit."
 echo "   Use it with ai.py like this:"
 echo "     python ai.py chat --weights qwen.npz --temperature 0.7 --top-k 20 --top-p 0.8"
+echo "   (flags override the manifest's chat profile; tool calls and summaries keep theirs)"
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Model weight prefetch for Amber (standard library only, so the installer can run it
+before the venv exists).
+Every file a manifest needs is downloaded into the Hugging Face cache layout
+(models--org--name/snapshots/<commit>/...), so `ai.py` and `ai.py models pin` find it
+without touching the network:
+  - files are split into ranged chunks fetched in parallel by a thread pool
+  - chunks land in `<file>.part` at their offset; finished chunks are logged in
+    `<file>.part.done`, so an interrupted download resumes where it stopped
+  - each file is checked against its SHA-256 (pinned manifests and LFS files) or git
+    blob id before it is moved into place
+Servers that ignore Range requests get a plain sequential download.
+
+  python prefetch.py --weights qwen.npz                      # what this machine would load
+  python prefetch.py --weights qwen.npz --all-variants
+  python prefetch.py serve ./fixtures --port 8765            # local stand-in for the hub
+  HF_ENDPOINT=http://127.0.0.1:8765 python prefetch.py --weights qwen.npz
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import models
+
+# --- CONFIGURATION ---
+ENDPOINT = os.environ.get("HF_ENDPOINT", "https://huggingface.co").rstrip("/")
+CHUNK_SIZE = 32 * 2**20      # bytes per ranged request
+WORKERS = 8                  # concurrent requests
+RETRIES = 3                  # per chunk
+TIMEOUT = 30                 # seconds per request
+
+# One file to fetch. `sha256` / `blob_id` may be None (then only the size is checked).
+FileSpec = namedtuple("FileSpec", "repo revision name size sha256 blob_id")
+
+
+class PrefetchError(Exception):
+    pass
+
+
+# --- PLANNING ---
+def _get_json(url, headers):
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=TIMEOUT) as r:
+        return json.load(r)
+
+def plan_repo(repo, entry=None, endpoint=ENDPOINT, headers=None):
+    """(commit, [FileSpec]) from a pinned manifest entry, else from the hub's file listing."""
+    if entry and entry.get("files"):
+        rev = entry.get("revision") or "main"
+        return rev, [FileSpec(repo, rev, name, info.get("size"), info.get("sha256"), None)
+                     for name, info in sorted(entry["files"].items())]
+    url = f"{endpoint}/api/models/{repo}/revision/main?blobs=true"
+    try:
+        info = _get_json(url, headers or {})
+    except (urllib.error.URLError, ValueError) as e:
+        raise PrefetchError(f"{repo}: cannot list files ({e})")
+    rev = info.get("sha") or "main"
+    specs = []
+    for s in info.get("siblings") or []:
+        lfs = s.get("lfs") or {}
+        specs.append(FileSpec(repo, rev, s["rfilename"], lfs.get("size", s.get("size")),
+                              lfs.get("sha256"), None if lfs else s.get("blobId")))
+    return rev, specs
+
+def manifest_plan(meta, all_variants=False):
+    """Repos to fetch: the variant this machine would load (+ draft), or every variant."""
+    if not all_variants:
+        meta, _ = models.choose_variant(meta, models.available_memory())
+    return models.manifest_repos(meta)
+
+
+# --- DOWNLOADING ---
+class Prefetcher:
+    """
+    fetch(repos, local) downloads into `cache_dir`. `progress(done, total, text)` is called
+    from worker threads (at most every `report_every` seconds, and at the end).
+    """
+    def __init__(self, endpoint=ENDPOINT, cache_dir=models.HF_CACHE, workers=WORKERS,
+                 chunk_size=CHUNK_SIZE, progress=None, report_every=0.5, token=None):
+        self.endpoint = endpoint.rstrip("/")
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.report_every = report_every
+        token = token or os.environ.get("HF_TOKEN")
+        self.headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self._lock = threading.Lock()
+        self.done = self.total = 0
+        self._last = 0.0
+
+    # ---- layout
+    def snapshot_dir(self, repo, rev):
+        return os.path.join(self.cache_dir, "models--" + repo.replace("/", "--"), "snapshots", rev)
+
+    def _set_ref(self, repo, rev):
+        refs = os.path.join(self.cache_dir, "models--" + repo.replace("/", "--"), "refs")
+        os.makedirs(refs, exist_ok=True)
+        with open(os.path.join(refs, "main"), "w") as f:
+            f.write(rev)
+
+    def url(self, spec):
+        return f"{self.endpoint}/{spec.repo}/resolve/{spec.revision}/{urllib.parse.quote(spec.name)}"
+
+    # ---- progress
+    def _advance(self, n, text=""):
+        with self._lock:
+            self.done += n
+            now = time.monotonic()
+            if not self.progress or (now - self._last < self.report_every and self.done < self.total):
+                return
+            self._last = now
+            done, total = self.done, self.total
+        self.progress(done, total, text)
+
+    # ---- public
+    def fetch(self, repos, local=None):
+        """Fetches every repo; returns {repo: snapshot dir}. Raises PrefetchError on failure."""
+        local = local or {}
+        plans = {repo: plan_repo(repo, local.get(repo), self.endpoint, self.headers) for repo in repos}
+        jobs = []
+        for repo, (rev, specs) in plans.items():
+            for spec in specs:
+                dest = os.path.join(self.snapshot_dir(repo, rev), spec.name)
+                if _complete(dest, spec):
+                    continue
+                jobs.append((spec, dest))
+        self.total = sum(spec.size or 0 for spec, _ in jobs)
+        self.done = sum(_part_done_bytes(dest, spec, self.chunk_size) for spec, dest in jobs)
+
+        # Every chunk of every file goes through one pool; files are checked as a whole after
+        errors = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            downloads = [self._open(spec, dest) for spec, dest in jobs]
+            tasks = {pool.submit(task): d for d in downloads for task in d.tasks}
+            for fut in as_completed(tasks):
+                try: fut.result()
+                except Exception as e: errors.setdefault(tasks[fut].dest, str(e))
+            for d in downloads: d.close()
+            checks = {pool.submit(self._finish, d): d for d in downloads if d.dest not in errors}
+            for fut in as_completed(checks):
+                try: fut.result()
+                except Exception as e: errors[checks[fut].dest] = str(e)
+        if errors:
+            raise PrefetchError("; ".join(errors.values()))
+        for repo, (rev, _) in plans.items():
+            self._set_ref(repo, rev)
+        if self.progress:
+            self.progress(self.total, self.total, "done")
+        return {repo: self.snapshot_dir(repo, rev) for repo, (rev, _) in plans.items()}
+
+    def _open(self, spec, dest):
+        """A _Download whose `tasks` fetch what is still missing of `dest`."""
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        d = _Download(spec, dest)
+        ranges = _chunks(spec.size, self.chunk_size) if spec.size else []
+        if len(ranges) < 2 or not self._accepts_ranges(spec):
+            d.tasks = [lambda: self._stream(spec, d.part)]
+            return d
+        finished = _read_done(d.log)
+        d.file = open(d.part, "r+b" if os.path.exists(d.part) else "wb")
+        d.file.truncate(spec.size)
+
+        def get(i):
+            start, end = ranges[i]
+            data = self._get_range(spec, start, end)
+            os.pwrite(d.file.fileno(), data, start)
+            with d.lock, open(d.log, "a") as f:
+                f.write(f"{i}\n")
+            self._advance(len(data), spec.name)
+
+        d.tasks = [lambda i=i: get(i) for i in range(len(ranges)) if i not in finished]
+        return d
+
+    def _finish(self, d):
+        spec, part, log, dest = d.spec, d.part, d.log, d.dest
+        if spec.size is not None and os.path.getsize(part) != spec.size:
+            raise PrefetchError(f"{spec.name}: size {os.path.getsize(part)} != {spec.size}")
+        problem = _checksum_problem(part, spec)
+        if problem:
+            for p in (part, log):
+                try: os.remove(p)
+                except OSError: pass
+            raise PrefetchError(f"{spec.repo}/{spec.name}: {problem} (partial download discarded)")
+        os.replace(part, dest)
+        try: os.remove(log)
+        except OSError: pass
+
+    # ---- HTTP
+    def _request(self, spec, headers=None, method="GET"):
+        req = urllib.request.Request(self.url(spec), headers={**self.headers, **(headers or {})}, method=method)
+        return urllib.request.urlopen(req, timeout=TIMEOUT)
+
+    def _accepts_ranges(self, spec):
+        try:
+            with self._request(spec, {"Range": "bytes=0-0"}) as r:
+                return r.status == 206
+        except urllib.error.URLError:
+            return False
+
+    def _get_range(self, spec, start, end):
+        for attempt in range(RETRIES):
+            try:
+                with self._request(spec, {"Range": f"bytes={start}-{end - 1}"}) as r:
+                    data = r.read()
+                if r.status == 206 and len(data) == end - start:
+                    return data
+                raise PrefetchError(f"{spec.name}: bad range reply ({r.status}, {len(data)} bytes)")
+            except (urllib.error.URLError, OSError, PrefetchError) as e:
+                if attempt == RETRIES - 1:
+                    raise PrefetchError(f"{spec.repo}/{spec.name} [{start}-{end}): {e}")
+                time.sleep(0.5 * 2 ** attempt)
+
+    def _stream(self, spec, part):
+        """Sequential download for small files and servers without Range support."""
+        try:
+            with self._request(spec) as r, open(part, "wb") as f:
+                while True:
+                    block = r.read(1 << 20)
+                    if not block: break
+                    f.write(block)
+                    self._advance(len(block), spec.name)
+        except (urllib.error.URLError, OSError) as e:
+            raise PrefetchError(f"{spec.repo}/{spec.name}: {e}")
+
+
+# --- FILE HELPERS ---
+class _Download:
+    """One file in flight: `<dest>.part` plus the log of its finished chunks."""
+    def __init__(self, spec, dest):
+        self.spec, self.dest = spec, dest
+        self.part, self.log = dest + ".part", dest + ".part.done"
+        self.file = None
+        self.tasks = []
+        self.lock = threading.Lock()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+def _chunks(size, chunk_size):
+    return [(s, min(s + chunk_size, size)) for s in range(0, size, chunk_size)]
+
+def _read_done(log):
+    try:
+        with open(log, "r") as f:
+            return {int(line) for line in f if line.strip().isdigit()}
+    except OSError:
+        return set()
+
+def _part_done_bytes(dest, spec, chunk_size):
+    if not spec.size or not os.path.exists(dest + ".part"): return 0
+    ranges = _chunks(spec.size, chunk_size)
+    return sum(ranges[i][1] - ranges[i][0] for i in _read_done(dest + ".part.done") if i < len(ranges))
+
+def _complete(dest, spec):
+    """Already downloaded: present with the right size, if known (hashes are checked when written)."""
+    try:
+        size = os.path.getsize(dest)
+    except OSError:
+        return False
+    return spec.size is None or size == spec.size
+
+def _checksum_problem(path, spec):
+    if spec.sha256:
+        got = models.file_sha256(path)
+        return None if got == spec.sha256 else f"sha256 {got[:12]}… != {spec.sha256[:12]}…"
+    if spec.blob_id:
+        h = hashlib.sha1(f"blob {os.path.getsize(path)}\0".encode())
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(models.HASH_CHUNK), b""):
+                h.update(block)
+        return None if h.hexdigest() == spec.blob_id else "git blob id mismatch"
+    return None
+
+
+# --- LOCAL HUB STAND-IN ---
+class HubStandIn(SimpleHTTPRequestHandler):
+    """
+    Serves `<root>/<org>/<name>/<file>` the way the hub does, for tests and offline mirrors:
+      GET /api/models/<org>/<name>/revision/<rev>   file listing with sizes and SHA-256
+      GET /<org>/<name>/resolve/<rev>/<file>        the file, honouring Range
+    """
+    root = "."
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        parts = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path).strip("/").split("/")
+        if parts[:2] == ["api", "models"] and len(parts) >= 4:
+            return self._listing("/".join(parts[2:4]))
+        if len(parts) >= 5 and parts[2] == "resolve":
+            return self._file(os.path.join(self.root, parts[0], parts[1], *parts[4:]))
+        self.send_error(404)
+
+    def _listing(self, repo):
+        base = os.path.join(self.root, *repo.split("/"))
+        if not os.path.isdir(base): return self.send_error(404)
+        siblings = []
+        for name in sorted(models._walk(base)):
+            path = os.path.join(base, name)
+            size = os.path.getsize(path)
+            siblings.append({"rfilename": name, "size": size,
+                             "lfs": {"sha256": models.file_sha256(path), "size": size}})
+        body = json.dumps({"id": repo, "sha": "standin", "siblings": siblings}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _file(self, path):
+        if not os.path.isfile(path): return self.send_error(404)
+        size = os.path.getsize(path)
+        start, end = 0, size
+        rng = self.headers.get("Range", "")
+        if rng.startswith("bytes="):
+            first, _, last = rng[6:].partition("-")
+            start, end = int(first or 0), min(int(last) + 1 if last else size, size)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+        with open(path, "rb") as f:
+            f.seek(start)
+            self.wfile.write(f.read(end - start))
+
+def serve(root, port=8765, host="127.0.0.1"):
+    """ThreadingHTTPServer running HubStandIn over `root` (call serve_forever / shutdown)."""
+    handler = type("Handler", (HubStandIn,), {"root": os.path.abspath(root)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+# --- CLI ---
+def main():
+    parser = argparse.ArgumentParser(description="Prefetch the model files a manifest needs")
+    parser.add_argument("cmd", nargs="?", default="fetch", choices=["fetch", "serve"])
+    parser.add_argument("root", nargs="?", default=".", help="serve: directory laid out as <org>/<name>/<file>")
+    parser.add_argument("--weights", default="qwen.npz")
+    parser.add_argument("--all-variants", action="store_true", help="Fetch every variant, not just the one that fits")
+    parser.add_argument("--endpoint", default=ENDPOINT)
+    parser.add_argument("--cache-dir", default=models.HF_CACHE)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--chunk-mb", type=float, default=CHUNK_SIZE / 2**20)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    if args.cmd == "serve":
+        server = serve(args.root, args.port)
+        print(f"🔹 Hub stand-in on http://127.0.0.1:{args.port} serving {os.path.abspath(args.root)}")
+        try: server.serve_forever()
+        except KeyboardInterrupt: pass
+        return
+
+    meta = models.read_manifest(args.weights)
+    repos = manifest_plan(meta, args.all_variants)
+    t0 = time.time()
+
+    def report(done, total, text):
+        pct = done * 100 // total if total else 100
+        sys.stdout.write(f"\r🔹 {done / 2**20:,.0f} / {total / 2**20:,.0f} MB ({pct}%) {text[:40]:<40}")
+        sys.stdout.flush()
+
+    fetcher = Prefetcher(args.endpoint, args.cache_dir, args.workers, int(args.chunk_mb * 2**20), report)
+    try:
+        paths = fetcher.fetch(repos, meta.get("local"))
+    except PrefetchError as e:
+        print(f"\n❌ {e}")
+        sys.exit(1)
+    print(f"\n✅ {len(paths)} repo(s) ready in {time.time() - t0:.1f}s")
+    for repo, path in paths.items():
+        print(f"   {repo}: {path}")
+
+
+if __name__ == "__main__":
+    main()
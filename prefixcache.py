@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Shared prefix KV cache for Amber.
+Every conversation keeps its own KV cache, yet they all open with the same system prompt
+and tool catalog, and batch jobs or repeated openers often share much more. The KV of
+recent prompts is kept in a radix tree over token ids, one tree per loaded model:
+  - each edge owns the KV segment for its run of tokens, so a prefix shared by many
+    prompts is stored once
+  - a sequence whose own cache holds less of its prompt than the tree starts from the
+    tree's copy (the segments along the matching path, joined; the match may end inside
+    an edge) and only prefills the rest
+  - finished prompts are added back; only tokens the tree doesn't have yet are copied in
+  - when the segments outgrow the budget, least recently used leaves are evicted. A lookup
+    copies the KV out, so no running sequence ever holds on to a node
+Stats report the hit ratio (prompt tokens served by the tree, out of those the sessions'
+own caches didn't already hold) and how much smaller the tree is than its cached prompts
+stored one by one. That is deduplication inside the tree only: a lookup copies the prefix
+into the session, so every session still holds its own full KV.
+"""
+import threading
+
+from engine import _common_prefix
+from models import PREFIX_CACHE_MB
+
+# --- CONFIGURATION ---
+BUDGET_MB = PREFIX_CACHE_MB   # per model; the variant fit check (models.required_bytes) counts it
+MIN_TOKENS = 32      # shorter prompts aren't worth a node
+MIN_GAIN = 16        # a lookup must beat the session's own cache by this many tokens
+
+
+class _Node:
+    __slots__ = ("tokens", "segment", "nbytes", "children", "parent", "used", "end")
+
+    def __init__(self, tokens=(), segment=None, nbytes=0, parent=None):
+        self.tokens = tokens      # the edge from the parent
+        self.segment = segment    # backend KV for exactly those tokens
+        self.nbytes = nbytes
+        self.children = {}        # first token -> child
+        self.parent = parent
+        self.used = 0             # LRU clock
+        self.end = False          # a cached prompt ends here
+
+
+class PrefixCache:
+    def __init__(self, backend, budget_mb=BUDGET_MB):
+        self.backend = backend
+        self.budget = int(budget_mb * 2**20)
+        self.root = _Node()
+        self.nbytes = 0
+        self.supported = True
+        self.lookups = self.hits = self.evictions = 0
+        self.wanted = self.hit_tokens = self.hit_bytes = 0
+        self._clock = 0
+        self._lock = threading.Lock()
+
+    def _touch(self, path):
+        self._clock += 1
+        for node in path:
+            node.used = self._clock
+
+    # ---- lookup
+    def lookup(self, tokens, have=0, limit=None):
+        """
+        (cache, n): a new cache holding the first n tokens of `tokens`, when the tree has at
+        least MIN_GAIN more of them than the `have` the caller's own cache holds. Else None.
+        """
+        limit = len(tokens) if limit is None else min(limit, len(tokens))
+        with self._lock:
+            self.lookups += 1
+            self.wanted += max(0, limit - have)
+            path, n = self._match(tokens, limit)
+            if n - have < MIN_GAIN: return None
+            cache = self.backend.join_segments([node.segment for node in path])
+            if not self.backend.trim_to(cache, n): return None   # the match ends inside the last edge
+            self._touch(path)
+            self.hits += 1
+            self.hit_tokens += n - have
+            per_token = sum(p.nbytes for p in path) / sum(len(p.tokens) for p in path)
+            self.hit_bytes += int(per_token * (n - have))
+        return cache, n
+
+    def _match(self, tokens, limit):
+        """Nodes whose edges cover the longest match (the last may only partly match) and its length."""
+        node, pos, path = self.root, 0, []
+        while pos < limit:
+            child = node.children.get(tokens[pos])
+            if child is None: break
+            m = _common_prefix(child.tokens, tokens[pos:limit])
+            path.append(child)
+            pos += m
+            if m < len(child.tokens): break
+            node = child
+        return path, pos
+
+    # ---- insertion
+    def insert(self, tokens, cache):
+        """Add the prompt `tokens` (held at the start of `cache`), copying only what is new."""
+        if not self.supported or len(tokens) < MIN_TOKENS: return
+        tokens = tuple(tokens)
+        with self._lock:
+            node, pos, path = self.root, 0, []
+            while pos < len(tokens):
+                child = node.children.get(tokens[pos])
+                if child is None:
+                    segment = self.backend.cache_segment(cache, pos, len(tokens))
+                    if segment is None:
+                        self.supported = False
+                        print("⚠️  Prefix cache: this model's KV cache can't be shared; disabled")
+                        return
+                    child = _Node(tokens[pos:], segment, self.backend.segment_bytes(segment), node)
+                    node.children[tokens[pos]] = child
+                    self.nbytes += child.nbytes
+                else:
+                    m = _common_prefix(child.tokens, tokens[pos:])
+                    if m < len(child.tokens):
+                        child = self._split(child, m)
+                path.append(child)
+                pos += len(child.tokens)
+                node = child
+            node.end = True
+            self._touch(path)
+            self._evict()
+
+    def _split(self, child, m):
+        """Cut `child`'s edge after m tokens; returns the new upper node."""
+        b = self.backend
+        whole = b.join_segments([child.segment])
+        top = _Node(child.tokens[:m], b.cache_segment(whole, 0, m), 0, child.parent)
+        top.nbytes = b.segment_bytes(top.segment)
+        rest = b.cache_segment(whole, m, len(child.tokens))
+        self.nbytes += top.nbytes + b.segment_bytes(rest) - child.nbytes
+        child.parent.children[child.tokens[0]] = top
+        child.tokens, child.segment, child.nbytes, child.parent = child.tokens[m:], rest, b.segment_bytes(rest), top
+        top.children[child.tokens[0]] = child
+        top.used = child.used
+        return top
+
+    def _evict(self):
+        """Drop least recently used leaves until the segments fit the budget."""
+        while self.nbytes > self.budget:
+            leaves = [n for n in self._nodes() if not n.children]
+            if not leaves: return
+            victim = min(leaves, key=lambda n: n.used)
+            del victim.parent.children[victim.tokens[0]]
+            self.nbytes -= victim.nbytes
+            self.evictions += 1
+
+    def _nodes(self):
+        stack = list(self.root.children.values())
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(node.children.values())
+
+    def clear(self):
+        with self._lock:
+            self.root, self.nbytes = _Node(), 0
+
+    # ---- reporting
+    def _saved_bytes(self):
+        """(cached prompts, bytes the tree saves over storing each of them whole)."""
+        order = list(self._nodes())            # parents before their children
+        below = {}
+        saved = 0
+        for node in reversed(order):
+            n = int(node.end) + sum(below[id(c)] for c in node.children.values())
+            below[id(node)] = n
+            saved += node.nbytes * max(0, n - 1)
+        return sum(below[id(c)] for c in self.root.children.values()), saved
+
+    def stats(self):
+        with self._lock:
+            nodes = sum(1 for _ in self._nodes())
+            prompts, saved = self._saved_bytes()
+        return {"hit_ratio": round(self.hit_tokens / self.wanted, 3) if self.wanted else 0.0,
+                "lookups": self.lookups, "hits": self.hits, "shared_tokens": self.hit_tokens,
+                "reused_mb": round(self.hit_bytes / 2**20, 1), "resident_mb": round(self.nbytes / 2**20, 1),
+                "dedup_mb": round(saved / 2**20, 1), "budget_mb": round(self.budget / 2**20),
+                "prompts": prompts, "nodes": nodes, "evictions": self.evictions}
+
+
+def open_prefix_cache(backend, budget_mb=BUDGET_MB):
+    """PrefixCache for `backend`; None when sharing is disabled (budget 0)."""
+    if backend is None or not budget_mb or budget_mb <= 0: return None
+    return PrefixCache(backend, budget_mb)
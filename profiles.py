@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Generation profiles for Amber.
+Each request type gets its own decoding settings from the weights manifest:
+  - "chat"      : normal conversation turns
+  - "tool_call" : dispatching a tool (short budget, greedy, stops after the JSON)
+  - "summary"   : context compaction and other digests
+The manifest's `profiles` field overrides any key of the defaults below, e.g.
+  "profiles": {"chat": {"temperature": 0.7, "max_tokens": 2048, "stop": ["\\nUser:"]}}
+Stop sequences are matched on the streamed text and are not part of the output.
+
+Reasoning: `thinking` switches the chat template's thinking mode (None = the manifest's
+`enable_thinking`) and `max_thinking_tokens` caps a <think> block; the engine closes it
+and lets the model answer once the cap is hit. route_profile() sends short tool
+dispatches ("open calculator") to the tool_call profile, which never thinks.
+"""
+import re
+from collections import namedtuple
+
+# --- CONFIGURATION ---
+SAMPLER_KEYS = ("temperature", "top_p", "top_k", "min_p", "repetition_penalty")
+MAX_THINKING_TOKENS = 1024   # default cap per <think> block
+
+DEFAULT_PROFILES = {
+    "chat":      {"temperature": 0.6, "top_p": 0.95, "top_k": 20, "max_tokens": 1024, "stop": [],
+                  "thinking": None},
+    "tool_call": {"temperature": 0.0, "max_tokens": 128, "stop": ["\n\n"], "thinking": False},
+    "summary":   {"temperature": 0.3, "top_p": 0.9, "top_k": 20, "max_tokens": 256, "stop": [],
+                  "thinking": False},
+}
+
+# Router: short imperative requests that name a tool skip reasoning entirely
+DISPATCH_MAX_WORDS = 12
+DISPATCH_VERBS = {"open", "launch", "start", "run", "close", "quit", "find", "search", "send",
+                  "email", "text", "message", "check", "show", "play", "browse", "edit"}
+REASONING_WORDS = ("why", "how", "explain", "compare", "plan", "write", "analy", "should",
+                   "difference", "debug", "prove", "think", "reason")
+
+# Resolved settings for one request. `sampling` holds only SAMPLER_KEYS.
+Profile = namedtuple("Profile", "name max_tokens stop sampling thinking max_thinking")
+
+
+# --- PROFILES ---
+class Profiles:
+    def __init__(self, meta=None):
+        meta = meta or {}
+        # Manifests written before `enable_thinking` existed keep the template's default (on)
+        self.thinking = bool(meta.get("enable_thinking", True))
+        self.max_thinking = int(meta.get("max_thinking_tokens") or MAX_THINKING_TOKENS)
+        self.table = {name: dict(values) for name, values in DEFAULT_PROFILES.items()}
+        for name, values in (meta.get("profiles") or {}).items():
+            self.table.setdefault(name, {}).update(values or {})
+
+    def names(self):
+        return sorted(self.table)
+
+    def get(self, name=None, max_tokens=None, stop=None, thinking=None, **sampling):
+        """Profile `name` (default "chat") with per-request overrides applied."""
+        values = dict(self.table.get(name or "chat") or self.table["chat"])
+        values.update({k: v for k, v in sampling.items() if v is not None})
+        if thinking is None:
+            thinking = values.get("thinking")
+        return Profile(
+            name=name or "chat",
+            max_tokens=int(max_tokens or values.get("max_tokens") or 1024),
+            stop=list(values.get("stop") or []) if stop is None else list(stop),
+            sampling={k: values[k] for k in SAMPLER_KEYS if values.get(k) is not None},
+            thinking=self.thinking if thinking is None else bool(thinking),
+            max_thinking=int(values.get("max_thinking_tokens") or self.max_thinking),
+        )
+
+
+def route_profile(content, tools=()):
+    """
+    "tool_call" for a simple dispatch (few words, a dispatch verb or a tool's name, nothing
+    that asks for reasoning), "chat" for everything else.
+    """
+    words = re.findall(r"[a-z0-9']+", (content or "").lower())
+    if not words or len(words) > DISPATCH_MAX_WORDS: return "chat"
+    if any(w.startswith(r) for w in words for r in REASONING_WORDS): return "chat"
+    names = {part for t in tools for part in re.split(r"[^a-z0-9]+", t.lower()) if len(part) > 2}
+    if words[0] in DISPATCH_VERBS or names & set(words): return "tool_call"
+    return "chat"
+
+
+# --- STOP SEQUENCES ---
+class StopMatcher:
+    """
+    Finds stop sequences in streamed text. Holds back at most (longest stop - 1)
+    characters, the most that could still turn into a match.
+    """
+    def __init__(self, stops):
+        self.stops = [s for s in stops if s]
+        self.keep = max((len(s) for s in self.stops), default=1) - 1
+        self.pending = ""
+        self.stopped = False
+
+    def feed(self, text):
+        """Returns the text that is safe to emit; sets `stopped` once a stop sequence appears."""
+        if not self.stops: return text
+        buf = self.pending + text
+        hits = [i for i in (buf.find(s) for s in self.stops) if i >= 0]
+        if hits:
+            self.stopped, self.pending = True, ""
+            return buf[:min(hits)]
+        cut = max(0, len(buf) - self.keep)
+        self.pending = buf[cut:]
+        return buf[:cut]
+
+    def flush(self):
+        """End of generation: release what was held back."""
+        out, self.pending = self.pending, ""
+        return out
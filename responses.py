@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Response cache for Amber.
+Repeated questions ("what's on my calendar", "summarize my unread email") are answered
+from a SQLite cache instead of a full generation:
+  - key: normalized prompt + scope, where the scope covers the conversation so far, the
+    profile and request overrides, the tool-set version (tool files' names, sizes and
+    mtimes) and the manifest (model, precision, profiles, system prompt)
+  - every entry has a TTL; tools can shorten it or opt out entirely through their
+    TOOL_METADATA ("cache_ttl": 600 / "cache": False)
+  - entries remember the tool outputs they were answered from. When a tool produces a
+    different output, every entry that depended on the old one is dropped, and a lookup
+    re-checks them as well, so a stale answer is never served
+  - optional near-duplicate lookup: MinHash signatures over character 3-grams with LSH
+    banding find candidates; a candidate must also have the same content words (only
+    filler words like "the", "for", "please" and spelling may differ)
+Only self-contained prompts decoded greedily (tool dispatches, or profiles a manifest sets
+to temperature 0) are cached; anything that refers back to the conversation ("do it
+again", "what about that one") always goes to the model. The cache is opt-in.
+Tool dispatches served from the cache still run the tool, so its output is always fresh.
+"""
+import os
+import re
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from engine import CACHE_DIR
+
+# --- CONFIGURATION ---
+CACHE_PATH = os.environ.get("AMBER_RESPONSE_CACHE", os.path.join(CACHE_DIR, "responses.db"))
+DEFAULT_TTL = 6 * 3600       # seconds
+NEAR_THRESHOLD = 0.85        # estimated Jaccard similarity for a near-duplicate hit
+NUM_PERM, BANDS = 64, 16     # MinHash permutations, LSH bands (4 rows each)
+SHINGLE = 3
+PURGE_EVERY = 100            # stores between sweeps of expired entries
+
+# Prompts that lean on the conversation so far can't be answered out of context
+REFERRING_WORDS = {"that", "this", "these", "those", "them", "they", "he", "she",
+                   "him", "her", "again", "above", "previous", "same", "last", "more", "else",
+                   "also", "too", "then", "one", "ones", "instead", "continue", "yes", "no", "ok"}
+FILLER_WORDS = {"a", "an", "the", "for", "of", "to", "in", "on", "at", "is", "are", "be", "do", "does",
+                "please", "can", "could", "would", "you", "me", "my", "i", "right", "now", "just", "hey"}
+TOOL_RE = re.compile(r'"tool"\s*:\s*"([^"]+)"')
+WORD_RE = re.compile(r"[a-z0-9']+")
+
+_MERSENNE = (1 << 61) - 1
+_rng = np.random.default_rng(0x5EED)
+_PERM_A = _rng.integers(1, 1 << 31, NUM_PERM, dtype=np.uint64)   # a * h + b stays below 2**64
+_PERM_B = _rng.integers(0, 1 << 31, NUM_PERM, dtype=np.uint64)
+
+# A cache hit. `similarity` is 1.0 for exact hits.
+Hit = namedtuple("Hit", "reply key near similarity age_s")
+
+
+# --- HELPERS ---
+def normalize(prompt):
+    """Case, whitespace and trailing punctuation don't change the question."""
+    text = " ".join((prompt or "").lower().replace("’", "'").split())
+    return text.rstrip(" ?!.")
+
+def self_contained(prompt):
+    words = WORD_RE.findall(normalize(prompt))
+    return bool(words) and not any(w in REFERRING_WORDS for w in words)
+
+def tool_name(reply):
+    """Tool a reply dispatches (the agent's {"tool": ...} JSON), or None."""
+    m = TOOL_RE.search(reply or "")
+    return m.group(1) if m else None
+
+def digest(*parts):
+    h = hashlib.sha256()
+    for p in parts:
+        h.update(json.dumps(p, sort_keys=True, default=str).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def toolset_version(registry):
+    """Changes whenever a tool is added, removed or edited."""
+    items = []
+    for name, entry in sorted((registry or {}).items()):
+        try:
+            st = os.stat(entry.get("path", ""))
+            items.append((name, st.st_size, int(st.st_mtime)))
+        except OSError:
+            items.append((name, None, None))
+    return digest(items)[:16]
+
+def manifest_fingerprint(meta, system_prompt=""):
+    keys = ("repo", "precision", "variant", "draft_repo", "enable_thinking", "max_thinking_tokens", "profiles")
+    return digest({k: meta.get(k) for k in keys}, system_prompt)[:16]
+
+def minhash(text):
+    """uint64 MinHash signature of the character 3-grams of `text`."""
+    text = f" {text} "
+    grams = {text[i:i + SHINGLE] for i in range(max(1, len(text) - SHINGLE + 1))}
+    h = np.array([zlib.crc32(g.encode("utf-8")) for g in grams], dtype=np.uint64)
+    return ((np.outer(h, _PERM_A) + _PERM_B) % _MERSENNE).min(axis=0)
+
+def _bands(scope, sig):
+    rows = NUM_PERM // BANDS
+    return [f"{scope}:{b}:{zlib.crc32(sig[b * rows:(b + 1) * rows].tobytes()):08x}" for b in range(BANDS)]
+
+def _guard(words):
+    """What a near-duplicate must share exactly: its content words."""
+    return {w.replace("'", "") for w in words} - FILLER_WORDS
+
+
+# --- CACHE ---
+class ResponseCache:
+    def __init__(self, path=CACHE_PATH, ttl=DEFAULT_TTL, near=False, threshold=NEAR_THRESHOLD):
+        self.path = path
+        self.ttl = ttl
+        self.near = near
+        self.threshold = threshold
+        self.hits = self.near_hits = self.misses = 0
+        self._stores = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, scope TEXT, prompt TEXT, reply TEXT,
+                                                created REAL, expires REAL, sig BLOB, hits INTEGER DEFAULT 0);
+            CREATE TABLE IF NOT EXISTS deps (key TEXT, tool TEXT, hash TEXT);
+            CREATE TABLE IF NOT EXISTS bands (band TEXT, key TEXT);
+            CREATE TABLE IF NOT EXISTS tools (tool TEXT PRIMARY KEY, hash TEXT, ts REAL);
+            CREATE INDEX IF NOT EXISTS deps_key ON deps (key);
+            CREATE INDEX IF NOT EXISTS deps_tool ON deps (tool);
+            CREATE INDEX IF NOT EXISTS bands_band ON bands (band);
+        """)
+        self._db.commit()
+
+    # ---- lookup
+    def get(self, prompt, scope):
+        """Hit for `prompt` in `scope`, or None."""
+        norm = normalize(prompt)
+        now = time.time()
+        with self._lock:
+            key = digest(scope, norm)
+            row = self._db.execute("SELECT reply, created, expires FROM entries WHERE key = ?", (key,)).fetchone()
+            if row and self._valid(key, row, now):
+                self.hits += 1
+                self._touch(key)
+                return Hit(row[0], key, False, 1.0, round(now - row[1], 1))
+            if self.near:
+                hit = self._near(norm, scope, now)
+                if hit:
+                    self.near_hits += 1
+                    self._touch(hit.key)
+                    return hit
+            self.misses += 1
+            return None
+
+    def _near(self, norm, scope, now):
+        sig = minhash(norm)
+        bands = _bands(scope, sig)
+        keys = [k for (k,) in self._db.execute(
+            f"SELECT DISTINCT key FROM bands WHERE band IN ({', '.join('?' * len(bands))})", bands)]
+        guard = _guard(WORD_RE.findall(norm))
+        best = None
+        for key in keys:
+            row = self._db.execute("SELECT reply, created, expires, sig, prompt FROM entries WHERE key = ?",
+                                   (key,)).fetchone()
+            if not row or _guard(WORD_RE.findall(row[4])) != guard: continue
+            sim = float(np.mean(np.frombuffer(row[3], dtype=np.uint64) == sig))
+            if sim >= self.threshold and (best is None or sim > best[1]) and self._valid(key, row, now):
+                best = (key, sim, row)
+        if best is None: return None
+        key, sim, row = best
+        return Hit(row[0], key, True, round(sim, 3), round(now - row[1], 1))
+
+    def _valid(self, key, row, now):
+        """Unexpired, and every tool output it was answered from is still the latest one."""
+        stale = row[2] < now or self._db.execute(
+            "SELECT 1 FROM deps d JOIN tools t ON t.tool = d.tool WHERE d.key = ? AND t.hash != d.hash LIMIT 1",
+            (key,)).fetchone()
+        if stale:
+            self._delete([key])
+            self._db.commit()
+        return not stale
+
+    def _touch(self, key):
+        self._db.execute("UPDATE entries SET hits = hits + 1 WHERE key = ?", (key,))
+        self._db.commit()
+
+    # ---- storing
+    def put(self, prompt, scope, reply, deps=None, ttl=None):
+        """Store `reply`. `deps` maps tool name -> hash of the output the reply was based on."""
+        norm = normalize(prompt)
+        now = time.time()
+        key = digest(scope, norm)
+        sig = minhash(norm)
+        with self._lock:
+            self._delete([key])
+            self._db.execute("INSERT INTO entries (key, scope, prompt, reply, created, expires, sig) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (key, scope, norm, reply, now, now + (self.ttl if ttl is None else ttl), sig.tobytes()))
+            self._db.executemany("INSERT INTO deps VALUES (?, ?, ?)", [(key, t, h) for t, h in (deps or {}).items()])
+            self._db.executemany("INSERT INTO bands VALUES (?, ?)", [(b, key) for b in _bands(scope, sig)])
+            self._stores += 1
+            if self._stores % PURGE_EVERY == 0:
+                expired = [k for (k,) in self._db.execute("SELECT key FROM entries WHERE expires < ?", (now,))]
+                self._delete(expired)
+            self._db.commit()
+        return key
+
+    # ---- invalidation
+    def tool_result(self, tool, output):
+        """
+        Record a tool's latest output. Returns its hash and drops entries answered from a
+        different output of the same tool.
+        """
+        h = digest(output)[:16]
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO tools VALUES (?, ?, ?)", (tool, h, time.time()))
+            stale = [k for (k,) in self._db.execute("SELECT DISTINCT key FROM deps WHERE tool = ? AND hash != ?",
+                                                    (tool, h))]
+            self._delete(stale)
+            self._db.commit()
+        return h
+
+    def invalidate(self, tool=None):
+        """Drop everything (or everything that depended on `tool`). Returns the count."""
+        with self._lock:
+            if tool is None:
+                keys = [k for (k,) in self._db.execute("SELECT key FROM entries")]
+            else:
+                keys = [k for (k,) in self._db.execute("SELECT DISTINCT key FROM deps WHERE tool = ?", (tool,))]
+            self._delete(keys)
+            self._db.commit()
+        return len(keys)
+
+    def _delete(self, keys):
+        for table in ("entries", "deps", "bands"):
+            self._db.executemany(f"DELETE FROM {table} WHERE key = ?", [(k,) for k in keys])
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {"entries": entries, "hits": self.hits, "near_hits": self.near_hits, "misses": self.misses}
+
+    def close(self):
+        self._db.close()
+
+
+def open_cache(path, ttl=DEFAULT_TTL, near=False):
+    """ResponseCache at `path`; None when caching is disabled ("" / "none")."""
+    if not path or path.lower() == "none": return None
+    try:
+        return ResponseCache(path, ttl=ttl, near=near)
+    except (OSError, sqlite3.Error) as e:
+        print(f"⚠️  Response cache disabled ({e})")
+        return None
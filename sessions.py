@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Persistent named conversations for Amber.
+Each session is an append-only JSON-lines log of context events (turns and rolling
+summaries, see context.ContextManager) plus, optionally, a snapshot of its KV cache saved
+next to it. Resuming replays the log and maps the snapshot back in, so a long conversation
+continues without prefilling it again.
+
+  ~/Library/Caches/AgentF/sessions/<name>.jsonl
+  ~/Library/Caches/AgentF/sessions/<name>.kv.safetensors   (extension depends on the backend)
+"""
+import os
+import re
+import json
+import glob
+import time
+
+from engine import CACHE_DIR
+
+# --- CONFIGURATION ---
+SESSIONS_DIR = os.path.join(CACHE_DIR, "sessions")
+KV_LIMIT = int(os.environ.get("AMBER_SESSIONS_KV_LIMIT", 8 * 2**30))  # bytes of KV snapshots kept
+NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$")
+SIZE_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$", re.IGNORECASE)
+
+
+# --- HELPERS ---
+def check_name(name):
+    if not NAME_RE.match(name or ""):
+        raise ValueError(f"Invalid session name '{name}' (letters, digits, '.', '_' and '-')")
+    return name
+
+def parse_size(text):
+    """'500M', '2G', '1.5GB' or plain bytes -> int."""
+    m = SIZE_RE.match(str(text))
+    if not m: raise ValueError(f"Invalid size '{text}'")
+    return int(float(m.group(1)) * 1024 ** " KMGT".index(m.group(2).upper() or " "))
+
+def _size(path):
+    try: return os.path.getsize(path)
+    except OSError: return 0
+
+
+# --- SESSION LOG ---
+class SessionLog:
+    def __init__(self, name, root=SESSIONS_DIR):
+        self.name = check_name(name)
+        self.root = root
+        self.path = os.path.join(root, f"{name}.jsonl")
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def kv_path(self, ext):
+        return os.path.join(self.root, f"{self.name}.kv{ext}")
+
+    def records(self):
+        """Logged events in order. A torn last line (crash mid-write) is ignored."""
+        if not self.exists(): return []
+        out = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    out.append(json.loads(line))
+                except ValueError:
+                    continue
+        return out
+
+    def append(self, record):
+        os.makedirs(self.root, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"ts": round(time.time(), 3), **record}) + "\n")
+
+
+# --- LISTING & PRUNING ---
+def _kv_files(root, name="*"):
+    return glob.glob(os.path.join(root, f"{name}.kv.*"))
+
+def list_sessions(root=SESSIONS_DIR):
+    """[{name, turns, log_bytes, kv_bytes, mtime}] newest first."""
+    out = []
+    for path in glob.glob(os.path.join(root, "*.jsonl")):
+        name = os.path.basename(path)[:-len(".jsonl")]
+        kv = _kv_files(root, glob.escape(name))
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            turns = sum(1 for line in f if '"type": "turn"' in line)
+        out.append({"name": name, "turns": turns, "log_bytes": _size(path),
+                    "kv_bytes": sum(_size(p) for p in kv),
+                    "mtime": max([os.path.getmtime(path)] + [os.path.getmtime(p) for p in kv])})
+    return sorted(out, key=lambda s: s["mtime"], reverse=True)
+
+def prune(root=SESSIONS_DIR, max_bytes=None, older_than_days=None, kv_only=False, keep=()):
+    """
+    Enforce limits, oldest first. KV snapshots go before logs: dropping a snapshot only
+    costs one prefill on the next resume, dropping a log loses the conversation.
+    Sessions in `keep` are never touched. Returns the removed paths.
+    """
+    removed = []
+    def remove(path):
+        try:
+            os.remove(path)
+            removed.append(path)
+        except OSError:
+            pass
+
+    sessions = [s for s in list_sessions(root) if s["name"] not in keep]
+    if older_than_days is not None and not kv_only:
+        cutoff = time.time() - older_than_days * 86400
+        for s in [s for s in sessions if s["mtime"] < cutoff]:
+            for p in _kv_files(root, glob.escape(s["name"])): remove(p)
+            remove(os.path.join(root, f"{s['name']}.jsonl"))
+            sessions.remove(s)
+
+    if max_bytes is None: return removed
+    oldest = sorted(sessions, key=lambda s: s["mtime"])
+    total = sum(s["kv_bytes"] + (0 if kv_only else s["log_bytes"]) for s in sessions)
+    for s in oldest:
+        if total <= max_bytes: break
+        if s["kv_bytes"]:
+            for p in _kv_files(root, glob.escape(s["name"])): remove(p)
+            total -= s["kv_bytes"]
+    if not kv_only:
+        for s in oldest:
+            if total <= max_bytes: break
+            remove(os.path.join(root, f"{s['name']}.jsonl"))
+            total -= s["log_bytes"]
+    return removed
@@ -22,6 +22,21 @@ RESOURCE_CANDIDATES = [
     "gui.py",
     "installer.py",
     "ai.py",
+    "engine.py",
+    "backends.py",
+    "daemon.py",
+    "context.py",
+    "profiles.py",
+    "streaming.py",
+    "metrics.py",
+    "sessions.py",
+    "models.py",
+    "prefetch.py",
+    "memory.py",
+    "responses.py",
+    "batch.py",
+    "dispatch.py",
+    "prefixcache.py",
     "agent.py",
     "agent-functions",        # contains agentf-app-launch.py + agentf-use-calc-app.py
     "apps",                   # ships apps/calculator/*
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Streaming output helpers for Amber.
+- ThinkFilter splits a token stream into answer text and <think> reasoning with a small
+  state machine. It only ever holds back a possible partial tag (at most len("</think>") - 1
+  characters), so the cost per chunk does not grow with the length of the reply.
+- FrameWriter buffers terminal output and flushes at a fixed frame rate instead of once
+  per token (one write syscall per frame).
+"""
+import sys
+import time
+
+# --- CONFIGURATION ---
+OPEN_TAG, CLOSE_TAG = "<think>", "</think>"
+FRAME_RATE = 30              # terminal flushes per second while streaming
+
+
+# --- THINK FILTER ---
+class ThinkFilter:
+    """
+    feed(chunk) -> [(kind, text), ...] with kind one of:
+      "text"        answer text
+      "think"       reasoning text
+      "think_start" / "think_end"   tag boundaries (text is "")
+    Tags split across chunks are recognised; nothing else is delayed.
+    """
+    def __init__(self):
+        self.inside = False
+        self.pending = ""      # possible partial tag carried over from the previous chunk
+
+    def feed(self, chunk):
+        out = []
+        buf = self.pending + chunk if self.pending else chunk
+        self.pending = ""
+        pos = 0
+        while pos < len(buf):
+            tag = CLOSE_TAG if self.inside else OPEN_TAG
+            kind = "think" if self.inside else "text"
+            i = buf.find(tag, pos)
+            if i >= 0:
+                if i > pos: out.append((kind, buf[pos:i]))
+                self.inside = not self.inside
+                out.append(("think_start" if self.inside else "think_end", ""))
+                pos = i + len(tag)
+                continue
+            # No complete tag: keep back only a suffix that could still become one
+            keep = _partial_tag(buf, pos, tag)
+            end = len(buf) - keep
+            if end > pos: out.append((kind, buf[pos:end]))
+            self.pending = buf[end:]
+            break
+        return out
+
+    def flush(self):
+        """End of stream: a dangling partial tag is just text."""
+        out, self.pending = self.pending, ""
+        return [("think" if self.inside else "text", out)] if out else []
+
+
+def _partial_tag(buf, start, tag):
+    """Length of the longest suffix of buf[start:] that is a proper prefix of `tag`."""
+    for n in range(min(len(tag) - 1, len(buf) - start), 0, -1):
+        if buf.endswith(tag[:n]):
+            return n
+    return 0
+
+
+# --- RENDERING ---
+class FrameWriter:
+    """Collects text and writes it out at most `fps` times per second (plus on flush())."""
+    def __init__(self, stream=None, fps=FRAME_RATE, clock=time.monotonic):
+        self.stream = stream or sys.stdout
+        self.interval = 1.0 / fps if fps else 0.0
+        self.clock = clock
+        self.parts = []
+        self.last = 0.0
+        self.frames = 0
+
+    def write(self, text):
+        if text: self.parts.append(text)
+        now = self.clock()
+        if now - self.last >= self.interval:
+            self.flush(now)
+
+    def flush(self, now=None):
+        if self.parts:
+            self.stream.write("".join(self.parts))
+            self.parts.clear()
+            self.frames += 1
+        self.stream.flush()
+        self.last = self.clock() if now is None else now
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# Caches and snapshots go to a scratch directory; the engine reads this at import time
+os.environ.setdefault("AMBER_CACHE_DIR", tempfile.mkdtemp(prefix="amber-tests-"))
+os.environ.setdefault("AMBER_MEMORY_EMBEDDER", "hash")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,12 @@
+import pytest
+
+from batch import read_inputs
+
+
+def test_read_inputs_rejects_non_objects(tmp_path):
+    path = tmp_path / "in.jsonl"
+    path.write_text('{"id": "a", "prompt": "hi"}\n"plain prompt"\n[1, 2]\n')
+    with pytest.raises(ValueError, match=r"in.jsonl:3: expected a JSON object or string"):
+        read_inputs(str(path))
+    path.write_text('{"id": "a", "prompt": "hi"}\n"plain prompt"\n')
+    assert [rid for rid, _ in read_inputs(str(path))] == ["a", "2"]
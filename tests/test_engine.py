@@ -0,0 +1,125 @@
+import threading
+
+import pytest
+
+from backends import make_backend
+from engine import BACKGROUND, INTERACTIVE, Engine, EngineThread, _Sequence
+from streaming import ThinkFilter
+
+REPLIES = [["^chat", "c" * 40], ["^work", "w" * 40]]
+
+
+@pytest.fixture
+def parked():
+    """
+    An EngineThread whose own thread is parked inside a job, so the test can step the
+    scheduler itself, one token boundary at a time.
+    """
+    made = []
+    def start(**kwargs):
+        def load(report):
+            backend = make_backend({"engine": "fake", "fake_responses": REPLIES})
+            backend.load()
+            return Engine(backend)
+        runner = EngineThread(load, **kwargs)
+        runner.loaded.result(timeout=10)
+        parked, release = threading.Event(), threading.Event()
+        runner.submit(lambda engine: (parked.set(), release.wait()))
+        assert parked.wait(timeout=10)
+        made.append((runner, release))
+        return runner
+    yield start
+    for runner, release in made:
+        runner.active.clear()
+        for pending in runner.waiting.values(): pending.clear()
+        runner.shutdown()
+        release.set()
+
+def enqueue(runner, content, priority=INTERACTIVE):
+    engine = Engine(runner.engine.backend)
+    p = engine.profiles.get("chat", thinking=False)
+    seq = _Sequence(engine, engine.tokenize_messages([{"role": "user", "content": content}], p.thinking),
+                    p, None, priority)
+    runner.waiting[priority].append(seq)
+    return seq
+
+def tick(runner, n=1):
+    for _ in range(n):
+        runner._admit()
+        runner._step()
+
+def output(seq):
+    chunks = []
+    while not seq.out.empty():
+        chunks.append(seq.out.get())
+    return "".join(c for c in chunks if isinstance(c, str))
+
+
+def test_interactive_work_preempts_background_work(parked):
+    runner = parked(max_batch=1)
+    work = enqueue(runner, "work", BACKGROUND)
+    tick(runner)
+    chat = enqueue(runner, "chat")
+    tick(runner)
+    assert runner.active == [chat] and list(runner.waiting[BACKGROUND]) == [work]
+    assert runner.load()["preemptions"] == 1 and work.n_tokens == 1
+    tick(runner, 41)                                          # 40 characters, EOS, then retired
+    assert chat not in runner.active and output(chat) == "c" * 40
+    tick(runner, 41)                                          # the paused sequence picks up where it was
+    assert output(work) == "w" * 40
+
+def test_background_steps_every_stride_while_chatting(parked):
+    runner = parked(max_batch=2, background_stride=4, starvation_steps=1000)
+    work = enqueue(runner, "work", BACKGROUND)
+    chat = enqueue(runner, "chat")
+    tick(runner, 8)
+    assert chat.n_tokens == 8 and work.n_tokens == 2
+    tick(runner, 34)                                          # 40 characters, EOS, then retired
+    assert chat not in runner.active
+    before = work.n_tokens
+    tick(runner, 4)                                           # alone in the batch it runs every step
+    assert work.n_tokens == before + 4
+
+def test_starved_background_work_is_promoted(parked):
+    runner = parked(max_batch=2, background_stride=1000, starvation_steps=5)
+    work = enqueue(runner, "work", BACKGROUND)
+    enqueue(runner, "chat")
+    tick(runner, 5)
+    assert work.priority == INTERACTIVE and work.n_tokens == 0
+    tick(runner)
+    assert work.n_tokens == 1
+
+def test_paused_background_work_is_promoted_in_the_queue(parked):
+    runner = parked(max_batch=1, starvation_steps=5)
+    work = enqueue(runner, "work", BACKGROUND)
+    tick(runner)
+    enqueue(runner, "chat")
+    tick(runner, 5)
+    assert list(runner.waiting[INTERACTIVE]) == [work] and not runner.waiting[BACKGROUND]
+
+
+def run(meta, content, **kwargs):
+    def load(report):
+        backend = make_backend({"engine": "fake", **meta})
+        backend.load()
+        return Engine(backend)
+    runner = EngineThread(load)
+    try:
+        engine = Engine(runner.loaded.result(timeout=10).backend)
+        text = "".join(runner.stream(engine, [{"role": "user", "content": content}], **kwargs))
+        return text, engine.last_turn
+    finally:
+        runner.shutdown()
+
+def test_think_block_is_closed_at_the_cap():
+    text, turn = run({"fake_think": 20, "max_thinking_tokens": 30}, "hi", thinking=True)
+    parts = ThinkFilter().feed(text)
+    assert [kind for kind, _ in parts] == ["think_start", "think", "think_end", "text"]
+    assert len(parts[1][1].strip("\n")) == 30 - 1             # the cap counts the newline after <think>
+    assert parts[3][1].strip() == "Echo: hi"
+    assert turn["thinking_tokens"] == 30
+
+def test_stop_string_across_tokens():
+    text, turn = run({"fake_responses": [["hi", "one two three"]]}, "hi", stop=["two"], thinking=False)
+    assert text == "one "                                     # every byte is its own token here
+    assert turn["tokens"] == 7
@@ -0,0 +1,26 @@
+import numpy as np
+
+import memory
+
+
+def test_numpy_index_matches_exact_search(tmp_path):
+    rng = np.random.default_rng(0)
+    store = memory.MemoryStore(str(tmp_path), memory.HashEmbedder(64), index_factory=memory.NumpyIndex)
+    vecs = rng.standard_normal((3000, 64), dtype=np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    store.add([f"memory {i}" for i in range(len(vecs))], vectors=vecs)
+    exact = vecs.astype(np.float16).astype(np.float32)
+    for q in rng.standard_normal((20, 64), dtype=np.float32):
+        q /= np.linalg.norm(q)
+        hits = store.search_vector(q, 4, min_score=-1)
+        assert [m.id - 1 for m in hits] == list(np.argsort(-(exact @ q))[:4])
+    store.close()
+
+
+def test_uncached_embedder_falls_back_to_hashing(monkeypatch):
+    monkeypatch.setattr(memory.models, "find_snapshot", lambda repo, download=False, revision=None: None)
+    assert isinstance(memory.make_embedder("org/not-downloaded"), memory.HashEmbedder)
+
+
+def test_numpy_index_is_the_default(tmp_path):
+    assert isinstance(memory.make_index(8), memory.NumpyIndex)
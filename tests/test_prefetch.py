@@ -0,0 +1,78 @@
+import os
+import threading
+
+import pytest
+
+import prefetch
+from prefetch import FileSpec, Prefetcher, PrefetchError, _complete
+
+CHUNK = 64 * 1024
+
+
+def test_complete_needs_the_file(tmp_path):
+    dest = tmp_path / "config.json"
+    unsized = FileSpec("org/model", "main", "config.json", None, None, None)
+    assert not _complete(str(dest), unsized)
+    dest.write_text("{}")
+    assert _complete(str(dest), unsized)
+    assert not _complete(str(dest), unsized._replace(size=10))
+
+
+@pytest.fixture
+def hub(tmp_path):
+    """A stand-in hub serving org/model: a 5-chunk weights file and a small config."""
+    root = tmp_path / "hub" / "org" / "model"
+    root.mkdir(parents=True)
+    weights = os.urandom(5 * CHUNK - 123)
+    (root / "model.safetensors").write_bytes(weights)
+    (root / "config.json").write_text('{"model_type": "qwen3"}')
+    server = prefetch.serve(str(tmp_path / "hub"), 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}", weights
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class CountingPrefetcher(Prefetcher):
+    """Counts ranged GETs; with `fail_after`, the connection drops once that many went through."""
+    def __init__(self, *args, fail_after=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ranges = 0
+        self.fail_after = fail_after
+
+    def _get_range(self, spec, start, end):
+        if self.fail_after is not None and self.ranges >= self.fail_after:
+            raise PrefetchError("connection dropped")
+        self.ranges += 1
+        return super()._get_range(spec, start, end)
+
+
+def test_interrupted_download_resumes(hub, tmp_path):
+    endpoint, weights = hub
+    cache = str(tmp_path / "cache")
+    first = CountingPrefetcher(endpoint, cache, workers=1, chunk_size=CHUNK, fail_after=2)
+    with pytest.raises(PrefetchError, match="connection dropped"):
+        first.fetch(["org/model"])
+    dest = os.path.join(first.snapshot_dir("org/model", "standin"), "model.safetensors")
+    assert not os.path.exists(dest)
+    assert prefetch._read_done(dest + ".part.done") == {0, 1}
+
+    second = CountingPrefetcher(endpoint, cache, workers=1, chunk_size=CHUNK)
+    snapshot = second.fetch(["org/model"])["org/model"]
+    assert second.ranges == 3                 # only the chunks the first run didn't finish
+    with open(os.path.join(snapshot, "model.safetensors"), "rb") as f:
+        assert f.read() == weights
+    assert not os.path.exists(dest + ".part") and not os.path.exists(dest + ".part.done")
+
+
+def test_checksum_mismatch_is_rejected(hub, tmp_path):
+    endpoint, weights = hub
+    pinned = {"revision": "standin",
+              "files": {"model.safetensors": {"size": len(weights), "sha256": "0" * 64}}}
+    p = Prefetcher(endpoint, str(tmp_path / "cache"), workers=2, chunk_size=CHUNK)
+    with pytest.raises(PrefetchError, match="sha256"):
+        p.fetch(["org/model"], local={"org/model": pinned})
+    dest = os.path.join(p.snapshot_dir("org/model", "standin"), "model.safetensors")
+    assert not os.path.exists(dest) and not os.path.exists(dest + ".part")
@@ -0,0 +1,62 @@
+from backends import _FakeCache, make_backend
+from prefixcache import MIN_GAIN, MIN_TOKENS, PrefixCache
+
+
+def tree(budget_bytes=10_000):
+    backend = make_backend({"engine": "fake", "fake_kv_bytes": 1})   # 1 byte per token: budgets in tokens
+    backend.load()
+    return PrefixCache(backend, budget_bytes / 2**20)
+
+def prompt(head, tail, n_tail=10):
+    return list(range(head)) + [tail] * n_tail
+
+def cache_for(tokens):
+    return _FakeCache(tokens)
+
+
+def test_shared_prefix_is_split_and_stored_once():
+    t = tree()
+    a, b = prompt(40, 1000), prompt(40, 2000)
+    t.insert(a, cache_for(a))
+    t.insert(b, cache_for(b))
+    assert t.stats()["nodes"] == 3 and t.nbytes == 60        # 40 shared + 10 + 10
+    assert t._saved_bytes() == (2, 40)
+    cache, n = t.lookup(b)
+    assert n == len(b) and cache.tokens == b
+    cache, n = t.lookup(prompt(30, 3000, 20))                 # ends inside the shared edge
+    assert n == 30 and cache.tokens == list(range(30))
+
+def test_thresholds():
+    t = tree()
+    short = list(range(MIN_TOKENS - 1))
+    t.insert(short, cache_for(short))
+    assert t.stats()["nodes"] == 0
+    a = prompt(40, 1000)
+    t.insert(a, cache_for(a))
+    assert t.lookup(a, have=len(a) - MIN_GAIN + 1) is None   # the session's own cache is nearly as good
+    cache, n = t.lookup(a, have=len(a) - MIN_GAIN)
+    assert n == len(a)
+    assert t.stats()["hit_ratio"] == round(MIN_GAIN / (2 * MIN_GAIN - 1), 3)
+
+def test_least_recently_used_leaf_is_evicted_at_the_budget():
+    t = tree(budget_bytes=100)
+    p1, p2, p3 = ([k * 100 + i for i in range(50)] for k in (1, 2, 3))
+    t.insert(p1, cache_for(p1))
+    t.insert(p2, cache_for(p2))
+    assert t.lookup(p1) is not None                           # p2 is now the oldest
+    t.insert(p3, cache_for(p3))
+    assert t.nbytes <= 100 and t.evictions == 1
+    assert t.lookup(p2) is None
+    assert t.lookup(p1) is not None and t.lookup(p3) is not None
+
+def test_lookup_copies_survive_eviction():
+    t = tree(budget_bytes=100)
+    p1 = list(range(50))
+    t.insert(p1, cache_for(p1))
+    cache, n = t.lookup(p1)
+    cache.tokens.append(7)                                    # the session keeps decoding into its copy
+    for k in (1, 2):
+        p = [k * 100 + i for i in range(50)]
+        t.insert(p, cache_for(p))
+    assert t.lookup(p1) is None
+    assert cache.tokens == p1 + [7]
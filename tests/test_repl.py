@@ -0,0 +1,60 @@
+import threading
+import time
+
+import ai
+import daemon
+from backends import make_backend
+from engine import Engine, EngineThread
+
+
+def test_fast_path_answered_behind_queued_chats(monkeypatch, capsys):
+    gate = threading.Event()
+
+    def load(report):
+        gate.wait(5)   # a hung REPL still gets the model eventually, so the test fails instead of hanging
+        backend = make_backend({"engine": "fake"})
+        backend.load()
+        return Engine(backend)
+
+    runner = EngineThread(load)
+    host = ai.AmberHost(runner, "You are Amber.", 4096)
+    typed = iter(["hello", "second", "tools"])
+    seen = {}
+
+    def fake_input(prompt=""):
+        try:
+            return next(typed)
+        except StopIteration:
+            seen["loaded"] = runner.loaded.done()
+            gate.set()
+            return "exit"
+
+    monkeypatch.setattr("builtins.input", fake_input)
+    try:
+        ai.Repl(daemon.LocalConnection(host)).run()
+    finally:
+        gate.set()
+        runner.shutdown()
+    out = capsys.readouterr().out
+    assert seen["loaded"] is False
+    assert "🔹 Tools:" in out
+    assert out.count("Echo: hello") == 1 and out.count("Echo: second") == 1
+
+
+def test_status_returns_without_waiting(capsys):
+    def load(report):
+        backend = make_backend({"engine": "fake"})
+        backend.load()
+        return Engine(backend)
+
+    runner = EngineThread(load)
+    runner.loaded.result(timeout=10)
+    repl = ai.Repl(daemon.LocalConnection(ai.AmberHost(runner, "You are Amber.", 4096)))
+    try:
+        t0 = time.perf_counter()
+        assert repl.fast_path("status")
+        assert time.perf_counter() - t0 < 1
+        assert repl.waiting == {}
+    finally:
+        runner.shutdown()
+    assert "🔹" in capsys.readouterr().out
@@ -0,0 +1,44 @@
+import threading
+
+import ai
+import responses
+from backends import make_backend
+from engine import Engine, EngineThread
+
+
+def make_host(tmp_path, profiles):
+    def load(report):
+        backend = make_backend({"engine": "fake", "profiles": profiles})
+        backend.load()
+        return Engine(backend)
+
+    runner = EngineThread(load)
+    runner.loaded.result(timeout=10)
+    cache = responses.ResponseCache(str(tmp_path / "responses.db"))
+    return runner, ai.AmberHost(runner, "You are Amber.", 4096, response_cache=cache)
+
+def ask(host, session, content):
+    events = []
+    host.chat(session, content, events.append, threading.Event())
+    return next(e for e in events if e["event"] == "metrics").get("cached", False)
+
+
+def test_same_prompt_under_different_histories_misses(tmp_path):
+    runner, host = make_host(tmp_path, {"chat": {"temperature": 0.0}})
+    try:
+        assert not ask(host, "ann", "what is my name")
+        assert ask(host, "bob", "what is my name")        # both conversations are empty so far
+        ask(host, "ann", "my name is Ann")
+        ask(host, "bob", "my name is Bob")
+        assert not ask(host, "ann", "what is my name")
+        assert not ask(host, "bob", "what is my name")
+    finally:
+        runner.shutdown()
+
+def test_sampled_replies_are_not_cached(tmp_path):
+    runner, host = make_host(tmp_path, {})
+    try:
+        assert not ask(host, "ann", "what is the capital of france")
+        assert not ask(host, "bob", "what is the capital of france")
+    finally:
+        runner.shutdown()
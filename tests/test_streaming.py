@@ -0,0 +1,54 @@
+import pytest
+
+from profiles import StopMatcher
+from streaming import ThinkFilter
+
+TEXT = "Hi <think>\nsome <b>reasoning</b>\n</think>\n\nthe answer"
+
+
+def merged(parts):
+    """Join runs of the same kind, so different chunkings compare equal."""
+    out = []
+    for kind, text in parts:
+        if out and out[-1][0] == kind and kind in ("text", "think"):
+            out[-1] = (kind, out[-1][1] + text)
+        else:
+            out.append((kind, text))
+    return out
+
+def split(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 100])
+def test_think_tags_split_across_chunks(size):
+    f = ThinkFilter()
+    parts = [p for chunk in split(TEXT, size) for p in f.feed(chunk)] + f.flush()
+    assert merged(parts) == [("text", "Hi "), ("think_start", ""), ("think", "\nsome <b>reasoning</b>\n"),
+                             ("think_end", ""), ("text", "\n\nthe answer")]
+
+def test_think_filter_holds_back_only_a_possible_tag():
+    f = ThinkFilter()
+    assert f.feed("a <thi") == [("text", "a ")]
+    assert f.feed("s is") == [("text", "<this is")]
+    assert f.feed("x </th") == [("text", "x </th")]           # outside a block only <think> is held
+    assert f.flush() == []
+    assert f.feed("<think>y </th") == [("think_start", ""), ("think", "y ")]
+    assert f.flush() == [("think", "</th")]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 4, 100])
+def test_stop_string_across_chunks(size):
+    m = StopMatcher(["\nUser:", "STOP"])
+    out = ""
+    for chunk in split("Sure.\nUse it.\nUser: more", size):
+        out += m.feed(chunk)
+        if m.stopped: break
+    assert m.stopped and out == "Sure.\nUse it."
+
+def test_stop_matcher_releases_held_text():
+    m = StopMatcher(["</tool>"])
+    assert m.feed("call </to") == "cal"                       # at most len("</tool>") - 1 held back
+    assert m.feed("day") == "l <"
+    assert not m.stopped and m.flush() == "/today"
+    assert StopMatcher([]).feed("anything") == "anything"